@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+""" Compare per-file and per-directory existence checking in intgmisc.check_files """
+
+import os
+import sys
+import time
+import argparse
+
+import intgutils.intgmisc as intgmisc
+
+
+def main():
+    """ entry point """
+
+    parser = argparse.ArgumentParser(description='Benchmark intgmisc.check_files')
+    parser.add_argument('dirs', nargs='+', help='directories whose files to check')
+    parser.add_argument('--missing', type=int, default=10,
+                        help='percent of names to make missing')
+    args = parser.parse_args(sys.argv[1:])
+
+    fullnames = []
+    for dirname in args.dirs:
+        for name in sorted(os.listdir(dirname)):
+            fullnames.append(os.path.join(dirname, name))
+    nmissing = len(fullnames) * args.missing // 100
+    for i in range(nmissing):
+        fullnames[i] += '.missing'
+
+    for (label, batch) in [('per file', False), ('by directory', True)]:
+        start = time.time()
+        (exists, missing) = intgmisc.check_files(fullnames, batch)
+        elapsed = time.time() - start
+        print(f"{label:13s}: {len(exists):8d} exist {len(missing):8d} missing  {elapsed:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+""" Compare reading plain and compressed copies of the same list file """
+
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import time
+import shutil
+import argparse
+import tempfile
+
+import intgutils.intgmisc as intgmisc
+
+COLUMNS = 'red.fullname,num,bkg.fullname'
+
+
+def read_io_counter(name):
+    """ Return given counter from /proc/self/io or None if not available """
+    try:
+        with open('/proc/self/io', 'r') as iofh:
+            for line in iofh:
+                (key, val) = line.split(':')
+                if key == name:
+                    return int(val)
+    except OSError:
+        pass
+    return None
+
+
+def main():
+    """ entry point """
+
+    parser = argparse.ArgumentParser(description='Benchmark reading compressed list files')
+    parser.add_argument('--nlines', type=int, default=1000000, help='number of lines in list')
+    args = parser.parse_args(sys.argv[1:])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        plain = os.path.join(tmpdir, 'test.list')
+        with open(plain, 'w') as listfh:
+            for i in range(args.nlines):
+                listfh.write(f"red/D{i:08d}_g_c33_r4055p01_immasked.fits.fz[0],{i},"
+                             f"bkg/D{i:08d}_g_c33_r4055p01_bkg.fits.fz\n")
+
+        listfiles = [('plain', plain)]
+        for (label, module) in [('gzip', gzip), ('bzip2', bz2), ('xz', lzma)]:
+            fname = f"{plain}.{label}"
+            with open(plain, 'rb') as infh, module.open(fname, 'wb') as outfh:
+                shutil.copyfileobj(infh, outfh)
+            listfiles.append((label, fname))
+
+        for (label, fname) in listfiles:
+            intgmisc.invalidate_list_cache()
+            startbytes = read_io_counter('rchar')
+            start = time.time()
+            intgmisc.read_fullnames_from_listfile(fname, 'textcsv', COLUMNS)
+            elapsed = time.time() - start
+            endbytes = read_io_counter('rchar')
+            nbytes = endbytes - startbytes if startbytes is not None else os.path.getsize(fname)
+            print(f"{label:6s}: {os.path.getsize(fname) / 1024 / 1024:8.2f} MiB on disk  "
+                  f"{nbytes / 1024 / 1024:8.2f} MiB read  {elapsed:8.3f} s")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+""" Compare line at a time and chunked list file reading in intgmisc """
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import despymisc.miscutils as miscutils
+import intgutils.intgmisc as intgmisc
+
+COLUMNS = 'red.fullname,num,bkg.fullname'
+
+
+def write_list(listfile, nlines):
+    """ Write a textcsv list with two fullname columns """
+    with open(listfile, 'w') as listfh:
+        for i in range(nlines):
+            listfh.write(f"red/D{i:08d}_g_c33_r4055p01_immasked.fits.fz[0],{i},"
+                         f"bkg/D{i:08d}_g_c33_r4055p01_bkg.fits.fz\n")
+
+
+def read_by_line(listfile):
+    """ Read list parsing every cell separately """
+    pos2fsect = intgmisc.get_list_fullname_columns(COLUMNS)
+    fullnames = {fsect: [] for fsect in pos2fsect.values()}
+    with open(listfile, 'r') as listfh:
+        for line in listfh:
+            lineinfo = miscutils.fwsplit(line.strip(), ',')
+            for pos, fsect in pos2fsect.items():
+                fullnames[fsect].append(intgmisc.parse_list_fullname(lineinfo[pos]))
+    return fullnames
+
+
+def read_by_row(listfile):
+    """ Read list with the generator interface """
+    return list(intgmisc.iter_listfile_fullnames(listfile, 'textcsv', COLUMNS))
+
+
+def main():
+    """ entry point """
+
+    parser = argparse.ArgumentParser(description='Benchmark list file reading')
+    parser.add_argument('--nlines', type=int, default=1000000, help='number of lines in list')
+    args = parser.parse_args(sys.argv[1:])
+
+    (fd, listfile) = tempfile.mkstemp(suffix='.list')
+    os.close(fd)
+    try:
+        write_list(listfile, args.nlines)
+        for (label, func) in [('line at a time', read_by_line),
+                              ('chunked columns', lambda fname: intgmisc.read_listfile_columns(fname, 'textcsv', COLUMNS)),
+                              ('chunked rows', read_by_row)]:
+            start = time.time()
+            func(listfile)
+            elapsed = time.time() - start
+            print(f"{label:15s}: {elapsed:8.3f} s  {args.nlines / elapsed:10.0f} lines/s")
+    finally:
+        os.unlink(listfile)
+
+
+if __name__ == "__main__":
+    main()
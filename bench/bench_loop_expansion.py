@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+""" Benchmark memory and throughput of $LOOP expansion in replace_vars """
+
+import re
+import sys
+import copy
+import time
+import argparse
+import tracemalloc
+
+import despymisc.miscutils as miscutils
+from intgutils.wcl import WCL
+import intgutils.replace_funcs as replfuncs
+
+
+def make_wcl(nvars, nvals, nkeep):
+    """ Return wcl with nvars loop variables of nvals values each """
+    wcl = WCL()
+    for i in range(nvars):
+        wcl[f'loop{i}'] = ','.join(str(j) for j in range(nvals))
+    for i in range(nkeep):
+        wcl[f'keep{i}'] = f'value{i}'
+    return wcl
+
+
+def deepcopy_loop(valpair, valdict, opts=None):
+    """ Previous replace_vars_loop (without debugging or padding) deep copying
+        the kept values at every step of every combination """
+    looptodo = [valpair]
+    valuedone = []
+    keepdone = []
+    while looptodo:
+        valpair = looptodo.pop()
+        var = re.search(r"(?i)\$LOOP\{([^}]+)\}", valpair[0]).group(1)
+        (_, newval) = valdict.search(var, opts)
+        for nval in miscutils.fwsplit(newval):
+            valsub = re.sub(fr"(?i)\$LOOP\{{{re.escape(var)}\}}", nval, valpair[0])
+            keep = copy.deepcopy(valpair[1])
+            keep[var] = nval
+            if '$LOOP{' in valsub:
+                looptodo.append((valsub, keep))
+            else:
+                valuedone.append(valsub)
+                keepdone.append(keep)
+    return valuedone, keepdone
+
+
+def run(wcl, nvars, nkeep, loopfunc):
+    """ Expand template once returning (number of values, seconds, peak bytes) """
+    template = '/'.join(f'$LOOP{{loop{i}}}' for i in range(nvars))
+    keep = {f'keep{i}': f'value{i}' for i in range(nkeep)}
+
+    tracemalloc.start()
+    start = time.time()
+    num = loopfunc((template, keep), wcl)
+    elapsed = time.time() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (num, elapsed, peak)
+
+
+def count_list(loopfunc):
+    """ Return function counting the values of a list returning loopfunc """
+    return lambda valpair, valdict: len(loopfunc(valpair, valdict)[0])
+
+
+def count_iter(valpair, valdict):
+    """ Count the values generated by iter_replace_vars_loop """
+    return sum(1 for _ in replfuncs.iter_replace_vars_loop(valpair, valdict))
+
+
+def main():
+    """ entry point """
+
+    parser = argparse.ArgumentParser(description='Benchmark $LOOP expansion')
+    parser.add_argument('--nvars', type=int, default=3, help='number of loop variables')
+    parser.add_argument('--nvals', type=int, default=25, help='values per loop variable')
+    parser.add_argument('--nkeep', type=int, default=50, help='values already kept before loop')
+    args = parser.parse_args(sys.argv[1:])
+
+    wcl = make_wcl(args.nvars, args.nvals, args.nkeep)
+    for (label, loopfunc) in [('deep copy (old)', count_list(deepcopy_loop)),
+                              ('replace_vars_loop', count_list(replfuncs.replace_vars_loop)),
+                              ('iter_replace_vars', count_iter)]:
+        (num, elapsed, peak) = run(wcl, args.nvars, args.nkeep, loopfunc)
+        print(f"{label:18s}: {num:8d} values  {elapsed:8.3f} s  {num / elapsed:10.0f} values/s  "
+              f"peak {peak / 1024 / 1024:8.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+""" Compare making the directory of each output file with making each leaf directory once """
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import despymisc.miscutils as miscutils
+import intgutils.intgmisc as intgmisc
+
+
+class CountCalls:
+    """ Count calls of os.mkdir and os.stat while in context """
+
+    def __init__(self):
+        self.counts = {'mkdir': 0, 'stat': 0}
+        self.saved = {}
+
+    def __enter__(self):
+        for name in self.counts:
+            self.saved[name] = getattr(os, name)
+
+            def counted(*args, _name=name, **kwargs):
+                self.counts[_name] += 1
+                return self.saved[_name](*args, **kwargs)
+            setattr(os, name, counted)
+        return self
+
+    def __exit__(self, *exc):
+        for name, func in self.saved.items():
+            setattr(os, name, func)
+
+
+def main():
+    """ entry point """
+
+    parser = argparse.ArgumentParser(description='Benchmark making output directories')
+    parser.add_argument('--basedir', help='directory to make directories in (e.g., on a network filesystem)')
+    parser.add_argument('--files', type=int, default=10000, help='number of output files')
+    parser.add_argument('--dirs', type=int, default=20, help='number of leaf directories')
+    parser.add_argument('--threads', type=int, default=8, help='threads for make_dirs')
+    args = parser.parse_args(sys.argv[1:])
+
+    basedir = tempfile.mkdtemp(dir=args.basedir)
+    try:
+        for (label, nthreads) in [('per file', None), ('leaf dirs', 1), ('leaf dirs threaded', args.threads)]:
+            top = os.path.join(basedir, label.replace(' ', '_'))
+            fullnames = [os.path.join(top, 'out', f'ccd{i % args.dirs:02d}', f'file{i}.fits')
+                         for i in range(args.files)]
+
+            start = time.time()
+            with CountCalls() as calls:
+                if nthreads is None:
+                    for fname in fullnames:
+                        miscutils.coremakedirs(os.path.dirname(fname))
+                else:
+                    intgmisc.make_dirs(intgmisc.get_leaf_dirs(fullnames), nthreads)
+            elapsed = time.time() - start
+            print(f"{label:18s}: {calls.counts['mkdir']:8d} mkdir {calls.counts['stat']:8d} stat  "
+                  f"{elapsed:8.3f} s")
+    finally:
+        shutil.rmtree(basedir)
+
+
+if __name__ == "__main__":
+    main()
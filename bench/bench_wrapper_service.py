@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+""" Compare latency of running a trivial wrapper cold with running it in the wrapper service """
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+import intgutils.wrapper_service as wrapper_service
+
+GENWRAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'genwrap.py')
+
+
+def time_runs(func, nruns):
+    """ Return list of seconds taken by each of nruns calls of func """
+
+    times = []
+    for _ in range(nruns):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return times
+
+
+def main():
+    """ entry point """
+
+    parser = argparse.ArgumentParser(description='Benchmark wrapper service latency')
+    parser.add_argument('--runs', type=int, default=20, help='number of wrappers to run each way')
+    parser.add_argument('--genwrap', default=GENWRAP, help='genwrap.py to run')
+    args = parser.parse_args(sys.argv[1:])
+
+    tmpdir = tempfile.mkdtemp()
+    sockpath = os.path.join(tmpdir, 'sock')
+    inputwcl = os.path.join(tmpdir, 'input.wcl')
+    with open(inputwcl, 'w') as wclfh:
+        wclfh.write(f"<wrapper>\n    outputwcl = {tmpdir}/output.wcl\n</wrapper>\n"
+                    "<exec_1>\n    execname = true\n</exec_1>\n")
+
+    server = subprocess.Popen([sys.executable, args.genwrap, '--serve', sockpath],
+                              stdout=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(sockpath):
+            time.sleep(0.05)
+
+        with open(os.devnull, 'w') as nullfh:
+            def cold():
+                subprocess.run([sys.executable, args.genwrap, inputwcl], stdout=nullfh, check=True)
+
+            def client():
+                subprocess.run([sys.executable, args.genwrap, '--client', sockpath, inputwcl],
+                               stdout=nullfh, check=True)
+
+            def in_process():
+                status = wrapper_service.run_client(sockpath, inputwcl,
+                                                    (0, nullfh.fileno(), nullfh.fileno()))
+                assert status == 0
+
+            for (label, func) in [('cold start', cold),
+                                  ('genwrap --client', client),
+                                  ('run_client', in_process)]:
+                times = time_runs(func, args.runs)
+                print(f"{label:16s}: median {statistics.median(times) * 1000:8.1f} ms  "
+                      f"min {min(times) * 1000:8.1f} ms  max {max(times) * 1000:8.1f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,158 @@
 #!/usr/bin/env python3
 
-""" Generic wrapper """
+""" Generic wrapper
 
+    Given several input wcls (or a manifest file listing them, one per line),
+    runs each wrapper in a child forked from this already initialized
+    process, one at a time or up to --workers at a time.  Each wrapper writes its own
+    output wcl and a failing wrapper, even one killed by a signal, does not
+    affect the others.
+
+    With --serve, runs a wrapper service (see intgutils.wrapper_service)
+    listening on the given socket.  With --client, has the service listening
+    on the given socket run the wrappers instead.
+"""
+
+import os
 import sys
+import time
 import argparse
 
-import intgutils.basic_wrapper as basic_wrapper
+# the wrapper code is only imported when needed, keeping --client quick to start
+
+# seconds between checks for finished wrappers when running several at once
+POLL_INTERVAL = 0.05
+
+
+def read_manifest(manifest):
+    """ Return input wcl filenames listed in manifest ignoring blank and # lines """
+
+    with open(manifest, 'r') as manfh:
+        return [line.strip() for line in manfh if line.strip() and not line.strip().startswith('#')]
+
+
+def fork_wrapper(inputwcl):
+    """ Fork a child running wrapper for inputwcl, returning (pid, fd from
+        which to read its exit status) """
+
+    import intgutils.basic_wrapper as basic_wrapper
+    (rfd, wfd) = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(rfd)
+            status = basic_wrapper.run_wrapper_file(inputwcl)
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.write(wfd, str(status).encode())
+            finally:
+                os._exit(0)
+    os.close(wfd)
+    return (pid, rfd)
+
+
+def get_forked_status(inputwcl, waitstatus, rfd):
+    """ Return exit status of wrapper child given its wait status and the fd
+        it wrote its status to, nonzero if it died before writing one """
+
+    # not waiting for EOF, as processes left by the wrapper may hold the pipe
+    os.set_blocking(rfd, False)
+    try:
+        data = os.read(rfd, 64)
+    except BlockingIOError:
+        data = b''
+    os.close(rfd)
+
+    if os.WIFSIGNALED(waitstatus):
+        signum = os.WTERMSIG(waitstatus)
+        print(f"genwrap: wrapper for {inputwcl} killed by signal {signum}", file=sys.stderr)
+        return 128 + signum
+    if not data:
+        print(f"genwrap: wrapper for {inputwcl} exited without a status", file=sys.stderr)
+        return os.waitstatus_to_exitcode(waitstatus) or 1
+    return int(data)
+
+
+def run_batch(inputwcls, workers=1):
+    """ Run wrapper for each input wcl returning list of exit statuses """
+
+    # a fresh fork per wrapper, also when running one at a time, keeps
+    # wrappers isolated from each other while sharing the imports already
+    # done by this process.  Each child is waited for by pid, so one dying
+    # (e.g., killed for memory) is reported as its wrapper's failure instead
+    # of ending or hanging the batch.
+    workers = max(1, workers)
+    statuses = [None] * len(inputwcls)
+    running = {}    # pid -> (index, fd)
+    todo = list(enumerate(inputwcls))
+    while todo or running:
+        while todo and len(running) < workers:
+            (idx, inputwcl) = todo.pop(0)
+            (pid, rfd) = fork_wrapper(inputwcl)
+            running[pid] = (idx, rfd)
+
+        finished = False
+        for (pid, (idx, rfd)) in list(running.items()):
+            (donepid, waitstatus) = os.waitpid(pid, os.WNOHANG)
+            if donepid != 0:
+                del running[pid]
+                statuses[idx] = get_forked_status(inputwcls[idx], waitstatus, rfd)
+                finished = True
+        if not finished:
+            time.sleep(POLL_INTERVAL)
+    return statuses
+
 
 def main():
     """ entry point """
 
     parser = argparse.ArgumentParser(description='Generic wrapper')
-    parser.add_argument('inputwcl', nargs=1, action='store')
+    parser.add_argument('inputwcl', nargs='*', action='store')
+    parser.add_argument('--manifest', action='store',
+                        help='file listing input wcls, one per line')
+    parser.add_argument('--workers', action='store', type=int, default=1,
+                        help='number of wrappers to run at the same time')
+    parser.add_argument('--serve', action='store', metavar='SOCKET',
+                        help='run wrapper service listening on unix socket')
+    parser.add_argument('--client', action='store', metavar='SOCKET',
+                        help='run wrappers in service listening on unix socket')
     args = parser.parse_args(sys.argv[1:])
 
-    bwrap = basic_wrapper.BasicWrapper(args.inputwcl[0])
-    bwrap.run_wrapper()
-    bwrap.write_outputwcl()
-    sys.exit(bwrap.get_status())
+    if args.serve is not None:
+        import intgutils.wrapper_service as wrapper_service
+        wrapper_service.WrapperService(args.serve, args.workers if args.workers > 1 else None).serve_forever()
+        sys.exit(0)
+
+    inputwcls = list(args.inputwcl)
+    if args.manifest is not None:
+        inputwcls.extend(read_manifest(args.manifest))
+    if not inputwcls:
+        parser.error('no input wcl given')
+
+    if args.client is not None:
+        import intgutils.wrapper_service as wrapper_service
+        statuses = [wrapper_service.run_client(args.client, inputwcl) for inputwcl in inputwcls]
+        if len(inputwcls) == 1:
+            sys.exit(statuses[0])
+    elif len(inputwcls) == 1 and args.manifest is None:
+        import intgutils.basic_wrapper as basic_wrapper
+        bwrap = basic_wrapper.BasicWrapper(inputwcls[0])
+        bwrap.run_wrapper()
+        bwrap.write_outputwcl()
+        sys.exit(bwrap.get_status())
+    else:
+        statuses = run_batch(inputwcls, args.workers)
+
+    for (inputwcl, status) in zip(inputwcls, statuses):
+        print(f"genwrap: {inputwcl} exit status = {status}")
+
+    # 0 if all wrappers succeeded, else the status of the first which failed
+    sys.exit(next((status for status in statuses if status != 0), 0))
 
 if __name__ == "__main__":
     main()
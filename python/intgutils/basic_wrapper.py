@@ -18,9 +18,13 @@ import traceback
 import re
 import errno
 import collections
+import threading
+import concurrent.futures
 
 import intgutils.intgdefs as intgdefs
+import intgutils.intgtrace as intgtrace
 import intgutils.intgmisc as intgmisc
+import intgutils.version_cache as version_cache
 from intgutils.wcl import WCL
 import intgutils.replace_funcs as replfuncs
 import despymisc.miscutils as miscutils
@@ -29,6 +33,18 @@ import despymisc.provdefs as provdefs
 
 WRAPPER_OUTPUT_PREFIX = 'WRAP: '
 
+# threads for pre-exec tasks and version probing when async_prepare is set
+PREPARE_THREADS = 8
+
+
+class ExecState(threading.local):
+    """ Exec and task stack being worked on, separately for each thread """
+
+    def __init__(self):
+        threading.local.__init__(self)
+        self.curr_exec = None
+        self.curr_task = []
+
 
 class BasicWrapper:
     """ Basic wrapper class """
@@ -52,8 +68,73 @@ class BasicWrapper:
 
         self.last_num_derived = 0
         self.last_num_meta = 0
-        self.curr_task = []
-        self.curr_exec = None
+        self.exec_state = ExecState()
+        self.wcl_lock = threading.RLock()
+        self.io_manifest = {}
+
+        self.version_cache = None
+        cachefile = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_VERSION_CACHE}")
+        if cachefile is not None:
+            refresh = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_VERSION_CACHE_REFRESH}")
+            self.version_cache = version_cache.VersionCache(cachefile,
+                                                            refresh is not None and
+                                                            miscutils.convertBool(refresh))
+
+        # opts for replacing variables, evaluating $FUNCs in a worker pool
+        # if the wrapper has func_workers
+        self.expand_opts = None
+        nworkers = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_FUNC_WORKERS}")
+        if nworkers is not None and int(nworkers) > 0:
+            self.expand_opts = {intgdefs.FUNC_WORKERS: int(nworkers)}
+            timeout = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_FUNC_TIMEOUT}")
+            if timeout is not None:
+                self.expand_opts[intgdefs.FUNC_TIMEOUT] = float(timeout)
+
+        asyncprep = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_ASYNC_PREPARE}")
+        self.async_prepare = asyncprep is not None and miscutils.convertBool(asyncprep)
+        self.prepare_pool = None
+        self.version_futures = {}
+
+    ######################################################################
+    @property
+    def curr_exec(self):
+        """ Output wcl section of the exec being run by this thread """
+        return self.exec_state.curr_exec
+
+    @curr_exec.setter
+    def curr_exec(self, ow_exec):
+        self.exec_state.curr_exec = ow_exec
+
+    @property
+    def curr_task(self):
+        """ Names of nested tasks being run by this thread """
+        return self.exec_state.curr_task
+
+    @curr_task.setter
+    def curr_task(self, tasks):
+        self.exec_state.curr_task = tasks
+
+    ######################################################################
+    def get_expand_opts(self):
+        """ Return copy of opts to pass to replace_vars (None if no options) """
+        return dict(self.expand_opts) if self.expand_opts is not None else None
+
+    ######################################################################
+    def eval_funcs(self, execs):
+        """ Evaluate every $FUNC used by the given exec sections, or the file
+            and list sections they read or write, at the same time in the
+            $FUNC worker pool, keeping the values for later replace_vars """
+
+        if self.expand_opts is not None:
+            sections = []
+            for ekey, iw_exec in execs.items():
+                sections.append(ekey)
+                for iokey in [intgdefs.IW_INPUTS, intgdefs.IW_OUTPUTS]:
+                    if iokey in iw_exec:
+                        sections.extend(miscutils.fwsplit(iw_exec[iokey], ','))
+            self.expand_opts.pop(intgdefs.FUNC_VALUES, None)
+            self.expand_opts[intgdefs.FUNC_VALUES] = self.inputwcl.eval_funcs(self.get_expand_opts(),
+                                                                              sections)
 
     ######################################################################
     def determine_status(self):
@@ -61,10 +142,10 @@ class BasicWrapper:
         status = 0
 
         execs = intgmisc.get_exec_sections(self.inputwcl, intgdefs.IW_EXEC_PREFIX)
-        if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 6:
             miscutils.fwdebug_print(f"INFO:  exec sections = {execs}", WRAPPER_OUTPUT_PREFIX)
 
-        for ekey in sorted(execs.keys()):
+        for ekey in execs.keys():
             if ekey in self.outputwcl:
                 if 'task_info' in self.outputwcl[ekey]:
                     for taskd in self.outputwcl[ekey]['task_info'].values():
@@ -72,12 +153,12 @@ class BasicWrapper:
                             if taskd['status'] != 0:
                                 status = taskd['status']
                         else:
-                            if miscutils.fwdebug_check(3, "BASICWRAP_DEBUG"):
+                            if intgtrace.BASICWRAP_DEBUG >= 3:
                                 miscutils.fwdebug_print(f"WARN: Missing status in outputwcl task_info for {ekey}",
                                                         WRAPPER_OUTPUT_PREFIX)
                             status = 1
                 else:
-                    if miscutils.fwdebug_check(3, "BASICWRAP_DEBUG"):
+                    if intgtrace.BASICWRAP_DEBUG >= 3:
                         miscutils.fwdebug_print(f"WARN: Missing task_info in outputwcl for {ekey}",
                                                 WRAPPER_OUTPUT_PREFIX)
                     status = 1
@@ -123,7 +204,7 @@ class BasicWrapper:
     ######################################################################
     def create_command_line(self, execnum, exwcl):
         """ Create command line string handling hyphens appropriately"""
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print(f"execnum = '{execnum}', exwcl = '{exwcl}'",
                                     WRAPPER_OUTPUT_PREFIX)
         self.start_exec_task('create_command_line')
@@ -143,13 +224,13 @@ class BasicWrapper:
 
                 # loop through command line args
                 for key, val in exwcl['cmdline'].items():
-                    if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+                    if intgtrace.BASICWRAP_DEBUG >= 3:
                         miscutils.fwdebug_print(f"key = '{key}', val = '{val}'",
                                                 WRAPPER_OUTPUT_PREFIX)
 
                     # replace any variables
-                    expandval = replfuncs.replace_vars(val, self.inputwcl)[0]
-                    if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+                    expandval = replfuncs.replace_vars(val, self.inputwcl, self.get_expand_opts())[0]
+                    if intgtrace.BASICWRAP_DEBUG >= 3:
                         miscutils.fwdebug_print(f"expandval = '{expandval}'",
                                                 WRAPPER_OUTPUT_PREFIX)
 
@@ -172,7 +253,7 @@ class BasicWrapper:
                     cmdlist.insert(int(k), f"{posargs[k]}")
 
             # convert list of args into string
-            if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+            if intgtrace.BASICWRAP_DEBUG >= 6:
                 miscutils.fwdebug_print(f"cmdlist = '{cmdlist}'", WRAPPER_OUTPUT_PREFIX)
             cmdstr = ' '.join(cmdlist)
         else:
@@ -186,8 +267,8 @@ class BasicWrapper:
 
     ######################################################################
     def save_exec_version(self, exwcl):
-        """ Run command with version flag and parse output for version information """
-        # assumes exit code for version is 0
+        """ Save version of exec, from the version cache if the wrapper has a
+            version_cache file, otherwise by running the exec with its version flag """
 
         self.start_exec_task('save_exec_version')
 
@@ -198,53 +279,11 @@ class BasicWrapper:
             verflag = exwcl['version_flag']
             verpat = exwcl['version_pattern']
 
-            cmd = f"{execname} {verflag}"
-            try:
-                process = subprocess.Popen(shlex.split(cmd),
-                                           shell=False,
-                                           stdout=subprocess.PIPE,
-                                           stderr=subprocess.STDOUT,
-                                           text=True)
-            except:
-                (exc_type, exc_value) = sys.exc_info()[0:2]
-                print("********************")
-                print(f"Unexpected error: {exc_type} - {exc_value}")
-                print(f"cmd> {cmd}")
-                print(f"Probably could not find {shlex.split(cmd)[0]} in path")
-                print("Check for misspelled execname in submit wcl or")
-                print("    make sure that the corresponding eups package is in the metapackage ")
-                print("    and it sets up the path correctly")
-                raise
-
-            process.wait()
-            out = process.communicate()[0]
-            if process.returncode != 0:
-                miscutils.fwdebug_print("INFO:  problem when running code to get version",
-                                        WRAPPER_OUTPUT_PREFIX)
-                miscutils.fwdebug_print(f"\t{execname} {verflag} {verpat}",
-                                        WRAPPER_OUTPUT_PREFIX)
-                miscutils.fwdebug_print(f"\tcmd> {cmd}", WRAPPER_OUTPUT_PREFIX)
-                miscutils.fwdebug_print(f"\t{out}", WRAPPER_OUTPUT_PREFIX)
-                ver = None
+            future = self.version_futures.get((execname, verflag, verpat))
+            if future is not None and not future.cancel():
+                ver = future.result()
             else:
-                # parse output with verpat
-                try:
-                    vmatch = re.search(verpat, out)
-                    if vmatch:
-                        ver = vmatch.group(1)
-                    else:
-                        if miscutils.fwdebug_check(0, 'BASICWRAP_DEBUG'):
-                            miscutils.fwdebug_print(f"re.search didn't find version for exec {execname}",
-                                                    WRAPPER_OUTPUT_PREFIX)
-                        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
-                            miscutils.fwdebug_print(f"\tcmd output={out}", WRAPPER_OUTPUT_PREFIX)
-                            miscutils.fwdebug_print(f"\tcmd verpat={verpat}",
-                                                    WRAPPER_OUTPUT_PREFIX)
-                except Exception as err:
-                    #print type(err)
-                    ver = None
-                    print(f"Error: Exception from re.match.  Didn't find version: {err}")
-                    raise
+                ver = self.find_exec_version(execname, verflag, verpat)
         else:
             miscutils.fwdebug_print(f"INFO: Could not find version info for exec {execname}",
                                     WRAPPER_OUTPUT_PREFIX)
@@ -255,37 +294,158 @@ class BasicWrapper:
         self.end_exec_task(0)
 
     ######################################################################
-    def create_output_dirs(self, exwcl):
-        """ Make directories for output files """
+    def find_exec_version(self, execname, verflag, verpat):
+        """ Return version of exec from the version cache or by running it """
+
+        if self.version_cache is None:
+            return self.get_exec_version(execname, verflag, verpat)
+
+        key = version_cache.get_exec_key(execname, verflag, verpat)
+        ver = self.version_cache.lookup(key)
+        if ver is None:
+            ver = self.get_exec_version(execname, verflag, verpat)
+            self.version_cache.store(key, ver)
+        return ver
+
+    ######################################################################
+    def prefetch_exec_versions(self, execs):
+        """ Start finding versions of all execs in background threads """
+
+        for iw_exec in execs.values():
+            if 'version_flag' in iw_exec and 'version_pattern' in iw_exec:
+                vkey = (iw_exec['execname'], iw_exec['version_flag'], iw_exec['version_pattern'])
+                if vkey not in self.version_futures:
+                    self.version_futures[vkey] = self.get_prepare_pool().submit(self.find_exec_version,
+                                                                                *vkey)
+
+    ######################################################################
+    def get_exec_version(self, execname, verflag, verpat):
+        """ Run command with version flag and parse output for version information """
+        # assumes exit code for version is 0
+
+        ver = None
+        cmd = f"{execname} {verflag}"
+        try:
+            process = subprocess.Popen(shlex.split(cmd),
+                                       shell=False,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       text=True)
+        except:
+            (exc_type, exc_value) = sys.exc_info()[0:2]
+            print("********************")
+            print(f"Unexpected error: {exc_type} - {exc_value}")
+            print(f"cmd> {cmd}")
+            print(f"Probably could not find {shlex.split(cmd)[0]} in path")
+            print("Check for misspelled execname in submit wcl or")
+            print("    make sure that the corresponding eups package is in the metapackage ")
+            print("    and it sets up the path correctly")
+            raise
+
+        process.wait()
+        out = process.communicate()[0]
+        if process.returncode != 0:
+            miscutils.fwdebug_print("INFO:  problem when running code to get version",
+                                    WRAPPER_OUTPUT_PREFIX)
+            miscutils.fwdebug_print(f"\t{execname} {verflag} {verpat}",
+                                    WRAPPER_OUTPUT_PREFIX)
+            miscutils.fwdebug_print(f"\tcmd> {cmd}", WRAPPER_OUTPUT_PREFIX)
+            miscutils.fwdebug_print(f"\t{out}", WRAPPER_OUTPUT_PREFIX)
+            ver = None
+        else:
+            # parse output with verpat
+            try:
+                vmatch = re.search(verpat, out)
+                if vmatch:
+                    ver = vmatch.group(1)
+                else:
+                    if intgtrace.BASICWRAP_DEBUG >= 0:
+                        miscutils.fwdebug_print(f"re.search didn't find version for exec {execname}",
+                                                WRAPPER_OUTPUT_PREFIX)
+                    if intgtrace.BASICWRAP_DEBUG >= 3:
+                        miscutils.fwdebug_print(f"\tcmd output={out}", WRAPPER_OUTPUT_PREFIX)
+                        miscutils.fwdebug_print(f"\tcmd verpat={verpat}",
+                                                WRAPPER_OUTPUT_PREFIX)
+            except Exception as err:
+                #print type(err)
+                ver = None
+                print(f"Error: Exception from re.match.  Didn't find version: {err}")
+                raise
+        return ver
+
+    ######################################################################
+    def get_io_manifest(self, ekey, get_inputs=True, get_outputs=True):
+        """ Return (inputs, outputs) dicts of section to set of fullnames for
+            the exec section, resolving each only once per exec
+
+            Inputs and outputs are resolved separately as output lists
+            may not exist until just before the exec runs.  Outputs are
+            resolved again after transform_outputs, which may change them.
+            Sets are shared, so do not change them. """
+
+        manifest = self.io_manifest.setdefault(ekey, {})
+        if get_inputs and 'inputs' not in manifest:
+            (manifest['inputs'], _) = intgmisc.get_fullnames(self.inputwcl, self.inputwcl, ekey,
+                                                             get_outputs=False,
+                                                             opts=self.expand_opts)
+        if get_outputs and 'outputs' not in manifest:
+            (_, manifest['outputs']) = intgmisc.get_fullnames(self.inputwcl, self.inputwcl, ekey,
+                                                              get_inputs=False,
+                                                              opts=self.expand_opts)
+        return (manifest.get('inputs'), manifest.get('outputs'))
+
+    ######################################################################
+    def invalidate_io_manifest(self, ekey=None, outputs_only=False):
+        """ Forget resolved fullnames for the exec section (all if None) """
+
+        for key in list(self.io_manifest) if ekey is None else [ekey]:
+            if outputs_only:
+                self.io_manifest.get(key, {}).pop('outputs', None)
+            else:
+                self.io_manifest.pop(key, None)
+
+    ######################################################################
+    def create_output_dirs(self, exwcl, ekey=None):
+        """ Make directories for output files
+
+            If ekey is given, output fullnames come from its I/O manifest.
+            Each unique directory is made once across all output sections,
+            skipping ones made anyway as ancestors of others, using the
+            wrapper's mkdir_threads threads. """
 
         self.start_exec_task('create_output_dirs')
 
+        outfiles = []
         if intgdefs.IW_OUTPUTS in exwcl:
             for sect in miscutils.fwsplit(exwcl[intgdefs.IW_OUTPUTS]):
                 sectkeys = sect.split('.')
-                if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+                if intgtrace.BASICWRAP_DEBUG >= 3:
                     miscutils.fwdebug_print(f"INFO: sectkeys={sectkeys}", WRAPPER_OUTPUT_PREFIX)
                 if sectkeys[0] == intgdefs.IW_FILE_SECT:
                     sectname = sectkeys[1]
                     if sectname in self.inputwcl[intgdefs.IW_FILE_SECT]:
                         if 'fullname' in self.inputwcl[intgdefs.IW_FILE_SECT][sectname]:
                             fullnames = self.inputwcl[intgdefs.IW_FILE_SECT][sectname]['fullname']
-                            if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+                            if intgtrace.BASICWRAP_DEBUG >= 3:
                                 miscutils.fwdebug_print(f"INFO: fullname = {fullnames}",
                                                         WRAPPER_OUTPUT_PREFIX)
                             if '$RNMLST{' in fullnames:
                                 raise ValueError('Deprecated $RNMLST in output filename')
 
-                            for fname in miscutils.fwsplit(fullnames, ','):
-                                outdir = os.path.dirname(fname)
-                                miscutils.coremakedirs(outdir)
+                            if ekey is not None:
+                                fullnames = self.get_io_manifest(ekey, get_inputs=False)[1][sect]
+                            else:
+                                fullnames = miscutils.fwsplit(fullnames, ',')
+                            outfiles.extend(fullnames)
+                elif sectkeys[0] == intgdefs.IW_LIST_SECT and ekey is not None:
+                    outfiles.extend(self.get_io_manifest(ekey, get_inputs=False)[1][sect])
                 elif sectkeys[0] == intgdefs.IW_LIST_SECT:
                     (_, _, filesect) = sect.split('.')
                     ldict = self.inputwcl[intgdefs.IW_LIST_SECT][sectkeys[1]]
 
                     # check list itself exists
                     listname = ldict['fullname']
-                    if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+                    if intgtrace.BASICWRAP_DEBUG >= 3:
                         miscutils.fwdebug_print(f"\tINFO: Checking existence of '{listname}'",
                                                 WRAPPER_OUTPUT_PREFIX)
 
@@ -301,21 +461,70 @@ class BasicWrapper:
 
                     # read fullnames from list file
                     fullnames = intgmisc.read_fullnames_from_listfile(listname, listfmt, ldict['columns'])
-                    if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+                    if intgtrace.BASICWRAP_DEBUG >= 3:
                         miscutils.fwdebug_print(f"\tINFO: fullnames={fullnames}", WRAPPER_OUTPUT_PREFIX)
-                    for fname in fullnames[filesect]:
-                        outdir = os.path.dirname(fname)
-                        miscutils.coremakedirs(outdir)
+                    outfiles.extend(fullnames[filesect])
+
+        outdirs = intgmisc.get_leaf_dirs(outfiles)
+        nthreads = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_MKDIR_THREADS}")
+        intgmisc.make_dirs(outdirs, int(nthreads) if nthreads is not None else None)
+
+        # compared to making the directory of each output file
+        saved = sum(1 for fname in outfiles if os.path.dirname(fname)) - len(outdirs)
+        self.curr_exec['task_info']['create_output_dirs']['mkdirs_saved'] = saved
+        if intgtrace.BASICWRAP_DEBUG >= 3:
+            miscutils.fwdebug_print(f"INFO: made {len(outdirs)} directories for {len(outfiles)} "
+                                    f"output files ({saved} makedirs calls saved)",
+                                    WRAPPER_OUTPUT_PREFIX)
 
         self.end_exec_task(0)
 
     ######################################################################
-    def run_exec(self):
-        """ Run given command line """
+    def invalidate_output_lists(self, exwcl):
+        """ Forget cached contents of lists the exec may have (re)written """
+
+        if intgdefs.IW_OUTPUTS in exwcl:
+            for sect in miscutils.fwsplit(exwcl[intgdefs.IW_OUTPUTS]):
+                sectkeys = sect.split('.')
+                if sectkeys[0] == intgdefs.IW_LIST_SECT:
+                    ldict = self.inputwcl[intgdefs.IW_LIST_SECT][sectkeys[1]]
+                    intgmisc.invalidate_list_cache(ldict['fullname'])
+
+    ######################################################################
+    def get_exec_value(self, exwcl, key):
+        """ Return value of key in exec section with any variables replaced """
+        return replfuncs.replace_vars(str(exwcl[key]), self.inputwcl, self.get_expand_opts())[0]
+
+    ######################################################################
+    def run_exec(self, exwcl=None):
+        """ Run given command line
+
+            If the exec section has a sample_interval, resource use of the
+            exec is sampled every sample_interval seconds.  Any of the limits
+            max_walltime, max_cputime, max_vmem and max_rss in the exec
+            section are enforced (see intgmisc.run_exec).  If the exec section
+            has an output_log, exec output goes gzip'ed to that file and on
+            failure the last output_tail KB go into the output wcl. """
 
         self.start_exec_task('run_exec')
         cmdline = self.curr_exec['cmdline']
 
+        sample_interval = None
+        if exwcl is not None and intgdefs.IW_EXEC_SAMPLE_INTERVAL in exwcl:
+            sample_interval = float(self.get_exec_value(exwcl, intgdefs.IW_EXEC_SAMPLE_INTERVAL))
+        limits = {}
+        logfile = None
+        tail_size = intgmisc.OUTPUT_TAIL_SIZE
+        if exwcl is not None:
+            for key in intgdefs.IW_EXEC_LIMITS:
+                if key in exwcl:
+                    limits[key] = float(self.get_exec_value(exwcl, key))
+            if intgdefs.IW_EXEC_OUTPUT_LOG in exwcl:
+                logfile = self.get_exec_value(exwcl, intgdefs.IW_EXEC_OUTPUT_LOG)
+                self.curr_exec[intgdefs.IW_EXEC_OUTPUT_LOG] = logfile
+                if intgdefs.IW_EXEC_OUTPUT_TAIL in exwcl:
+                    tail_size = int(float(self.get_exec_value(exwcl, intgdefs.IW_EXEC_OUTPUT_TAIL)) * 1024)
+
         retcode = None
         procinfo = None
 
@@ -323,7 +532,8 @@ class BasicWrapper:
         print('*' * 70)
         sys.stdout.flush()
         try:
-            (retcode, procinfo) = intgmisc.run_exec(cmdline)
+            (retcode, procinfo) = intgmisc.run_exec(cmdline, sample_interval, limits,
+                                                    logfile, tail_size)
         except OSError as exc:
             if exc.errno != errno.ENOENT:
                 raise
@@ -341,24 +551,69 @@ class BasicWrapper:
         sys.stdout.flush()
 
         if retcode != 0:
-            if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+            if intgtrace.BASICWRAP_DEBUG >= 3:
                 miscutils.fwdebug_print(f"\tINFO: cmd exited with non-zero exit code = {retcode}",
                                         WRAPPER_OUTPUT_PREFIX)
                 miscutils.fwdebug_print(f"\tINFO: failed cmd = {cmdline}", WRAPPER_OUTPUT_PREFIX)
         else:
-            if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+            if intgtrace.BASICWRAP_DEBUG >= 3:
                 miscutils.fwdebug_print("\tINFO: cmd exited with exit code = 0",
                                         WRAPPER_OUTPUT_PREFIX)
 
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print("END", WRAPPER_OUTPUT_PREFIX)
         print('*' * 70)
+        if procinfo is not None and 'samples' in procinfo:
+            procinfo['samples'] = intgmisc.encode_samples(procinfo['samples'])
+            procinfo['sample_fields'] = ','.join(intgmisc.SAMPLE_FIELDS)
+        if procinfo is not None and 'output_tail' in procinfo:
+            tail = procinfo.pop('output_tail')
+            if retcode != 0:
+                # one line, without wcl comment character
+                self.curr_exec[intgdefs.IW_EXEC_OUTPUT_TAIL] = \
+                    tail.encode('unicode_escape').decode('ascii').replace('#', '\\x23')
+        if procinfo is not None and 'limit_exceeded' in procinfo:
+            miscutils.fwdebug_print(f"ERROR: exec terminated for exceeding {procinfo['limit_exceeded']}",
+                                    WRAPPER_OUTPUT_PREFIX)
+            self.curr_exec['task_info']['run_exec']['limit_exceeded'] = procinfo['limit_exceeded']
         self.curr_exec['status'] = retcode
         self.curr_exec['procinfo'] = procinfo
 
         self.end_exec_task(retcode)
 
 
+    ######################################################################
+    def check_files(self, fullnames):
+        """ Return (existing, missing) lists of fullnames, stat'ing them with
+            the wrapper's stat_threads threads and stat_timeout
+
+            Files whose stat timed out are stat'ed once more.  If still not
+            known to exist or not, TimeoutError is raised instead of reporting
+            them missing. """
+
+        nthreads = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_STAT_THREADS}")
+        nthreads = int(nthreads) if nthreads is not None else None
+        timeout = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_STAT_TIMEOUT}")
+        timeout = float(timeout) if timeout is not None else None
+        stats = intgmisc.stat_files(fullnames, nthreads, timeout)
+
+        unknown = [fname for (fname, finfo) in stats.items() if finfo.exists is None]
+        if unknown:
+            miscutils.fwdebug_print(f"WARN: stat of {len(unknown)} files timed out, trying again",
+                                    WRAPPER_OUTPUT_PREFIX)
+            stats.update(intgmisc.stat_files(unknown, nthreads, timeout))
+            unknown = [fname for fname in unknown if stats[fname].exists is None]
+            if unknown:
+                for fname in unknown:
+                    miscutils.fwdebug_print(f"ERROR: could not stat '{fname}' within {timeout} secs "
+                                            "(filesystem slow or hung)", WRAPPER_OUTPUT_PREFIX)
+                raise TimeoutError(f"stat of {len(unknown)} files took longer than {timeout} secs")
+
+        exists = [fname for fname in fullnames if stats[fname].exists]
+        missing = [fname for fname in fullnames if not stats[fname].exists]
+        return (exists, missing)
+
+
     ######################################################################
     def check_inputs(self, ekey):
         """ Check which input files/lists do not exist """
@@ -366,9 +621,9 @@ class BasicWrapper:
         self.start_exec_task('check_inputs')
 
         existfiles = {}
-        ins, _ = intgmisc.get_fullnames(self.inputwcl, self.inputwcl, ekey, get_outputs=False)
+        (ins, _) = self.get_io_manifest(ekey, get_outputs=False)
         for sect in ins:
-            exists, missing = intgmisc.check_files(ins[sect])
+            exists, missing = self.check_files(ins[sect])
             existfiles[sect] = exists
 
             if missing:
@@ -405,7 +660,7 @@ class BasicWrapper:
     def check_outputs(self, ekey, exitcode):
         """ Check which output files were created, renaming if necessary """
 
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print("INFO: Beg", WRAPPER_OUTPUT_PREFIX)
 
         self.start_exec_task('check_outputs')
@@ -413,21 +668,21 @@ class BasicWrapper:
         existfiles = {}
         missingfiles = {}
 
-        _, outs = intgmisc.get_fullnames(self.inputwcl, self.inputwcl, ekey)
+        (_, outs) = self.get_io_manifest(ekey, get_inputs=False)
         for sect in outs:
-            if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+            if intgtrace.BASICWRAP_DEBUG >= 3:
                 miscutils.fwdebug_print(f"INFO: sect={sect}", WRAPPER_OUTPUT_PREFIX)
 
-            exists, missing = intgmisc.check_files(outs[sect])
+            exists, missing = self.check_files(outs[sect])
             existfiles.update({sect:exists})
             if missing:
                 optout = self.get_optout(sect)
                 if optout:
-                    if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+                    if intgtrace.BASICWRAP_DEBUG >= 3:
                         miscutils.fwdebug_print(f"\tINFO: optional output file '{missing}' does not exist (sect: {sect}).",
                                                 WRAPPER_OUTPUT_PREFIX)
                 elif exitcode != 0:
-                    if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+                    if intgtrace.BASICWRAP_DEBUG >= 6:
                         miscutils.fwdebug_print(f"INFO: skipping missing output due to non-zero exit code ({sect}: {missing})",
                                                 WRAPPER_OUTPUT_PREFIX)
                 else:
@@ -436,11 +691,11 @@ class BasicWrapper:
                     missingfiles.update({sect:missing})
 
 
-        if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 6:
             miscutils.fwdebug_print(f"INFO: existfiles={existfiles}", WRAPPER_OUTPUT_PREFIX)
             miscutils.fwdebug_print(f"INFO: missingfiles={missingfiles}", WRAPPER_OUTPUT_PREFIX)
 
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print("INFO: end", WRAPPER_OUTPUT_PREFIX)
 
         if missingfiles:
@@ -467,13 +722,18 @@ class BasicWrapper:
 
     ######################################################################
     def save_provenance(self, execsect, exwcl, infiles, outfiles, exitcode):
-        """ Create provenance wcl """
+        """ Create provenance wcl
+
+            If infiles is None, inputs come from the exec's I/O manifest """
         #pylint: disable=unbalanced-tuple-unpacking
         self.start_exec_task('save_provenance')
 
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if infiles is None:
+            infiles = self.get_io_manifest(execsect, get_outputs=False)[0]
+
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print("INFO: Beg", WRAPPER_OUTPUT_PREFIX)
-        if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 6:
             miscutils.fwdebug_print(f"INFO: infiles = {infiles}", WRAPPER_OUTPUT_PREFIX)
             miscutils.fwdebug_print(f"INFO: outfiles = {outfiles}", WRAPPER_OUTPUT_PREFIX)
 
@@ -482,14 +742,11 @@ class BasicWrapper:
         # convert probably fullnames in outexist to filename+compression
         new_outfiles = collections.OrderedDict()
         for exlabel, exlist in outfiles.items():
-            if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+            if intgtrace.BASICWRAP_DEBUG >= 6:
                 miscutils.fwdebug_print(f"INFO: exlabel={exlabel} exlist={exlist}",
                                         WRAPPER_OUTPUT_PREFIX)
-            newlist = []
-            for fullname in exlist:
-                basename = miscutils.parse_fullname(fullname, miscutils.CU_PARSE_BASENAME)
-                newlist.append(basename)
-            if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+            newlist = intgmisc.parse_fullnames(exlist, miscutils.CU_PARSE_BASENAME)
+            if intgtrace.BASICWRAP_DEBUG >= 6:
                 miscutils.fwdebug_print(f"INFO: newlist={newlist}", WRAPPER_OUTPUT_PREFIX)
 
             new_outfiles[exlabel] = newlist
@@ -501,11 +758,8 @@ class BasicWrapper:
         if infiles:
             all_infiles = []
             for key, sublist in infiles.items():
-                new_infiles[key] = []
-                for fullname in sublist:
-                    basename = miscutils.parse_fullname(fullname, miscutils.CU_PARSE_BASENAME)
-                    all_infiles.append(basename)
-                    new_infiles[key].append(basename)
+                new_infiles[key] = intgmisc.parse_fullnames(sublist, miscutils.CU_PARSE_BASENAME)
+                all_infiles.extend(new_infiles[key])
             prov[provdefs.PROV_USED][execsect] = provdefs.PROV_DELIM.join(all_infiles)
 
         # was_generated_by - done by PFW when saving metadata
@@ -515,10 +769,10 @@ class BasicWrapper:
             wdf = prov[provdefs.PROV_WDF]
             derived_pairs = miscutils.fwsplit(exwcl[intgdefs.IW_DERIVATION], provdefs.PROV_DELIM)
             for dpair in derived_pairs:
-                if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+                if intgtrace.BASICWRAP_DEBUG >= 6:
                     miscutils.fwdebug_print(f"INFO: dpair = {dpair}", WRAPPER_OUTPUT_PREFIX)
                 (parent_sect, child_sect) = miscutils.fwsplit(dpair, ':')[:2]
-                if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+                if intgtrace.BASICWRAP_DEBUG >= 6:
                     miscutils.fwdebug_print(f"INFO: parent_sect = {parent_sect}", WRAPPER_OUTPUT_PREFIX)
                     miscutils.fwdebug_print(f"INFO: child_sect = {child_sect}", WRAPPER_OUTPUT_PREFIX)
 
@@ -526,7 +780,7 @@ class BasicWrapper:
                 #parent_key = miscutils.fwsplit(parent_sect, '.')[-1]
                 #child_key = miscutils.fwsplit(child_sect, '.')[-1]
 
-                if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+                if intgtrace.BASICWRAP_DEBUG >= 6:
                     #miscutils.fwdebug_print("INFO: parent_key = %s" % parent_key,
                     #                        WRAPPER_OUTPUT_PREFIX)
                     #miscutils.fwdebug_print("INFO: child_key = %s" % child_key,
@@ -542,11 +796,11 @@ class BasicWrapper:
                         new_outfiles[child_sect] is None or \
                         not new_outfiles[child_sect]:
                     if optout:
-                        if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+                        if intgtrace.BASICWRAP_DEBUG >= 6:
                             miscutils.fwdebug_print(f"INFO: skipping missing optional output {parent_sect}:{child_sect}",
                                                     WRAPPER_OUTPUT_PREFIX)
                     elif exitcode != 0:
-                        if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+                        if intgtrace.BASICWRAP_DEBUG >= 6:
                             miscutils.fwdebug_print(f"INFO: skipping missing output due to non-zero exit code {parent_sect}:{child_sect}",
                                                     WRAPPER_OUTPUT_PREFIX)
                     else:
@@ -556,7 +810,7 @@ class BasicWrapper:
                 else:
                     self.last_num_derived += 1
                     key = 'derived_%d' % self.last_num_derived
-                    if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+                    if intgtrace.BASICWRAP_DEBUG >= 6:
                         miscutils.fwdebug_print(f"INFO: key = {key}", WRAPPER_OUTPUT_PREFIX)
                         miscutils.fwdebug_print(f"INFO: before wdf = {prov[provdefs.PROV_WDF]}",
                                                 WRAPPER_OUTPUT_PREFIX)
@@ -581,20 +835,18 @@ class BasicWrapper:
                         elif parent_sect in new_outfiles:
                             # this output was generated within same
                             #   program/wrapper from other output files
-                            parents = []
-                            for outparent in outfiles[parent_sect]:
-                                parents.append(miscutils.parse_fullname(outparent,
-                                                                        miscutils.CU_PARSE_FILENAME))
+                            parents = intgmisc.parse_fullnames(outfiles[parent_sect],
+                                                               miscutils.CU_PARSE_FILENAME)
                             wdf[key][provdefs.PROV_PARENTS] = provdefs.PROV_DELIM.join(parents)
 
 
-                if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+                if intgtrace.BASICWRAP_DEBUG >= 6:
                     miscutils.fwdebug_print(f"INFO: after wdf = {prov[provdefs.PROV_WDF]}",
                                             WRAPPER_OUTPUT_PREFIX)
             if not wdf:
                 del prov[provdefs.PROV_WDF]
 
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print(f"INFO: End (num_errs = {num_errs:d})", WRAPPER_OUTPUT_PREFIX)
 
         self.end_exec_task(num_errs)
@@ -608,12 +860,12 @@ class BasicWrapper:
         if outfilename is None:
             outfilename = self.inputwcl['wrapper']['outputwcl']
 
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print(f"outfilename = {outfilename}", WRAPPER_OUTPUT_PREFIX)
 
         # create output wcl directory if needed
-        outwcldir = miscutils.parse_fullname(outfilename, miscutils.CU_PARSE_PATH)
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        outwcldir = intgmisc.parse_fullname(outfilename, miscutils.CU_PARSE_PATH)
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print(f"outwcldir = {outwcldir}", WRAPPER_OUTPUT_PREFIX)
         miscutils.coremakedirs(outwcldir)
 
@@ -658,7 +910,7 @@ class BasicWrapper:
     ######################################################################
     def save_outputs_by_section(self, ekey, outexist):
         """ save fullnames from outexist to outputs by section """
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print(f"INFO: before adding  outputs_by_sect={self.outputwcl[intgdefs.OW_OUTPUTS_BY_SECT]}",
                                     WRAPPER_OUTPUT_PREFIX)
         for exlabel, exlist in outexist.items():
@@ -668,7 +920,7 @@ class BasicWrapper:
                 if ekey not in self.outputwcl[intgdefs.OW_OUTPUTS_BY_SECT][exlabel]:
                     self.outputwcl[intgdefs.OW_OUTPUTS_BY_SECT][exlabel][ekey] = []
 
-                if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+                if intgtrace.BASICWRAP_DEBUG >= 3:
                     miscutils.fwdebug_print(f"INFO: adding to sect={exlabel}: {exlist}",
                                             WRAPPER_OUTPUT_PREFIX)
                 self.outputwcl[intgdefs.OW_OUTPUTS_BY_SECT][exlabel][ekey].extend(exlist)
@@ -677,11 +929,243 @@ class BasicWrapper:
                                         WRAPPER_OUTPUT_PREFIX)
 
 
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print(f"INFO: after adding  outputs_by_sect={self.outputwcl[intgdefs.OW_OUTPUTS_BY_SECT]}",
                                     WRAPPER_OUTPUT_PREFIX)
 
 
+    ######################################################################
+    def prepare_exec(self, ekey, iw_exec):
+        """ Tasks before running the exec, returning existing inputs
+
+            If async_prepare is set, save_exec_version and check_inputs run
+            in threads while the command line is made, followed by
+            create_output_dirs once the inputs are found.  Each still records
+            its own task_info.  The exec's I/O manifest is
+            resolved first, so that the threads only read the wcls. """
+
+        self.transform_inputs(iw_exec)
+        if self.async_prepare:
+            try:
+                self.get_io_manifest(ekey)
+            except Exception:
+                # let the tasks report the problem as in a serial run
+                pass
+            else:
+                return self.prepare_exec_async(ekey, iw_exec)
+
+        inputs = self.check_inputs(ekey)
+        self.check_command_line(ekey, iw_exec)
+        self.save_exec_version(iw_exec)
+        self.create_command_line(ekey, iw_exec)
+        self.create_output_dirs(iw_exec, ekey)
+        return inputs
+
+    ######################################################################
+    def prepare_exec_async(self, ekey, iw_exec):
+        """ Run pre-exec tasks concurrently, joining before returning
+            existing inputs.  Failures are raised in serial task order.
+
+            As in prepare_exec, output directories are only made once the
+            inputs are found and the command line is made. """
+
+        pool = self.get_prepare_pool()
+        ow_exec = self.curr_exec
+        tasks = [pool.submit(self.run_task_thread, ow_exec, self.check_inputs, ekey),
+                 pool.submit(self.run_task_thread, ow_exec, self.save_exec_version, iw_exec)]
+        try:
+            self.check_command_line(ekey, iw_exec)
+            self.create_command_line(ekey, iw_exec)
+            tasks[0].result()
+            tasks.append(pool.submit(self.run_task_thread, ow_exec, self.create_output_dirs,
+                                     iw_exec, ekey))
+        finally:
+            concurrent.futures.wait(tasks)
+
+            # keep task_info in serial order
+            task_info = ow_exec['task_info']
+            for name in ['check_inputs', 'check_command_line', 'save_exec_version',
+                         'create_command_line', 'create_output_dirs']:
+                if name in task_info:
+                    task_info[name] = task_info.pop(name)
+            inputs = tasks[0].result()
+        for task in tasks[1:]:
+            task.result()
+        return inputs
+
+    ######################################################################
+    def run_task_thread(self, ow_exec, task, *args):
+        """ Run task method for exec ow_exec in a pool thread """
+
+        self.curr_exec = ow_exec
+        try:
+            return task(*args)
+        except BaseException:
+            self.end_all_tasks(1)
+            raise
+        finally:
+            self.curr_exec = None
+
+    ######################################################################
+    def get_prepare_pool(self):
+        """ Return thread pool for pre-exec tasks, starting it if needed """
+
+        if self.prepare_pool is None:
+            self.prepare_pool = concurrent.futures.ThreadPoolExecutor(max_workers=PREPARE_THREADS)
+        return self.prepare_pool
+
+    ######################################################################
+    def stop_prepare_pool(self):
+        """ Cancel pending version probes and stop the pre-exec thread pool """
+
+        for future in self.version_futures.values():
+            future.cancel()
+        if self.prepare_pool is not None:
+            self.prepare_pool.shutdown(wait=True)
+            self.prepare_pool = None
+        self.version_futures = {}
+
+    ######################################################################
+    def run_exec_section(self, ekey, iw_exec):
+        """ Run the exec and make its outputs visible to later execs """
+
+        self.run_exec(iw_exec)
+        with self.wcl_lock:
+            self.invalidate_output_lists(iw_exec)
+            self.transform_outputs(iw_exec)
+
+            # outputs are checked as they are after transform_outputs
+            self.invalidate_io_manifest(ekey, outputs_only=True)
+
+    ######################################################################
+    def finish_exec(self, ekey, iw_exec, inputs):
+        """ Tasks after running the exec: check outputs and save provenance """
+
+        ow_exec = self.curr_exec
+        outexist = self.check_outputs(ekey, ow_exec['status'])
+        self.save_outputs_by_section(ekey, outexist)
+        self.save_provenance(ekey, iw_exec, inputs, outexist, ow_exec['status'])
+
+        ow_exec['status'] = 0
+
+    ######################################################################
+    def get_exec_files(self, ekey, iw_exec):
+        """ Return (inputs, outputs) sets of absolute paths of files and lists
+            the exec section declares, or None if they cannot be resolved yet
+            (e.g., an input list written by an earlier exec)
+
+            Fullnames are resolved without filling the exec's I/O manifest,
+            which must wait for transform_inputs. """
+
+        ins = set()
+        outs = set()
+        try:
+            (infiles, outfiles) = intgmisc.get_fullnames(self.inputwcl, self.inputwcl, ekey,
+                                                         opts=self.expand_opts)
+        except Exception:
+            return None
+
+        for (iokey, manifest, paths) in [(intgdefs.IW_INPUTS, infiles, ins),
+                                         (intgdefs.IW_OUTPUTS, outfiles, outs)]:
+            for fullnames in manifest.values():
+                paths.update(os.path.abspath(fname) for fname in fullnames)
+            if iokey in iw_exec:
+                for sect in miscutils.fwsplit(iw_exec[iokey], ','):
+                    sectkeys = sect.split('.')
+                    if sectkeys[0] == intgdefs.IW_LIST_SECT:
+                        ldict = self.inputwcl[intgdefs.IW_LIST_SECT][sectkeys[1]]
+                        paths.add(os.path.abspath(ldict['fullname']))
+        return (ins, outs)
+
+    ######################################################################
+    def get_exec_dependencies(self, execs):
+        """ Return dict of exec section to the earlier exec sections it must
+            wait for, i.e., that write files it reads or writes, or read files
+            it writes.  Execs whose files cannot be resolved depend on all
+            earlier execs. """
+
+        depends = collections.OrderedDict()
+        files = collections.OrderedDict()
+        for ekey, iw_exec in execs.items():
+            files[ekey] = self.get_exec_files(ekey, iw_exec)
+            depends[ekey] = []
+            for prevkey in depends:
+                if prevkey == ekey:
+                    break
+                if files[ekey] is None or files[prevkey] is None:
+                    depends[ekey].append(prevkey)
+                    continue
+                (ins, outs) = files[ekey]
+                (previns, prevouts) = files[prevkey]
+                if not ins.isdisjoint(prevouts) or not outs.isdisjoint(previns | prevouts):
+                    depends[ekey].append(prevkey)
+
+        if intgtrace.BASICWRAP_DEBUG >= 3:
+            miscutils.fwdebug_print(f"INFO: exec dependencies = {dict(depends)}",
+                                    WRAPPER_OUTPUT_PREFIX)
+        return depends
+
+    ######################################################################
+    def run_exec_worker(self, ekey, iw_exec, ow_exec, waitfor, abort):
+        """ Prepare and run one exec once the execs it depends on are done """
+
+        for future in waitfor:
+            future.result()
+        if abort.is_set():
+            return None
+
+        self.curr_exec = ow_exec
+        try:
+            with self.wcl_lock:
+                inputs = self.prepare_exec(ekey, iw_exec)
+            self.run_exec_section(ekey, iw_exec)
+        except BaseException:
+            self.end_all_tasks(1)
+            raise
+        return inputs
+
+    ######################################################################
+    def run_execs_parallel(self, execs, ncores):
+        """ Run independent execs concurrently using up to ncores threads
+
+            Each exec is prepared and run in a worker thread once the execs
+            it depends on have run.  Checking outputs and saving provenance
+            is done by this thread in exec order, so the output wcl is the
+            same as for a serial run.  Tasks touching the wcls hold wcl_lock;
+            subclasses overriding them must be safe to call from threads. """
+
+        depends = self.get_exec_dependencies(execs)
+        ow_execs = collections.OrderedDict((ekey, {'task_info': {}}) for ekey in execs)
+        futures = {}
+        abort = threading.Event()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=ncores) as pool:
+            try:
+                # dependencies are always submitted (and so started) first
+                for ekey, iw_exec in execs.items():
+                    futures[ekey] = pool.submit(self.run_exec_worker, ekey, iw_exec,
+                                                ow_execs[ekey],
+                                                [futures[dkey] for dkey in depends[ekey]],
+                                                abort)
+
+                for ekey, iw_exec in execs.items():
+                    self.outputwcl[ekey] = ow_execs[ekey]
+                    inputs = futures[ekey].result()
+                    self.curr_exec = ow_execs[ekey]
+                    with self.wcl_lock:
+                        self.finish_exec(ekey, iw_exec, inputs)
+            except BaseException:
+                abort.set()
+                for future in futures.values():
+                    future.cancel()
+                concurrent.futures.wait(futures.values())
+
+                # record execs which already started
+                for ekey, ow_exec in ow_execs.items():
+                    if ow_exec['task_info'] and ekey not in self.outputwcl:
+                        self.outputwcl[ekey] = ow_exec
+                raise
+
     ######################################################################
     def cleanup(self):
         """ Remove intermediate files from wrapper execution """
@@ -691,32 +1175,32 @@ class BasicWrapper:
     ######################################################################
     def run_wrapper(self):
         """ Workflow for this wrapper """
-        if miscutils.fwdebug_check(3, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 3:
             miscutils.fwdebug_print("INFO: Begin", WRAPPER_OUTPUT_PREFIX)
         self.outputwcl['wrapper']['start_time'] = time.time()
         try:
             execs = intgmisc.get_exec_sections(self.inputwcl, intgdefs.IW_EXEC_PREFIX)
-            if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+            if intgtrace.BASICWRAP_DEBUG >= 6:
                 miscutils.fwdebug_print(f"INFO:  exec sections = {execs}", WRAPPER_OUTPUT_PREFIX)
 
-            for ekey, iw_exec in sorted(execs.items()):
-                ow_exec = {'task_info': {}}
-                self.outputwcl[ekey] = ow_exec
-                self.curr_exec = ow_exec
-
-                self.transform_inputs(iw_exec)
-                inputs = self.check_inputs(ekey)
-                self.check_command_line(ekey, iw_exec)
-                self.save_exec_version(iw_exec)
-                self.create_command_line(ekey, iw_exec)
-                self.create_output_dirs(iw_exec)
-                self.run_exec()
-                self.transform_outputs(iw_exec)
-                outexist = self.check_outputs(ekey, ow_exec['status'])
-                self.save_outputs_by_section(ekey, outexist)
-                self.save_provenance(ekey, iw_exec, inputs, outexist, ow_exec['status'])
-
-                ow_exec['status'] = 0
+            if self.async_prepare:
+                self.prefetch_exec_versions(execs)
+            if self.expand_opts is not None:
+                self.eval_funcs(execs)
+
+            ncores = self.inputwcl.get(f"{intgdefs.IW_WRAP_SECT}.{intgdefs.IW_EXEC_CORES}")
+            ncores = int(ncores) if ncores is not None else 1
+            if ncores > 1 and len(execs) > 1:
+                self.run_execs_parallel(execs, ncores)
+            else:
+                for ekey, iw_exec in execs.items():
+                    ow_exec = {'task_info': {}}
+                    self.outputwcl[ekey] = ow_exec
+                    self.curr_exec = ow_exec
+
+                    inputs = self.prepare_exec(ekey, iw_exec)
+                    self.run_exec_section(ekey, iw_exec)
+                    self.finish_exec(ekey, iw_exec, inputs)
 
             self.cleanup()
             self.outputwcl['wrapper']['status'] = self.determine_status()
@@ -730,13 +1214,14 @@ class BasicWrapper:
                                       file=sys.stdout)
             self.outputwcl['wrapper']['status'] = 1
             self.end_all_tasks(1)
+        finally:
+            self.stop_prepare_pool()
 
-
-        if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+        if intgtrace.BASICWRAP_DEBUG >= 6:
             miscutils.fwdebug_print(f"INFO: outputwcl[intgdefs.OW_OUTPUTS_BY_SECT]={self.outputwcl[intgdefs.OW_OUTPUTS_BY_SECT]}",
                                     WRAPPER_OUTPUT_PREFIX)
         for fsname, fssect in self.outputwcl[intgdefs.OW_OUTPUTS_BY_SECT].items():
-            if miscutils.fwdebug_check(6, 'BASICWRAP_DEBUG'):
+            if intgtrace.BASICWRAP_DEBUG >= 6:
                 miscutils.fwdebug_print(f"INFO: making string for sect {fsname}: {fssect}",
                                         WRAPPER_OUTPUT_PREFIX)
             for exname, exlist in fssect.items():
@@ -744,3 +1229,27 @@ class BasicWrapper:
         self.outputwcl['wrapper']['end_time'] = time.time()
 
         miscutils.fwdebug_print(f"INFO: end - exit status = {self.get_status()}", WRAPPER_OUTPUT_PREFIX)
+
+
+######################################################################
+def run_wrapper_file(inputwcl):
+    """ Run wrapper for inputwcl writing its output wcl, returning its exit
+        status.  Any failure only affects the returned status. """
+
+    try:
+        bwrap = BasicWrapper(inputwcl)
+        bwrap.run_wrapper()
+        bwrap.write_outputwcl()
+        status = bwrap.get_status()
+    except SystemExit as err:
+        # sys.exit() without a status means success
+        if err.code is None:
+            status = 0
+        else:
+            status = err.code if isinstance(err.code, int) else 1
+    except Exception:
+        (exc_type, exc_value, exc_trback) = sys.exc_info()
+        traceback.print_exception(exc_type, exc_value, exc_trback, file=sys.stdout)
+        status = 1
+    sys.stdout.flush()
+    return status
@@ -1,6 +1,9 @@
 """ string definitions """
 
 REPLACE_VARS = 'replace_vars'
+FUNC_WORKERS = 'func_workers'
+FUNC_TIMEOUT = 'func_timeout'
+FUNC_VALUES = 'func_values'
 
 
 LISTENTRY = 'line'
@@ -27,6 +30,23 @@ IW_FILE_SECT = 'filespecs'
 IW_EXEC_PREFIX = 'exec_'
 IW_WRAP_SECT = 'wrapper'
 IW_OUTPUT_OPTIONAL = 'optional'
+IW_FUNC_WORKERS = 'func_workers'
+IW_FUNC_TIMEOUT = 'func_timeout'   # seconds for each batch of $FUNC calls
+IW_STAT_THREADS = 'stat_threads'
+IW_STAT_TIMEOUT = 'stat_timeout'
+IW_MKDIR_THREADS = 'mkdir_threads'
+IW_EXEC_CORES = 'exec_cores'
+IW_VERSION_CACHE = 'version_cache'
+IW_VERSION_CACHE_REFRESH = 'version_cache_refresh'
+IW_ASYNC_PREPARE = 'async_prepare'
+IW_EXEC_SAMPLE_INTERVAL = 'sample_interval'
+IW_EXEC_MAX_WALLTIME = 'max_walltime'   # seconds
+IW_EXEC_MAX_CPUTIME = 'max_cputime'     # seconds per process
+IW_EXEC_MAX_VMEM = 'max_vmem'           # bytes of address space per process
+IW_EXEC_MAX_RSS = 'max_rss'             # bytes summed over process tree
+IW_EXEC_OUTPUT_LOG = 'output_log'     # gzip'ed file for exec stdout/stderr
+IW_EXEC_OUTPUT_TAIL = 'output_tail'   # KB of output kept for output wcl on failure
+IW_EXEC_LIMITS = [IW_EXEC_MAX_WALLTIME, IW_EXEC_MAX_CPUTIME, IW_EXEC_MAX_VMEM, IW_EXEC_MAX_RSS]
 IW_FILE_SECT = 'filespecs'
 IW_META_SECT = 'filetype_metadata'
 
@@ -9,28 +9,324 @@ Contains misc integration utilities
 """
 
 import shlex
+import errno
+import shutil
+import sys
+import subprocess
 import os
+import array
+import base64
+import zlib
+import threading
+import queue
+import signal
+import fcntl
+import resource
+import gzip
+import bz2
+import lzma
 import re
+import math
+import time
+import copy
+import collections
+import concurrent.futures
+import functools
+import itertools
 from despymisc import subprocess4
 from despymisc import miscutils
 from intgutils import intgdefs
+from intgutils import intgtrace
 import intgutils.replace_funcs as replfuncs
+from intgutils.wcl import WCL
+
+
+# directories with fewer files to check than this are checked a file at a time
+SCANDIR_MIN_FILES = 8
+
+# default number of threads used by stat_files
+STAT_THREADS = 16
+
+# default number of threads used by make_dirs (1 means no threads)
+MKDIR_THREADS = 1
+
+# result of stat_files for one file (size and mtime are None if not exists)
+FileStat = collections.namedtuple('FileStat', ['exists', 'size', 'mtime'])
+
+# result of stat_files for a file whose stat did not finish in time (exists unknown)
+STAT_TIMED_OUT = FileStat(None, None, None)
+
+# parsed list files keyed by (abs path, mtime_ns, size, linefmt, colstr),
+# least recently used first
+LIST_CACHE = collections.OrderedDict()
+LIST_CACHE_LOCK = threading.Lock()
+
+# max number of fullnames (over all lists) kept in LIST_CACHE
+LIST_CACHE_MAX_ROWS = 2000000
+
+# max number of (fullname, mask) results kept by parse_fullname
+PARSE_CACHE_SIZE = 100000
+
+# values of each sample of an exec's resource use (see ProcSampler)
+SAMPLE_FIELDS = ('elapsed', 'rss', 'cpu', 'read_bytes', 'write_bytes', 'threads')
+# counters from /proc/<pid>/io saved in procinfo (prefixed with io_)
+PROC_IO_FIELDS = ('rchar', 'wchar', 'syscr', 'syscw', 'read_bytes', 'write_bytes')
+# seconds between checks of an exec's walltime/rss limits
+LIMIT_CHECK_INTERVAL = 1.0
+# seconds between asking a process tree over its limits to stop and killing it
+LIMIT_KILL_GRACE = 10
+# bytes of exec output kept in memory when capturing output (see OutputCapture)
+OUTPUT_TAIL_SIZE = 64 * 1024
+# size of exec output pipes and max bytes per read from them
+OUTPUT_PIPE_SIZE = 1024 * 1024
+OUTPUT_READ_SIZE = 1024 * 1024
+# seconds to wait for output pipes to close after exec exits (background
+# processes may hold them open)
+OUTPUT_DRAIN_TIMEOUT = 10
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# delimiter for each text list format
+LIST_DELIMS = {'textcsv': ',', 'texttab': '\t', 'textsp': ' '}
+
+# number of list lines parsed at a time
+LIST_CHUNK_LINES = 10000
+
+# chunk of list cells, one per line, which are all plain path/filename[N]
+FAST_FULLNAMES_RE = re.compile(r'(?:/?[^/\s\[\]]+(?:/[^/\s\[\]]+)+(?:\[\d+\])?\n)*'
+                               r'/?[^/\s\[\]]+(?:/[^/\s\[\]]+)+(?:\[\d+\])?')
+HDU_SUFFIX_RE = re.compile(r'\[\d+\]$', re.M)
+
+# characters in list lines needing fwsplit or cell stripping
+LIST_SPECIAL_CHARS = '(): \t\r\f\v'
+
+# leading (magic) bytes of compressed list files and module to read them
+LIST_COMPRESSIONS = [(re.compile(rb'\x1f\x8b'), gzip),
+                     (re.compile(rb'BZh[1-9]'), bz2),
+                     (re.compile(rb'\xfd7zXZ\x00'), lzma)]
+
+######################################################################
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_fullname(fullname, retmask=miscutils.CU_PARSE_FILENAME):
+    """ miscutils.parse_fullname remembering results since the same
+        fullnames are parsed many times during a wrapper run """
+    return miscutils.parse_fullname(fullname, retmask)
+
+
+######################################################################
+def parse_fullnames(fullnames, retmask=miscutils.CU_PARSE_FILENAME):
+    """ Parse many fullnames returning a list of values per requested part
+        (or a single list if only one part requested like parse_fullname) """
+
+    results = [parse_fullname(fullname, retmask) for fullname in fullnames]
+    nparts = bin(retmask).count('1')
+    if nparts == 1:
+        return results
+    if not results:
+        return tuple([] for _ in range(nparts))
+    return tuple(list(col) for col in zip(*results))
+
+
+######################################################################
+def stat_file(fname):
+    """ Return FileStat for a single file """
+    try:
+        sinfo = os.stat(fname)
+    except OSError:
+        return FileStat(False, None, None)
+    return FileStat(True, sinfo.st_size, sinfo.st_mtime)
+
+
+######################################################################
+def stat_files(fullnames, nthreads=None, timeout=None):
+    """ Return dict of fullname to FileStat stat'ing files concurrently
+
+        Stat calls are spread over nthreads threads since stat latency on
+        network filesystems is high but parallelizes well.   A stat taking
+        longer than timeout seconds is reported as STAT_TIMED_OUT, i.e., with
+        exists None, not as missing.  A hung stat cannot be stopped, so the
+        threads are daemon threads which neither are waited for here nor keep
+        the process from exiting. """
+
+    if nthreads is None:
+        nthreads = STAT_THREADS
+    fnames = list(dict.fromkeys(fullnames))    # unique, keeping order
+
+    if nthreads <= 1 or len(fnames) <= 1:
+        return {fname: stat_file(fname) for fname in fnames}
+
+    todo = queue.SimpleQueue()
+    for fname in fnames:
+        todo.put(fname)
+    results = {}
+    started = {}
+    finished = set()
+    cond = threading.Condition()
+
+    def stat_worker():
+        """ stat files from todo until none are left """
+        while True:
+            try:
+                fname = todo.get_nowait()
+            except queue.Empty:
+                return
+            with cond:
+                started[fname] = time.time()
+            finfo = stat_file(fname)
+            with cond:
+                finished.add(fname)
+                results.setdefault(fname, finfo)
+                cond.notify()
+
+    nthreads = min(nthreads, len(fnames))
+    for _ in range(nthreads):
+        threading.Thread(target=stat_worker, daemon=True).start()
+
+    with cond:
+        while len(results) < len(fnames):
+            cond.wait(None if timeout is None else min(timeout, 0.1))
+            if timeout is None:
+                continue
+
+            now = time.time()
+            hung = [fname for (fname, stime) in started.items()
+                    if fname not in finished and now - stime > timeout]
+            for fname in hung:
+                if fname not in results:
+                    miscutils.fwdebug_print(f"WARN: stat of {fname} took longer than {timeout} secs")
+                    results[fname] = STAT_TIMED_OUT
+
+            # if every thread is hung, no other stat can start
+            if len(hung) >= nthreads and len(results) < len(fnames):
+                miscutils.fwdebug_print(f"WARN: all stat threads hung, giving up on "
+                                        f"{len(fnames) - len(results)} files")
+                for fname in fnames:
+                    results.setdefault(fname, STAT_TIMED_OUT)
+
+    return {fname: results[fname] for fname in fnames}
 
 
 ######################################################################
-def check_files(fullnames):
-    """ Check whether given files do exist on disk """
+def check_files(fullnames, batch=False, nthreads=None, timeout=None):
+    """ Check whether given files do exist on disk
+
+        If batch is True, check files by listing each directory once
+        instead of checking every file separately, otherwise files are
+        stat'ed concurrently (see stat_files).  Raises TimeoutError if any
+        stat did not finish within timeout, as whether those files exist is
+        not known. """
+
+    starttime = time.time()
+    if batch:
+        found = find_files_by_dir(fullnames)
+    else:
+        stats = stat_files(fullnames, nthreads, timeout)
+        unknown = [fname for fname, finfo in stats.items() if finfo.exists is None]
+        if unknown:
+            raise TimeoutError(f"stat of {len(unknown)} files took longer than {timeout} secs: "
+                               f"{', '.join(unknown)}")
+        found = {fname for fname, finfo in stats.items() if finfo.exists}
 
     exists = []
     missing = []
     for fname in fullnames:
-        if os.path.exists(fname):
+        if fname in found:
             exists.append(fname)
         else:
             missing.append(fname)
+
+    if intgtrace.INTGMISC_DEBUG >= 3:
+        method = 'by directory' if batch else 'per file'
+        miscutils.fwdebug_print(f"INFO: checked {len(exists) + len(missing)} files {method} "
+                                f"in {time.time() - starttime:0.3f} secs")
     return (exists, missing)
 
 
+######################################################################
+def find_files_by_dir(fullnames):
+    """ Return set of the given files which exist using one listing per directory """
+
+    bydir = {}
+    for fname in fullnames:
+        bydir.setdefault(os.path.dirname(fname), []).append(fname)
+
+    found = set()
+    for dirname, fnames in bydir.items():
+        if len(fnames) < SCANDIR_MIN_FILES:
+            found.update(fname for fname in fnames if os.path.exists(fname))
+            continue
+
+        try:
+            with os.scandir(dirname or '.') as diriter:
+                entries = {entry.name: entry for entry in diriter}
+        except (FileNotFoundError, NotADirectoryError):
+            continue    # none of the files can exist
+        except OSError:
+            # e.g., directory is not readable, but files may still be
+            found.update(fname for fname in fnames if os.path.exists(fname))
+            continue
+
+        for fname in fnames:
+            basename = os.path.basename(fname)
+            if basename in ['', '.', '..']:
+                if os.path.exists(fname):
+                    found.add(fname)
+            elif basename in entries:
+                # exists follows symbolic links, so dangling links are missing
+                if not entries[basename].is_symlink() or os.path.exists(fname):
+                    found.add(fname)
+
+    if intgtrace.INTGMISC_DEBUG >= 6:
+        miscutils.fwdebug_print(f"INFO: listed {len(bydir)} directories for {len(fullnames)} files")
+    return found
+
+
+######################################################################
+def get_leaf_dirs(fullnames):
+    """ Return sorted list of unique directories of the files without those
+        which are ancestors of others as making a directory makes them too """
+
+    dirs = {os.path.normpath(dirname) for dirname in
+            {os.path.dirname(fname) for fname in fullnames} if dirname}
+
+    ancestors = set()
+    for dirname in dirs:
+        parent = os.path.dirname(dirname)
+        while parent and parent != dirname and parent not in ancestors:
+            ancestors.add(parent)
+            (dirname, parent) = (parent, os.path.dirname(parent))
+
+    return sorted(dirs - ancestors)
+
+
+######################################################################
+def make_dir(dirname):
+    """ Make directory and any missing ancestors, doing nothing if it exists """
+
+    try:
+        os.makedirs(dirname)
+    except FileExistsError:
+        pass
+
+
+######################################################################
+def make_dirs(dirs, nthreads=None):
+    """ Make directories, spread over nthreads threads if more than 1
+
+        Concurrent creation of shared ancestors is safe as os.makedirs
+        ignores ancestors made meanwhile. """
+
+    if nthreads is None:
+        nthreads = MKDIR_THREADS
+    if nthreads <= 1 or len(dirs) <= 1:
+        for dirname in dirs:
+            make_dir(dirname)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(nthreads, len(dirs))) as executor:
+            for _ in executor.map(make_dir, dirs):
+                pass
+
+
 #######################################################################
 def get_cmd_hyphen(hyphen_type, cmd_option):
     """ Determine correct hyphenation for command line argument """
@@ -53,22 +349,343 @@ def get_cmd_hyphen(hyphen_type, cmd_option):
 
 #######################################################################
 def get_exec_sections(wcl, prefix):
-    """ Returns exec sections appearing in given wcl """
-    execs = {}
-    for key, val in wcl.items():
-        if miscutils.fwdebug_check(3, "DEBUG"):
-            miscutils.fwdebug_print(f"\tsearching for exec prefix in {key}")
+    """ Returns exec sections appearing in given wcl in numeric order """
+
+    if isinstance(wcl, WCL):
+        keys = wcl.get_numbered_sections(prefix)
+    else:
+        pattern = re.compile(re.escape(prefix) + r'(\d+)')
+        keys = sorted((key for key in wcl if pattern.fullmatch(key)),
+                      key=lambda k: (int(pattern.fullmatch(k).group(1)), k))
+
+    if intgtrace.DEBUG >= 4:
+        miscutils.fwdebug_print(f"\tFound exec sections {keys}")
+    return {key: wcl[key] for key in keys}
+
+
+#######################################################################
+def _read_proc_stat(pid):
+    """ Return fields of /proc/<pid>/stat following the command name
+        (i.e., starting with state) or None if not readable """
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as statfh:
+            data = statfh.read()
+    except OSError:
+        return None
+    return data[data.rindex(')') + 2:].split()
+
+
+#######################################################################
+def _read_proc_io(pid):
+    """ Return dict of counters in /proc/<pid>/io or None if not readable """
+    try:
+        with open(f'/proc/{pid}/io', 'r') as iofh:
+            return {key: int(val) for (key, val) in (line.split(':') for line in iofh)}
+    except (OSError, ValueError):
+        return None
+
+
+#######################################################################
+def get_proc_tree(pid):
+    """ Return pid followed by the pids of all its descendants """
+
+    children = {}
+    try:
+        pids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return [pid]
+    for cpid in pids:
+        fields = _read_proc_stat(cpid)
+        if fields is not None:
+            children.setdefault(int(fields[1]), []).append(cpid)
+
+    tree = [pid]
+    for tpid in tree:    # grows while iterating
+        tree.extend(children.get(tpid, []))
+    return tree
+
+
+#######################################################################
+class ProcSampler(threading.Thread):
+    """ Thread periodically sampling resource use of a process and its
+        descendants from /proc
+
+        Samples are kept flat in an array of doubles, SAMPLE_FIELDS values
+        per sample. """
+
+    def __init__(self, pid, interval):
+        threading.Thread.__init__(self, daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = array.array('d')
+        self.starttime = time.time()
+        self._done = threading.Event()
+
+    def run(self):
+        while True:
+            self.take_sample()
+            if self._done.wait(self.interval):
+                break
+
+    def take_sample(self):
+        """ Add one sample summed over the process tree """
+        (rss, cpu, rbytes, wbytes, threads) = (0, 0, 0, 0, 0)
+        found = False
+        for pid in get_proc_tree(self.pid):
+            fields = _read_proc_stat(pid)
+            if fields is None:
+                continue
+            found = True
+            cpu += sum(int(x) for x in fields[11:15]) / CLOCK_TICKS  # utime stime cutime cstime
+            threads += int(fields[17])
+            rss += int(fields[21]) * PAGE_SIZE
+            counters = _read_proc_io(pid)
+            if counters is not None:
+                rbytes += counters.get('read_bytes', 0)
+                wbytes += counters.get('write_bytes', 0)
+        if found:
+            self.samples.extend((time.time() - self.starttime, rss, cpu, rbytes, wbytes, threads))
 
-        if re.search(r"^%s\d+$" % prefix, key):
-            if miscutils.fwdebug_check(4, "DEBUG"):
-                miscutils.fwdebug_print(f"\tFound exec prefex {key}")
-            execs[key] = val
-    return execs
+    def stop(self):
+        """ Stop sampling and wait for thread to finish """
+        self._done.set()
+        self.join()
 
 
 #######################################################################
-def run_exec(cmd):
-    """ Run an executable with given command returning process information """
+def summarize_samples(samples):
+    """ Return dict of summary statistics for samples from ProcSampler """
+
+    nfields = len(SAMPLE_FIELDS)
+    nsamples = len(samples) // nfields
+    if nsamples == 0:
+        return {'sample_count': 0}
+
+    (elapsed, rss, cpu, rbytes, wbytes, threads) = [samples[i::nfields] for i in range(nfields)]
+    imax = max(range(nsamples), key=rss.__getitem__)
+    return {'sample_count': nsamples,
+            'sample_rss_max': int(rss[imax]),
+            'sample_rss_max_time': round(elapsed[imax], 3),
+            'sample_rss_mean': int(sum(rss) / nsamples),
+            'sample_threads_max': int(max(threads)),
+            'sample_cpu_util': round(cpu[-1] / elapsed[-1], 3) if elapsed[-1] > 0 else 0.,
+            'sample_read_bytes': int(max(rbytes)),
+            'sample_write_bytes': int(max(wbytes))}
+
+
+#######################################################################
+def encode_samples(samples):
+    """ Return samples from ProcSampler as a compact string for wcl """
+    if sys.byteorder != 'little':
+        samples = array.array('d', samples)
+        samples.byteswap()
+    return base64.b64encode(zlib.compress(samples.tobytes())).decode('ascii')
+
+
+#######################################################################
+def decode_samples(encoded):
+    """ Return array of samples from string made by encode_samples """
+    samples = array.array('d', zlib.decompress(base64.b64decode(encoded)))
+    if sys.byteorder != 'little':
+        samples.byteswap()
+    return samples
+
+
+#######################################################################
+def get_tree_rss(pid):
+    """ Return resident memory in bytes summed over pid and its descendants """
+    rss = 0
+    for tpid in get_proc_tree(pid):
+        fields = _read_proc_stat(tpid)
+        if fields is not None:
+            rss += int(fields[21]) * PAGE_SIZE
+    return rss
+
+
+#######################################################################
+def kill_proc_tree(pids, sig):
+    """ Send signal to each of pids ignoring those already gone """
+    for tpid in pids:
+        try:
+            os.kill(tpid, sig)
+        except ProcessLookupError:
+            pass
+
+
+#######################################################################
+class LimitWatcher(threading.Thread):
+    """ Thread terminating an exec's process tree (TERM, then KILL after
+        LIMIT_KILL_GRACE seconds) if over its walltime or rss limit
+
+        The exec stays in the wrapper's process group so that signals for
+        the job (e.g., Ctrl-C, or a batch system killing the job) reach it,
+        which means the tree is found from /proc instead of killing a group. """
+
+    def __init__(self, pid, limits):
+        threading.Thread.__init__(self, daemon=True)
+        self.pid = pid
+        self.max_walltime = limits.get(intgdefs.IW_EXEC_MAX_WALLTIME)
+        self.max_rss = limits.get(intgdefs.IW_EXEC_MAX_RSS)
+        self.reason = None
+        self.starttime = time.time()
+        self._done = threading.Event()
+
+    def run(self):
+        while True:
+            interval = LIMIT_CHECK_INTERVAL
+            if self.max_walltime:
+                interval = max(0., min(interval, self.starttime + self.max_walltime - time.time()))
+            if self._done.wait(interval):
+                return
+
+            if self.max_walltime and time.time() - self.starttime >= self.max_walltime:
+                self.reason = f"{intgdefs.IW_EXEC_MAX_WALLTIME} ({self.max_walltime} secs)"
+            elif self.max_rss:
+                rss = get_tree_rss(self.pid)
+                if rss > self.max_rss:
+                    self.reason = f"{intgdefs.IW_EXEC_MAX_RSS} ({rss} > {self.max_rss} bytes)"
+
+            if self.reason is not None:
+                miscutils.fwdebug_print(f"ERROR: exec over limit {self.reason}, terminating")
+                pids = get_proc_tree(self.pid)
+                kill_proc_tree(pids, signal.SIGTERM)
+                self._done.wait(LIMIT_KILL_GRACE)
+                # including descendants already reparented after TERM
+                kill_proc_tree(set(pids).union(get_proc_tree(self.pid)), signal.SIGKILL)
+                return
+
+    def stop(self):
+        """ Stop watching (exec is done) and wait for thread to finish """
+        self._done.set()
+        self.join()
+
+
+#######################################################################
+def get_rlimits(limits):
+    """ Return list of (resource, (soft, hard)) enforcing the per process limits """
+    rlimits = []
+    if limits.get(intgdefs.IW_EXEC_MAX_CPUTIME):
+        cpusecs = int(math.ceil(limits[intgdefs.IW_EXEC_MAX_CPUTIME]))
+        # SIGXCPU at the soft limit, SIGKILL at the hard limit
+        rlimits.append((resource.RLIMIT_CPU, (cpusecs, cpusecs + LIMIT_KILL_GRACE)))
+    if limits.get(intgdefs.IW_EXEC_MAX_VMEM):
+        vmem = int(limits[intgdefs.IW_EXEC_MAX_VMEM])
+        rlimits.append((resource.RLIMIT_AS, (vmem, vmem)))
+    return rlimits
+
+
+#######################################################################
+def get_prlimit_args(rlimits):
+    """ Return prlimit(1) command prefix setting rlimits before running the
+        command, or None if prlimit is not available """
+    prlimit = shutil.which('prlimit')
+    if prlimit is None:
+        return None
+    names = {resource.RLIMIT_CPU: 'cpu', resource.RLIMIT_AS: 'as'}
+    return [prlimit] + [f"--{names[rsrc]}={soft}:{hard}" for (rsrc, (soft, hard)) in rlimits] + ['--']
+
+
+#######################################################################
+class OutputCapture:
+    """ Copy exec output from pipes into a gzip'ed log file keeping the last
+        tail_size bytes in memory
+
+        Each pipe is read in its own thread so the exec never blocks on a
+        full pipe.  Compression level 1 keeps up with high volume writers. """
+
+    def __init__(self, logfile, tail_size=OUTPUT_TAIL_SIZE):
+        self.tail_size = tail_size
+        self.tail = collections.deque()
+        self.tail_bytes = 0
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        logdir = os.path.dirname(logfile)
+        if logdir:
+            miscutils.coremakedirs(logdir)
+        self.logfh = gzip.open(logfile, 'wb', compresslevel=1)
+        self.threads = []
+
+    def start(self, pipes):
+        """ Start a reader thread for each pipe """
+        for pipe in pipes:
+            # bigger pipes mean fewer, larger reads and fewer stalls of the exec
+            if hasattr(fcntl, 'F_SETPIPE_SZ'):
+                try:
+                    fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, OUTPUT_PIPE_SIZE)
+                except OSError:
+                    pass
+            thread = threading.Thread(target=self._read_pipe, args=(pipe,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _read_pipe(self, pipe):
+        """ Copy everything from pipe """
+        fdesc = pipe.fileno()
+        while True:
+            data = os.read(fdesc, OUTPUT_READ_SIZE)
+            if not data:
+                break
+            self._save(data)
+        pipe.close()
+
+    def _save(self, data):
+        """ Write data to log adding it to the tail """
+        with self.lock:
+            if self.logfh is None:    # finished waiting
+                return
+            self.logfh.write(data)
+            self.total_bytes += len(data)
+            self.tail.append(data)
+            self.tail_bytes += len(data)
+            while self.tail_bytes - len(self.tail[0]) >= self.tail_size:
+                self.tail_bytes -= len(self.tail.popleft())
+
+    def finish(self, timeout=OUTPUT_DRAIN_TIMEOUT):
+        """ Wait for pipes to close, close log, and return tail of output """
+        endtime = time.time() + timeout
+        for thread in self.threads:
+            thread.join(max(0., endtime - time.time()))
+        with self.lock:
+            self.logfh.close()
+            self.logfh = None
+            return b''.join(self.tail)[-self.tail_size:]
+
+
+#######################################################################
+def wait_proc_io(pid):
+    """ Wait for process to exit without reaping it returning counters from
+        its /proc/<pid>/io (None if not available)
+
+        Counters for an exited process include those of the descendants it
+        waited for, which is not true for descendants still running or
+        reparented to init. """
+
+    if not hasattr(os, 'waitid'):
+        return None
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:
+        return None
+    return _read_proc_io(pid)
+
+
+#######################################################################
+def run_exec(cmd, sample_interval=None, limits=None, logfile=None, tail_size=OUTPUT_TAIL_SIZE):
+    """ Run an executable with given command returning process information
+
+        If sample_interval is given, resource use is also sampled every
+        sample_interval seconds (see ProcSampler).
+
+        limits is an optional dict with any of max_walltime, max_cputime,
+        max_vmem and max_rss (see intgdefs.IW_EXEC_LIMITS).  The per process
+        limits are set before the exec starts (see get_prlimit_args), while
+        going over max_walltime or max_rss terminates the exec's process tree
+        (see LimitWatcher).  The name of a limit found exceeded is saved in
+        procinfo['limit_exceeded'].
+
+        If logfile is given, stdout and stderr are written gzip'ed to logfile
+        instead of the wrapper's stdout, with the last tail_size bytes in
+        procinfo['output_tail'] (see OutputCapture). """
 
     procfields = ['ru_idrss', 'ru_inblock', 'ru_isrss', 'ru_ixrss',
                   'ru_majflt', 'ru_maxrss', 'ru_minflt', 'ru_msgrcv',
@@ -77,10 +694,75 @@ def run_exec(cmd):
     retcode = None
     procinfo = None
 
-    subp = subprocess4.Popen(shlex.split(cmd), shell=False, text=True)
-    retcode = subp.wait4()
+    limits = {key: val for (key, val) in (limits or {}).items() if val}
+    rlimits = get_rlimits(limits)
+
+    popenargs = {}
+    capture = None
+    if logfile is not None:
+        capture = OutputCapture(logfile, tail_size)
+        popenargs = {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE}
+
+    try:
+        cmdargs = shlex.split(cmd)
+        preexec = None
+        if rlimits:
+            prlimit_args = get_prlimit_args(rlimits)
+            if prlimit_args is not None:
+                # prlimit sets the limits on itself and execs the command,
+                # as preexec_fn is not safe with threads
+                if shutil.which(cmdargs[0]) is None:
+                    raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), cmdargs[0])
+                cmdargs = prlimit_args + cmdargs
+            else:
+                def preexec():
+                    for (rsrc, rlimit) in rlimits:
+                        resource.setrlimit(rsrc, rlimit)
+        subp = subprocess4.Popen(cmdargs, shell=False, text=True, preexec_fn=preexec, **popenargs)
+    except BaseException:
+        if capture is not None:
+            capture.finish(0)
+        raise
+    if capture is not None:
+        capture.start([subp.stdout, subp.stderr])
+
+    watcher = None
+    if intgdefs.IW_EXEC_MAX_WALLTIME in limits or intgdefs.IW_EXEC_MAX_RSS in limits:
+        watcher = LimitWatcher(subp.pid, limits)
+        watcher.start()
+
+    sampler = None
+    if sample_interval:
+        sampler = ProcSampler(subp.pid, sample_interval)
+        sampler.start()
+    try:
+        counters = wait_proc_io(subp.pid)
+        retcode = subp.wait4()
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        if sampler is not None:
+            sampler.stop()
+        if capture is not None:
+            tail = capture.finish()
     procinfo = dict((field, getattr(subp.rusage, field)) for field in procfields)
 
+    if watcher is not None and watcher.reason is not None:
+        procinfo['limit_exceeded'] = watcher.reason
+    elif intgdefs.IW_EXEC_MAX_CPUTIME in limits and \
+            (retcode == -signal.SIGXCPU or (retcode == -signal.SIGKILL and
+                                            subp.rusage.ru_utime + subp.rusage.ru_stime >=
+                                            limits[intgdefs.IW_EXEC_MAX_CPUTIME])):
+        procinfo['limit_exceeded'] = f"{intgdefs.IW_EXEC_MAX_CPUTIME} ({limits[intgdefs.IW_EXEC_MAX_CPUTIME]} secs)"
+    if counters is not None:
+        procinfo.update((f'io_{field}', counters[field]) for field in PROC_IO_FIELDS if field in counters)
+    if sampler is not None:
+        procinfo['samples'] = sampler.samples
+        procinfo.update(summarize_samples(sampler.samples))
+    if capture is not None:
+        procinfo['output_bytes'] = capture.total_bytes
+        procinfo['output_tail'] = tail.decode('utf-8', 'replace')
+
     return (retcode, procinfo)
 
 
@@ -111,62 +793,313 @@ def convert_col_string_to_list(colstr, with_format=True):
     return columns
 
 
+#######################################################################
+def invalidate_list_cache(listfile=None):
+    """ Forget parsed contents of given list file (all lists if None)
+
+        Needed for lists rewritten within the same mtime tick without
+        changing size, e.g., lists written by the exec itself """
+
+    with LIST_CACHE_LOCK:
+        if listfile is None:
+            LIST_CACHE.clear()
+        else:
+            path = os.path.abspath(listfile)
+            for key in [k for k in LIST_CACHE if k[0] == path]:
+                del LIST_CACHE[key]
+
+
+#######################################################################
+def _count_list_rows(fullnames):
+    """ Return number of fullnames in parsed list contents """
+    return sum(len(fnames) for fnames in fullnames.values())
+
+
+#######################################################################
+def _cache_list(key, fullnames):
+    """ Save parsed list contents in LIST_CACHE replacing older versions of
+        the same list and dropping least recently used lists while the cache
+        holds more than LIST_CACHE_MAX_ROWS fullnames """
+
+    nrows = _count_list_rows(fullnames)
+    if nrows > LIST_CACHE_MAX_ROWS:
+        return
+    with LIST_CACHE_LOCK:
+        for okey in [k for k in LIST_CACHE if k[0] == key[0] and k[1:3] != key[1:3]]:
+            del LIST_CACHE[okey]
+        LIST_CACHE[key] = fullnames
+        total = sum(_count_list_rows(fnames) for fnames in LIST_CACHE.values())
+        while total > LIST_CACHE_MAX_ROWS:
+            (_, oldest) = LIST_CACHE.popitem(last=False)
+            total -= _count_list_rows(oldest)
+
+
 #######################################################################
 def read_fullnames_from_listfile(listfile, linefmt, colstr):
-    """ Read a list file returning fullnames from the list """
+    """ Read a list file returning fullnames from the list
 
-    if miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
-        miscutils.fwdebug_print(f'colstr={colstr}')
+        Parsed lists are cached keyed by the list's path, modification
+        time, size, format and columns, keeping at most LIST_CACHE_MAX_ROWS
+        fullnames of the most recently used lists """
+
+    try:
+        sinfo = os.stat(listfile)
+    except OSError:
+        return _read_fullnames_from_listfile(listfile, linefmt, colstr)
+
+    key = (os.path.abspath(listfile), sinfo.st_mtime_ns, sinfo.st_size, linefmt,
+           colstr if isinstance(colstr, str) else tuple(colstr))
+    with LIST_CACHE_LOCK:
+        fullnames = LIST_CACHE.get(key)
+        if fullnames is not None:
+            LIST_CACHE.move_to_end(key)
+    if fullnames is not None:
+        if intgtrace.INTGMISC_DEBUG >= 3:
+            miscutils.fwdebug_print(f'INFO: using cached contents of list {listfile}')
+    else:
+        fullnames = _read_fullnames_from_listfile(listfile, linefmt, colstr)
+        _cache_list(key, fullnames)
+
+    # copy so callers cannot change cached lists
+    return {fsect: list(fnames) for fsect, fnames in fullnames.items()}
+
+
+#######################################################################
+def get_list_fullname_columns(colstr):
+    """ Return dict of column position to file section for fullname columns """
 
     columns = convert_col_string_to_list(colstr, False)
 
-    if miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
+    if intgtrace.INTGMISC_DEBUG >= 3:
         miscutils.fwdebug_print(f'columns={columns}')
 
-    fullnames = {}
-    pos2fsect = {}
+    pos2fsect = collections.OrderedDict()
     for i, col in enumerate(columns):
         lcol = col.lower()
         if lcol.endswith('.fullname'):
-            filesect = lcol[:-9]
-            pos2fsect[i] = filesect
-            fullnames[filesect] = []
+            pos2fsect[i] = lcol[:-9]
         # else a data column instead of a filename
+    return pos2fsect
+
+
+#######################################################################
+def split_list_line(line, delim):
+    """ Split a stripped list line like fwsplit, skipping fwsplit if nothing
+        in the line needs its special handling (ranges, parens) """
+
+    if '(' in line or ')' in line or ':' in line:
+        return miscutils.fwsplit(line, delim)
+    return [x.strip() for x in line.split(delim)]
+
+
+#######################################################################
+def parse_list_fullname(value):
+    """ Return fullname for a single list cell removing any hdu """
+
+    # use common routine to parse actual fullname (e.g., remove [0])
+    parsemask = miscutils.CU_PARSE_PATH | miscutils.CU_PARSE_FILENAME | \
+                miscutils.CU_PARSE_COMPRESSION
+    (path, filename, compression) = parse_fullname(value, parsemask)
+    fname = f"{path}/{filename}"
+    if compression is not None:
+        fname += compression
+    return fname
 
-    if miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
-        miscutils.fwdebug_print(f'pos2fsect={pos2fsect}')
+
+#######################################################################
+def parse_list_fullnames(values):
+    """ Return fullnames for a chunk of list cells removing any hdu
+
+        If every cell is a plain path/filename with an optional [N] hdu,
+        the whole chunk is handled with single regex passes, otherwise
+        each cell goes through parse_list_fullname """
+
+    if not values:
+        return []
+    chunk = '\n'.join(values)
+    if FAST_FULLNAMES_RE.fullmatch(chunk):
+        return HDU_SUFFIX_RE.sub('', chunk).split('\n')
+    return [parse_list_fullname(value) for value in values]
+
+
+#######################################################################
+def open_listfile(listfile):
+    """ Open list file for reading as text, decompressing it while reading
+        if it is gzip, bzip2 or xz compressed (regardless of its name) """
+
+    with open(listfile, 'rb') as listfh:
+        magic = listfh.read(6)
+
+    for (pattern, module) in LIST_COMPRESSIONS:
+        if pattern.match(magic):
+            if intgtrace.INTGMISC_DEBUG >= 3:
+                miscutils.fwdebug_print(f'INFO: reading {module.__name__} compressed list {listfile}')
+            return module.open(listfile, 'rt')
+    return open(listfile, 'r')
+
+
+#######################################################################
+def _iter_list_chunks(listfile, linefmt, positions, chunksize):
+    """ Yield dict of column position to fullnames for each chunk of lines """
+
+    if linefmt not in LIST_DELIMS:
+        miscutils.fwdie(f'Error:  unknown linefmt ({linefmt})', 1)
+    delim = LIST_DELIMS[linefmt]
+    special = LIST_SPECIAL_CHARS.replace(delim, '')
+
+    with open_listfile(listfile) as listfh:
+        while True:
+            lines = list(itertools.islice(listfh, chunksize))
+            if not lines:
+                break
+            text = ''.join(lines)
+            if any(char in text for char in special):
+                rows = [split_list_line(line.strip(), delim) for line in lines]
+            else:   # no cell needs stripping
+                rows = [line.strip().split(delim) for line in lines]
+            yield {pos: parse_list_fullnames([row[pos] for row in rows]) for pos in positions}
+
+
+#######################################################################
+def read_listfile_columns(listfile, linefmt, colstr, chunksize=LIST_CHUNK_LINES):
+    """ Return dict of file section to list of fullnames read from a text list """
+
+    pos2fsect = get_list_fullname_columns(colstr)
+    fullnames = {fsect: [] for fsect in pos2fsect.values()}
+    for chunk in _iter_list_chunks(listfile, linefmt, pos2fsect, chunksize):
+        for pos, fnames in chunk.items():
+            fullnames[pos2fsect[pos]].extend(fnames)
+    return fullnames
+
+
+#######################################################################
+def iter_listfile_fullnames(listfile, linefmt, colstr, chunksize=LIST_CHUNK_LINES):
+    """ Generator yielding a tuple of fullnames per line of a text list
+
+        Tuple is in order of the fullname columns in colstr (see
+        get_list_fullname_columns) """
+
+    positions = list(get_list_fullname_columns(colstr))
+    for chunk in _iter_list_chunks(listfile, linefmt, positions, chunksize):
+        yield from zip(*[chunk[pos] for pos in positions])
+
+
+#######################################################################
+def iter_wcl_list_lines(listfh, filename='stdin'):
+    """ Generator yielding (line label, dict of file label to file info) for
+        each <line> of a WCL format list (e.g., from queryutils.output_lines_wcl)
+
+        Only the list/line sections are kept, one line at a time, instead of
+        reading the whole file into a WCL object.   Includes are not supported. """
+
+    stack = []          # (section key, whether opened as sublabel)
+    lineinfo = None
+    fileinfo = None
+    linecnt = 0
+    for line in listfh:
+        linecnt += 1
+        line = line.strip()
+        while line.endswith('\\'):
+            line = line[:-1] + next(listfh, '').strip()
+            linecnt += 1
+        line = line.split('#')[0].strip()
+        if not line:
+            continue
+
+        if line.startswith('</'):
+            key = line[2:-1].strip().lower()
+            if stack and stack[-1][0] == key:
+                stack.pop()
+            elif len(stack) > 1 and stack[-1][1] and stack[-2][0] == key:
+                del stack[-2:]
+            else:
+                raise SyntaxError(f'File {filename} Line {linecnt:d} - Error:  Invalid or missing section' +
+                                  f' close.   Got close for {key}.')
+            if len(stack) < 3 and lineinfo is not None:
+                yield lineinfo
+                lineinfo = None
+            elif len(stack) < 5:
+                fileinfo = None
+        elif line.startswith('<') and line.endswith('>') and not line.startswith('<<'):
+            parts = line[1:-1].split()
+            stack.append((parts[0].lower(), False))
+            if len(parts) > 1:
+                stack.append((parts[1].lower(), True))
+            keys = [k for (k, _) in stack]
+            if len(stack) == 3 and keys[:2] == ['list', intgdefs.LISTENTRY]:
+                lineinfo = (keys[2], collections.OrderedDict())
+            elif len(stack) == 5 and lineinfo is not None and keys[3] == 'file':
+                fileinfo = {}
+                lineinfo[1][keys[4]] = fileinfo
+        elif fileinfo is not None and len(stack) == 5:
+            patmatch = re.match(r"(\S+)\s*=\s*(.*)$", line) or re.match(r"(\S+)\s+(.*)$", line)
+            if patmatch is not None:
+                fileinfo[patmatch.group(1).lower()] = patmatch.group(2).strip()
+
+    if stack:
+        raise SyntaxError(f"File {filename} - missing section closing line.")
+
+
+#######################################################################
+def get_wcl_list_fullname(fileinfo):
+    """ Return fullname for file info from a WCL list removing any hdu """
+
+    if 'fullname' in fileinfo:
+        return parse_list_fullname(fileinfo['fullname'])
+    fname = f"{fileinfo['path']}/{fileinfo['filename']}"
+    if fileinfo.get('compression'):
+        fname += fileinfo['compression']
+    return fname
+
+
+#######################################################################
+def iter_wcl_listfile_fullnames(listfile, colstr):
+    """ Generator yielding a tuple of fullnames per line of a WCL format list
+
+        Tuple is in order of the fullname columns in colstr.  Columns are
+        matched to the line's files by file label, or if the line has a single
+        file and there is a single fullname column, that file is used. """
+
+    fsects = list(get_list_fullname_columns(colstr).values())
+    with open_listfile(listfile) as listfh:
+        for (lname, files) in iter_wcl_list_lines(listfh, listfile):
+            fnames = []
+            for fsect in fsects:
+                if fsect in files:
+                    fileinfo = files[fsect]
+                elif len(files) == 1 and len(fsects) == 1:
+                    fileinfo = next(iter(files.values()))
+                else:
+                    raise KeyError(f"Error: Could not find file {fsect} in line {lname} of {listfile}")
+                fnames.append(get_wcl_list_fullname(fileinfo))
+            yield tuple(fnames)
+
+
+#######################################################################
+def read_wcl_listfile_columns(listfile, colstr):
+    """ Return dict of file section to list of fullnames read from a WCL list """
+
+    fsects = list(get_list_fullname_columns(colstr).values())
+    fullnames = {fsect: [] for fsect in fsects}
+    for fnames in iter_wcl_listfile_fullnames(listfile, colstr):
+        for fsect, fname in zip(fsects, fnames):
+            fullnames[fsect].append(fname)
+    return fullnames
+
+
+#######################################################################
+def _read_fullnames_from_listfile(listfile, linefmt, colstr):
+    """ Read a list file returning fullnames from the list """
+
+    if intgtrace.INTGMISC_DEBUG >= 3:
+        miscutils.fwdebug_print(f'colstr={colstr}')
 
     if linefmt in ['config', 'wcl']:
-        miscutils.fwdie(f'Error:  wcl list format not currently supported ({listfile})', 1)
+        fullnames = read_wcl_listfile_columns(listfile, colstr)
     else:
-        with open(listfile, 'r') as listfh:
-            for line in listfh:
-                line = line.strip()
-
-                # convert line into python list
-                lineinfo = []
-                if linefmt == 'textcsv':
-                    lineinfo = miscutils.fwsplit(line, ',')
-                elif linefmt == 'texttab':
-                    lineinfo = miscutils.fwsplit(line, '\t')
-                elif linefmt == 'textsp':
-                    lineinfo = miscutils.fwsplit(line, ' ')
-                else:
-                    miscutils.fwdie(f'Error:  unknown linefmt ({linefmt})', 1)
-
-                # save each fullname in line
-                for pos in pos2fsect:
-                    # use common routine to parse actual fullname (e.g., remove [0])
-                    parsemask = miscutils.CU_PARSE_PATH | miscutils.CU_PARSE_FILENAME | \
-                                miscutils.CU_PARSE_COMPRESSION
-                    (path, filename, compression) = miscutils.parse_fullname(lineinfo[pos],
-                                                                             parsemask)
-                    fname = f"{path}/{filename}"
-                    if compression is not None:
-                        fname += compression
-                    fullnames[pos2fsect[pos]].append(fname)
-
-    if miscutils.fwdebug_check(6, 'INTGMISC_DEBUG'):
+        fullnames = read_listfile_columns(listfile, linefmt, colstr)
+
+    if intgtrace.INTGMISC_DEBUG >= 6:
         miscutils.fwdebug_print(f'fullnames = {fullnames}')
     return fullnames
 
@@ -180,7 +1113,7 @@ def get_list_fullnames(sect, modwcl):
 
     # check list itself exists
     listname = ldict['fullname']
-    if miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
+    if intgtrace.INTGMISC_DEBUG >= 3:
         miscutils.fwdebug_print(f"\tINFO: Checking existence of '{listname}'")
 
     if not os.path.exists(listname):
@@ -196,13 +1129,13 @@ def get_list_fullnames(sect, modwcl):
 
     # read fullnames from list file
     fullnames = read_fullnames_from_listfile(listname, listfmt, ldict['columns'])
-    if miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
+    if intgtrace.INTGMISC_DEBUG >= 3:
         miscutils.fwdebug_print(f"\tINFO: fullnames={fullnames}")
 
     if filesect not in fullnames:
         columns = convert_col_string_to_list(ldict['columns'], False)
 
-        if miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
+        if intgtrace.INTGMISC_DEBUG >= 3:
             miscutils.fwdebug_print('columns={columns}')
 
         hasfullname = False
@@ -214,7 +1147,7 @@ def get_list_fullnames(sect, modwcl):
             miscutils.fwdebug_print(f"ERROR: Could not find sect {filesect} in list")
             miscutils.fwdebug_print(f"\tcolumns = {columns}")
             miscutils.fwdebug_print(f"\tlist keys = {list(fullnames.keys())}")
-        elif miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
+        elif intgtrace.INTGMISC_DEBUG >= 3:
             miscutils.fwdebug_print(f"WARN: Could not find sect {filesect} in fullname list.   Not a problem if list (sect) has only data.")
     else:
         setfnames = set(fullnames[filesect])
@@ -222,21 +1155,22 @@ def get_list_fullnames(sect, modwcl):
 
 
 ######################################################################
-def get_file_fullnames(sect, filewcl, fullwcl):
-    """ get list of full names """
+def get_file_fullnames(sect, filewcl, fullwcl, opts=None):
+    """ get list of full names (opts are passed to replace_vars) """
     sectkeys = sect.split('.')
     sectname = sectkeys[1]
 
-    if miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
+    if intgtrace.INTGMISC_DEBUG >= 3:
         miscutils.fwdebug_print(f"INFO: Beg sectname={sectname}")
 
     fnames = []
     if sectname in filewcl:
         filesect = filewcl[sectname]
         if 'fullname' in filesect:
-            fnames = replfuncs.replace_vars(filesect['fullname'], fullwcl)[0]
+            fnames = replfuncs.replace_vars(filesect['fullname'], fullwcl,
+                                            copy.copy(opts) if opts is not None else None)[0]
             fnames = miscutils.fwsplit(fnames, ',')
-            if miscutils.fwdebug_check(3, 'INTGMISC_DEBUG'):
+            if intgtrace.INTGMISC_DEBUG >= 3:
                 miscutils.fwdebug_print(f"INFO: fullname = {fnames}")
 
     return set(fnames)
@@ -244,8 +1178,10 @@ def get_file_fullnames(sect, filewcl, fullwcl):
 
 
 ######################################################################
-def get_fullnames(modwcl, fullwcl, exsect=None, get_inputs=True, get_outputs=True):
-    """ Return dictionaries of input and output fullnames by section """
+def get_fullnames(modwcl, fullwcl, exsect=None, get_inputs=True, get_outputs=True, opts=None):
+    """ Return dictionaries of input and output fullnames by section
+
+        opts are passed to replace_vars when replacing variables in fullnames """
 
     exec_sectnames = []
     if exsect is None:
@@ -259,14 +1195,14 @@ def get_fullnames(modwcl, fullwcl, exsect=None, get_inputs=True, get_outputs=Tru
     outputs = {}
     allouts = set()
     if get_outputs:
-        for _exsect in sorted(exec_sectnames):
+        for _exsect in exec_sectnames:
             exwcl = modwcl[_exsect]
             if intgdefs.IW_OUTPUTS in exwcl:
                 for sect in miscutils.fwsplit(exwcl[intgdefs.IW_OUTPUTS], ','):
                     sectkeys = sect.split('.')
                     outset = None
                     if sectkeys[0] == intgdefs.IW_FILE_SECT:
-                        outset = get_file_fullnames(sect, modwcl[intgdefs.IW_FILE_SECT], fullwcl)
+                        outset = get_file_fullnames(sect, modwcl[intgdefs.IW_FILE_SECT], fullwcl, opts)
                     elif sectkeys[0] == intgdefs.IW_LIST_SECT:
                         print('   ----   ' + sect)
                         _, outset = get_list_fullnames(sect, modwcl)
@@ -287,7 +1223,7 @@ def get_fullnames(modwcl, fullwcl, exsect=None, get_inputs=True, get_outputs=Tru
                     sectkeys = sect.split('.')
                     inset = None
                     if sectkeys[0] == intgdefs.IW_FILE_SECT:
-                        inset = get_file_fullnames(sect, modwcl[intgdefs.IW_FILE_SECT], fullwcl)
+                        inset = get_file_fullnames(sect, modwcl[intgdefs.IW_FILE_SECT], fullwcl, opts)
                     elif sectkeys[0] == intgdefs.IW_LIST_SECT:
                         _, inset = get_list_fullnames(sect, modwcl)
                         #inset.add(listname)
@@ -0,0 +1,47 @@
+"""
+Debug levels for intgutils subsystems resolved once instead of on every check
+
+Hot loops test a precomputed module-level level, e.g.
+    if intgtrace.REPL_DEBUG >= 6:
+which is equivalent to miscutils.fwdebug_check(6, 'REPL_DEBUG') as of the last
+call to reconfigure().   Call reconfigure() after changing debug environment
+variables.
+"""
+
+import despymisc.miscutils as miscutils
+
+# highest debug level probed
+MAX_LEVEL = 10
+
+# debug environment variables whose levels are precomputed
+SUBSYSTEMS = ['DEBUG', 'REPL_DEBUG', 'WCL_DEBUG', 'INTGMISC_DEBUG', 'BASICWRAP_DEBUG']
+
+# current debug level of each subsystem (-1 means even level 0 checks are off)
+DEBUG = -1
+REPL_DEBUG = -1
+WCL_DEBUG = -1
+INTGMISC_DEBUG = -1
+BASICWRAP_DEBUG = -1
+
+
+#######################################################################
+def get_level(envdbgvar):
+    """ Return highest level for which fwdebug_check passes for envdbgvar """
+
+    level = -1
+    for lvl in range(MAX_LEVEL + 1):
+        if not miscutils.fwdebug_check(lvl, envdbgvar):
+            break
+        level = lvl
+    return level
+
+
+#######################################################################
+def reconfigure():
+    """ Re-read debug levels of all subsystems """
+
+    for name in SUBSYSTEMS:
+        globals()[name] = get_level(name)
+
+
+reconfigure()
@@ -7,21 +7,240 @@
 
 """ Functions to replace variables in a string with their values from a isinstance(dict) object """
 
+import os
 import copy
 import re
+import time
+import atexit
+import multiprocessing
+import collections.abc
 from astropy.io import fits
 
 import despymisc.miscutils as miscutils
 import intgutils.intgdefs as intgdefs
+import intgutils.intgtrace as intgtrace
 import despyfitsutils.fitsutils as fitsutils
 
-def replace_vars_single(instr, valdict, opts=None):
+
+class KeepMap(collections.abc.Mapping):
+    """ Immutable mapping of kept variable values used while expanding loops
+
+        bind() returns a new KeepMap with one more value which shares all
+        existing values with its parent instead of copying them, so expanding
+        many loop combinations does not copy every prior value per combination.
+        Use to_dict() (or dict()) to get a plain dict. """
+
+    __slots__ = ('_parent', '_key', '_val', '_base')
+
+    def __init__(self, base=None):
+        self._parent = None
+        self._key = None
+        self._val = None
+        self._base = dict(base) if base else {}
+
+    def bind(self, key, val):
+        """ Return new KeepMap with key set to val """
+        node = KeepMap.__new__(KeepMap)
+        node._parent = self
+        node._key = key
+        node._val = val
+        node._base = None
+        return node
+
+    def __getitem__(self, key):
+        node = self
+        while node._parent is not None:
+            if node._key == key:
+                return node._val
+            node = node._parent
+        return node._base[key]
+
+    def to_dict(self):
+        """ Return values as a plain dict """
+        chain = []
+        node = self
+        while node._parent is not None:
+            chain.append(node)
+            node = node._parent
+        result = dict(node._base)
+        for node in reversed(chain):
+            result[node._key] = node._val
+        return result
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __repr__(self):
+        return f"KeepMap({self.to_dict()!r})"
+
+
+class VariableCycleError(Exception):
+    """ Variables reference each other in a cycle so can never be fully replaced """
+
+    def __init__(self, path):
+        self.path = list(path)
+        Exception.__init__(self, f"Error: variable cycle found ({' -> '.join(self.path)})")
+
+
+# worker pool used to evaluate $FUNC calls when opts[intgdefs.FUNC_WORKERS] is set
+FUNC_POOL = None
+FUNC_POOL_SIZE = 0
+
+# $HEAD values: (absolute filename, header key) -> (file id when read, value)
+HEADER_CACHE = collections.OrderedDict()
+HEADER_CACHE_SIZE = 10000
+
+
+def get_file_id(fname):
+    """ Return (mtime, size, inode) identifying version of file or None if missing """
+
+    try:
+        fstat = os.stat(fname)
+    except OSError:
+        return None
+    return (fstat.st_mtime_ns, fstat.st_size, fstat.st_ino)
+
+
+def get_header_values(fname, keys):
+    """ Return list of string values of header keys in fits file
+
+        Values are cached until the file changes, so the file is only opened
+        if it has a key not read before. """
+
+    path = os.path.abspath(fname)
+    fileid = get_file_id(path)
+    values = {}
+    if fileid is not None:
+        for key in keys:
+            entry = HEADER_CACHE.get((path, key))
+            if entry is not None and entry[0] == fileid:
+                HEADER_CACHE.move_to_end((path, key))
+                values[key] = entry[1]
+
+    if len(values) < len(set(keys)):
+        hdulist = fits.open(fname, 'readonly')
+        try:
+            for key in keys:
+                if key not in values:
+                    if intgtrace.REPL_DEBUG >= 0:
+                        miscutils.fwdebug_print(f"\tHEAD variable header key: {key} ")
+                    values[key] = str(fitsutils.get_hdr_value(hdulist, key))
+                    if fileid is not None:
+                        HEADER_CACHE[(path, key)] = (fileid, values[key])
+        finally:
+            hdulist.close()
+        while len(HEADER_CACHE) > HEADER_CACHE_SIZE:
+            HEADER_CACHE.popitem(last=False)
+
+    return [values[key] for key in keys]
+
+
+def _call_func(funcinfo, args):
+    """ Evaluate a single $FUNC (runs inside a pool worker) """
+    specf = miscutils.dynamically_load_class(funcinfo)
+    return specf(args)
+
+
+def get_func_pool(nworkers):
+    """ Return worker pool for $FUNC calls, (re)creating it if size changed """
+    global FUNC_POOL, FUNC_POOL_SIZE   # pylint: disable=global-statement
+
+    if FUNC_POOL is not None and FUNC_POOL_SIZE != nworkers:
+        shutdown_func_pool()
+    if FUNC_POOL is None:
+        FUNC_POOL = multiprocessing.Pool(nworkers)
+        FUNC_POOL_SIZE = nworkers
+    return FUNC_POOL
+
+
+def shutdown_func_pool(terminate=False):
+    """ Stop the $FUNC worker pool if one is running """
+    global FUNC_POOL, FUNC_POOL_SIZE   # pylint: disable=global-statement
+
+    if FUNC_POOL is not None:
+        if terminate:
+            FUNC_POOL.terminate()
+        else:
+            FUNC_POOL.close()
+        FUNC_POOL.join()
+    FUNC_POOL = None
+    FUNC_POOL_SIZE = 0
+
+
+def _forget_func_pool():
+    """ Drop the parent's $FUNC worker pool in a forked child (its workers
+        belong to the parent, so the child starts its own if needed) """
+    global FUNC_POOL, FUNC_POOL_SIZE   # pylint: disable=global-statement
+    FUNC_POOL = None
+    FUNC_POOL_SIZE = 0
+
+
+atexit.register(shutdown_func_pool, terminate=True)
+os.register_at_fork(after_in_child=_forget_func_pool)
+
+
+def get_func_workers(opts):
+    """ Return number of $FUNC pool workers requested in opts (0 = evaluate inline) """
+    nworkers = 0
+    if opts is not None and intgdefs.FUNC_WORKERS in opts and opts[intgdefs.FUNC_WORKERS]:
+        nworkers = int(opts[intgdefs.FUNC_WORKERS])
+    return nworkers
+
+
+def find_funcs(instr):
+    """ Return set of the $FUNC calls (function and arguments) in instr whose
+        arguments contain no variables """
+    return {var.split(':')[0] for var in re.findall(r"(?i)\$FUNC\{([^$}]+)\}", instr)}
+
+
+def eval_funcs(funcvars, opts, skip_errors=False):
+    """ Evaluate $FUNC variables concurrently in the worker pool returning dict of values
+
+        If skip_errors, calls which fail or time out are left out of the
+        returned values (e.g., when evaluating calls ahead of time, so that
+        failures are reported where the values are used).
+
+        opts[func_timeout] is the seconds all of the calls together may take. """
+
+    timeout = None
+    if intgdefs.FUNC_TIMEOUT in opts and opts[intgdefs.FUNC_TIMEOUT]:
+        timeout = float(opts[intgdefs.FUNC_TIMEOUT])
+
+    pool = get_func_pool(get_func_workers(opts))
+    deadline = time.time() + timeout if timeout is not None else None
+    pending = []
+    for newvar in funcvars:
+        varlist = miscutils.fwsplit(newvar, ',')
+        if intgtrace.REPL_DEBUG >= 1:
+            miscutils.fwdebug_print(f"\tdispatching FUNC to pool: {varlist[0]} ")
+        pending.append((newvar, pool.apply_async(_call_func, (varlist[0], varlist[1:]))))
+
+    # results are collected in dispatch order, all waits sharing one deadline
+    funcvals = {}
+    for newvar, result in pending:
+        wait = max(0., deadline - time.time()) if deadline is not None else None
+        try:
+            funcvals[newvar] = result.get(wait)
+        except multiprocessing.TimeoutError:
+            shutdown_func_pool(terminate=True)   # only way to stop a hung worker
+            if skip_errors:
+                break
+            raise TimeoutError(f"Error: $FUNC{{{newvar}}} did not finish within {timeout} seconds")
+        except Exception:
+            if not skip_errors:
+                raise
+    return funcvals
+
+def replace_vars_single(instr, valdict, opts=None, stack=None):
     """ Return single instr after replacing vars """
 
     assert isinstance(instr, str)
     #assert(isinstance(valdict, dict))
 
-    values, _ = replace_vars(instr, valdict, opts)
+    values, _ = replace_vars(instr, valdict, opts, stack)
 
     retval = None
     if isinstance(values, list):
@@ -38,26 +257,42 @@ def replace_vars_single(instr, valdict, opts=None):
     return retval
 
 
-def replace_vars_type(instr, valdict, required, stype, opts=None):
-    """ Search given string for variables of 1 type and replace """
+def check_cycle(stack, name):
+    """ Raise VariableCycleError if name is already being resolved """
+    if name in stack:
+        raise VariableCycleError(stack[stack.index(name):] + [name])
+
+
+def replace_vars_type(instr, valdict, required, stype, opts=None, stack=None):
+    """ Search given string for variables of 1 type and replace
+
+        stack is the list of variables whose values are being replaced (e.g.,
+        instr is the value of the last variable in stack).   Values are fully
+        replaced before being inserted so a variable recurring within its own
+        value raises VariableCycleError instead of looping forever. """
 
     assert isinstance(instr, str)
     #assert(isinstance(valdict, dict))
 
+    if stack is None:
+        stack = []
+
     keep = {}
     done = True
-    maxtries = 100    # avoid infinite loop
-    count = 0
 
     newstr = copy.copy(instr)
 
     # be careful of nested variables  ${RMS_${BAND}}
     varpat = fr"(?i)\${stype}\{{([^$}}]+)\}}"
 
-    match_var = re.search(varpat, newstr)
-    while match_var and count < maxtries:
-        count += 1
+    # values of $FUNC calls evaluated in the worker pool, starting with any
+    # evaluated ahead of time (e.g., by WCL.eval_funcs)
+    funcvals = None
+    if stype == 'FUNC' and get_func_workers(opts) > 0:
+        funcvals = dict(opts.get(intgdefs.FUNC_VALUES) or {})
 
+    match_var = re.search(varpat, newstr)
+    while match_var:
         # the string inside the curly braces
         var = match_var.group(1)
 
@@ -67,7 +302,7 @@ def replace_vars_type(instr, valdict, required, stype, opts=None):
         # variable name to replace
         newvar = parts[0]
 
-        if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+        if intgtrace.REPL_DEBUG >= 6:
             miscutils.fwdebug_print(f"\t newstr: {newstr} ")
             miscutils.fwdebug_print(f"\t var: {var} ")
             miscutils.fwdebug_print(f"\t parts: {parts} ")
@@ -75,34 +310,34 @@ def replace_vars_type(instr, valdict, required, stype, opts=None):
 
         # find the variable's value
         if stype == 'HEAD':
-            if miscutils.fwdebug_check(0, 'REPL_DEBUG'):
+            if intgtrace.REPL_DEBUG >= 0:
                 miscutils.fwdebug_print(f"\tfound HEAD variable to expand: {newvar} ")
 
             varlist = miscutils.fwsplit(newvar, ',')
             fname = varlist[0]
-            if miscutils.fwdebug_check(0, 'REPL_DEBUG'):
+            if intgtrace.REPL_DEBUG >= 0:
                 miscutils.fwdebug_print(f"\tHEAD variable fname: {fname} ")
-            hdulist = fits.open(fname, 'readonly')
-            newval = []
-            for key in varlist[1:]:
-                if miscutils.fwdebug_check(0, 'REPL_DEBUG'):
-                    miscutils.fwdebug_print(f"\tHEAD variable header key: {key} ")
-                newval.append(str(fitsutils.get_hdr_value(hdulist, key)))
+            newval = get_header_values(fname, varlist[1:])
             miscutils.fwdebug_print(f"\tnewval: {newval} ")
             newval = ','.join(newval)
             haskey = True
-            hdulist.close()
         elif stype == 'FUNC':
-            if miscutils.fwdebug_check(1, 'REPL_DEBUG'):
+            if intgtrace.REPL_DEBUG >= 1:
                 miscutils.fwdebug_print(f"\tfound FUNC variable to expand: {newvar} ")
 
             varlist = miscutils.fwsplit(newvar, ',')
             funcinfo = varlist[0]
-            if miscutils.fwdebug_check(1, 'REPL_DEBUG'):
+            if intgtrace.REPL_DEBUG >= 1:
                 miscutils.fwdebug_print(f"\tFUNC info: {funcinfo} ")
 
-            specf = miscutils.dynamically_load_class(funcinfo)
-            newval = specf(varlist[1:])
+            if funcvals is not None:
+                if newvar not in funcvals:
+                    # dispatch every FUNC currently in string so they run concurrently
+                    funcvals.update(eval_funcs(find_funcs(newstr) - set(funcvals), opts))
+                newval = funcvals[newvar]
+            else:
+                specf = miscutils.dynamically_load_class(funcinfo)
+                newval = specf(varlist[1:])
             haskey = True
         elif hasattr(valdict, 'search'):
             (haskey, newval) = valdict.search(newvar, opts)
@@ -112,7 +347,7 @@ def replace_vars_type(instr, valdict, required, stype, opts=None):
                 haskey = True
                 newval = valdict[newvar]
 
-        if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+        if intgtrace.REPL_DEBUG >= 6:
             miscutils.fwdebug_print(f"\t newvar: {newvar} ")
             miscutils.fwdebug_print(f"\t haskey: {haskey} ")
             try:  # newval may be undefined
@@ -123,21 +358,28 @@ def replace_vars_type(instr, valdict, required, stype, opts=None):
         if haskey:
             newval = str(newval)
 
+            # name of value being resolved, used to detect cycles
+            if stype in ['', 'opt']:
+                stackname = newvar.lower()
+            else:
+                stackname = f"${stype}{{{newvar}}}"
+            check_cycle(stack, stackname)
+
             # check if a multiple value variable (e.g., band, ccdnum)
             if newval.startswith('(') or ',' in newval:
-                if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+                if intgtrace.REPL_DEBUG >= 6:
                     miscutils.fwdebug_print(f"\tfound val to expand: {newval} ")
                     miscutils.fwdebug_print(f"\tfound val to expand: opts={opts} ")
 
                 if opts is not None and 'expand' in opts and opts['expand']:
                     newval = f'$LOOP{{{var}}}'   # postpone for later expanding
 
-                if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+                if intgtrace.REPL_DEBUG >= 6:
                     miscutils.fwdebug_print(f"\tLOOP? newval = {newval}")
             elif len(parts) > 1:
                 prpat = f"{{:0{int(parts[1]):d}d}}"
                 try:
-                    keepval = replace_vars_single(newval, valdict, opts)
+                    keepval = replace_vars_single(newval, valdict, opts, stack + [stackname])
                     keep[newvar] = keepval
                     newval = prpat.format(int(keepval))
                 except (TypeError, ValueError) as err:
@@ -149,13 +391,23 @@ def replace_vars_type(instr, valdict, required, stype, opts=None):
             else:
                 keep[newvar] = newval
 
-            newstr = re.sub(fr"(?i)\${stype}{{{var}}}", newval, newstr)
+            # replace variables inside value before inserting it
+            if '$' in newval and not newval.startswith('$LOOP{'):
+                if stype == 'FUNC':
+                    (_, newval, keep2) = replace_vars_type(newval, valdict, True, 'FUNC', opts,
+                                                           stack + [stackname])
+                else:
+                    (newval, keep2) = replace_vars_nonfunc(newval, valdict, opts,
+                                                           stack + [stackname])
+                keep.update(keep2)
+
+            newstr = re.sub(fr"(?i)\${stype}\{{{re.escape(var)}\}}", newval, newstr)
             done = False
         elif required:
             raise KeyError(f"Error: Could not find value for {newvar}")
         else:
             # missing optional value so replace with empty string
-            newstr = re.sub(fr"(?i)\${stype}{{{var}}}", "", newstr)
+            newstr = re.sub(fr"(?i)\${stype}\{{{re.escape(var)}\}}", "", newstr)
 
         match_var = re.search(varpat, newstr)
 
@@ -163,20 +415,39 @@ def replace_vars_type(instr, valdict, required, stype, opts=None):
 
 
 def replace_vars_loop(valpair, valdict, opts=None):
-    """ Expand variables that have multiple values (e.g., band, ccdnum) """
+    """ Expand variables that have multiple values (e.g., band, ccdnum)
 
-    #assert(isinstance(valdict, dict))
+        Returns list of values and list of dicts of the kept values.  Use
+        iter_replace_vars_loop to go through many combinations without
+        holding all of them. """
 
-    looptodo = [valpair]
     valuedone = []
     keepdone = []
-    maxtries = 100    # avoid infinite loop
-    count = 0
-    while looptodo and count < maxtries:
-        count += 1
+    for (value, keep) in iter_replace_vars_loop(valpair, valdict, opts):
+        valuedone.append(value)
+        keepdone.append(keep.to_dict())
+    return valuedone, keepdone
+
+
+def iter_replace_vars_loop(valpair, valdict, opts=None):
+    """ Generate (value, kept values) for each combination of the values of
+        the loop variables, in the order of replace_vars_loop
+
+        Combinations are expanded only as they are asked for, and the kept
+        values are KeepMaps sharing values between combinations. """
+
+    #assert(isinstance(valdict, dict))
+
+    if not isinstance(valpair[1], KeepMap):
+        valpair = (valpair[0], KeepMap(valpair[1]))
+
+    looptodo = [valpair]
+    numdone = 0
+    looprefs = {}    # loop variable -> loop variables appearing in its values
+    while looptodo:
         valpair = looptodo.pop()
 
-        if miscutils.fwdebug_check(3, 'REPL_DEBUG'):
+        if intgtrace.REPL_DEBUG >= 3:
             miscutils.fwdebug_print(f"looptodo: valpair[0] = {valpair[0]}")
 
         match_loop = re.search(r"(?i)\$LOOP\{([^}]+)\}", valpair[0])
@@ -185,19 +456,26 @@ def replace_vars_loop(valpair, valdict, opts=None):
         parts = var.split(':')
         newvar = parts[0]
 
-        if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+        if intgtrace.REPL_DEBUG >= 6:
             miscutils.fwdebug_print(f"\tloop search: newvar= {newvar}")
             miscutils.fwdebug_print(f"\tloop search: opts= {opts}")
 
         (haskey, newval, ) = valdict.search(newvar, opts)
 
         if haskey:
-            if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+            if intgtrace.REPL_DEBUG >= 6:
                 miscutils.fwdebug_print(f"\tloop search results: newva1= {newval}")
 
             newvalarr = miscutils.fwsplit(newval)
+
+            # a loop value referring back to its own variable would never finish
+            if newvar not in looprefs:
+                looprefs[newvar] = {m.split(':')[0] for nval in newvalarr
+                                    for m in re.findall(r"(?i)\$LOOP\{([^}]+)\}", nval)}
+                find_loop_cycle(looprefs, newvar)
+
             for nval in newvalarr:
-                if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+                if intgtrace.REPL_DEBUG >= 6:
                     miscutils.fwdebug_print("\tloop nv: nval={nval}")
 
                 kval = nval    # save unpadded value for keep
@@ -212,95 +490,104 @@ def replace_vars_loop(valpair, valdict, opts=None):
                         miscutils.fwdebug_print(f"\topts = {opts}")
                         raise err
 
-                if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+                if intgtrace.REPL_DEBUG >= 6:
                     miscutils.fwdebug_print(f"\tloop nv2: nval={nval}")
                     miscutils.fwdebug_print(f"\tbefore loop sub: valpair[0]={valpair[0]}")
 
-                valsub = re.sub(fr"(?i)\$LOOP\{{{var}\}}", nval, valpair[0])
-                keep = copy.deepcopy(valpair[1])
-                keep[newvar] = kval
-                if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+                valsub = re.sub(fr"(?i)\$LOOP\{{{re.escape(var)}\}}", nval, valpair[0])
+                keep = valpair[1].bind(newvar, kval)
+                if intgtrace.REPL_DEBUG >= 6:
                     miscutils.fwdebug_print(f"\tafter loop sub: valsub={valsub}")
                 if '$LOOP{' in valsub:
-                    if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+                    if intgtrace.REPL_DEBUG >= 6:
                         miscutils.fwdebug_print("\t\tputting back in todo list")
                     looptodo.append((valsub, keep))
                 else:
-                    valuedone.append(valsub)
-                    keepdone.append(keep)
-                    if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
-                        miscutils.fwdebug_print("\t\tputting back in done list")
-        if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+                    numdone += 1
+                    if intgtrace.REPL_DEBUG >= 6:
+                        miscutils.fwdebug_print("\t\treturning done value")
+                    yield (valsub, keep)
+        if intgtrace.REPL_DEBUG >= 6:
             miscutils.fwdebug_print(f"\tNumber in todo list = {len(looptodo)}")
-            miscutils.fwdebug_print(f"\tNumber in done list = {len(valuedone)}")
-    if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
-        miscutils.fwdebug_print(f"\tEND OF WHILE LOOP = {len(valuedone)}")
+            miscutils.fwdebug_print(f"\tNumber done = {numdone}")
+    if intgtrace.REPL_DEBUG >= 6:
+        miscutils.fwdebug_print(f"\tEND OF WHILE LOOP = {numdone}")
 
-    return valuedone, keepdone
 
+def find_loop_cycle(looprefs, start):
+    """ Raise VariableCycleError if start can reach itself through looprefs """
 
-def replace_vars(instr, valdict, opts=None):
-    """ Replace variables in given instr """
+    path = [start]
+    todo = [iter(looprefs.get(start, ()))]
+    while todo:
+        nextvar = next(todo[-1], None)
+        if nextvar is None:
+            todo.pop()
+            path.pop()
+        elif nextvar == start:
+            raise VariableCycleError(path + [start])
+        elif nextvar not in path:
+            path.append(nextvar)
+            todo.append(iter(looprefs.get(nextvar, ())))
 
-    assert isinstance(instr, str)
-    #assert(isinstance(valdict, dict))
 
-    newstr = copy.copy(instr)
-
-    if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
-        miscutils.fwdebug_print("BEG")
-        miscutils.fwdebug_print(f"\tinitial instr = '{instr}'")
-        #miscutils.fwdebug_print("\tvaldict = '%s'" % valdict)
-        miscutils.fwdebug_print(f"\tinitial opts = '{opts}'")
+def replace_vars_nonfunc(instr, valdict, opts=None, stack=None):
+    """ Replace all header, optional and required variables in instr """
 
+    newstr = instr
     keep = {}
-
-    maxtries = 100    # avoid infinite loop
-    count = 0
     done = False
-    while not done and count < maxtries:
-        count += 1
+    while not done:
         done = True
 
-
         # header vars ($HEAD{)
-        (done2, newstr, keep2) = replace_vars_type(newstr, valdict, True, 'HEAD', opts)
+        (done2, newstr, keep2) = replace_vars_type(newstr, valdict, True, 'HEAD', opts, stack)
         done = done and done2
         keep.update(keep2)
 
         # optional vars ($opt{)
-        (done2, newstr, keep2) = replace_vars_type(newstr, valdict, False, 'opt', opts)
+        (done2, newstr, keep2) = replace_vars_type(newstr, valdict, False, 'opt', opts, stack)
         done = done and done2
         keep.update(keep2)
 
         # required vars (${)
-        (done2, newstr, keep2) = replace_vars_type(newstr, valdict, True, '', opts)
+        (done2, newstr, keep2) = replace_vars_type(newstr, valdict, True, '', opts, stack)
         done = done and done2
         keep.update(keep2)
 
-    #print "keep = ", keep
+    return (newstr, keep)
 
-    if count >= maxtries:
-        raise Exception(f"Error: replace_vars function aborting from infinite loop '{instr}'")
+
+def replace_vars(instr, valdict, opts=None, stack=None):
+    """ Replace variables in given instr """
+
+    assert isinstance(instr, str)
+    #assert(isinstance(valdict, dict))
+
+    newstr = copy.copy(instr)
+
+    if intgtrace.REPL_DEBUG >= 6:
+        miscutils.fwdebug_print("BEG")
+        miscutils.fwdebug_print(f"\tinitial instr = '{instr}'")
+        #miscutils.fwdebug_print("\tvaldict = '%s'" % valdict)
+        miscutils.fwdebug_print(f"\tinitial opts = '{opts}'")
+
+    (newstr, keep) = replace_vars_nonfunc(newstr, valdict, opts, stack)
+
+    #print "keep = ", keep
 
     ##### FUNC
-    maxtries = 100    # avoid infinite loop
-    count = 0
     done = False
-    while not done and count < maxtries:
-        count += 1
+    while not done:
         done = True
 
         # func vars ($FUNC{)
-        (done2, newstr, keep2) = replace_vars_type(newstr, valdict, True, 'FUNC', opts)
+        (done2, newstr, keep2) = replace_vars_type(newstr, valdict, True, 'FUNC', opts, stack)
         done = done and done2
         keep.update(keep2)
 
     #print "keep = ", keep
 
-    if count >= maxtries:
-        raise Exception(f"Error: replace_vars function aborting from infinite loop '{instr}'")
-
 
     #####
     valpair = (newstr, keep)
@@ -314,7 +601,7 @@ def replace_vars(instr, valdict, opts=None):
         valuedone, keepdone = replace_vars_loop(valpair, valdict, opts)
 
 
-    if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+    if intgtrace.REPL_DEBUG >= 6:
         miscutils.fwdebug_print(f"\tvaluedone = {valuedone}")
         miscutils.fwdebug_print(f"\tkeepdone = {keepdone}")
         miscutils.fwdebug_print(f"\tvaluepair = {str(valpair)}")
@@ -326,8 +613,8 @@ def replace_vars(instr, valdict, opts=None):
     else:
         val2return = valpair
 
-    if miscutils.fwdebug_check(6, 'REPL_DEBUG'):
+    if intgtrace.REPL_DEBUG >= 6:
         miscutils.fwdebug_print(f"\tval2return = {str(val2return)}")
-    if miscutils.fwdebug_check(5, 'REPL_DEBUG'):
+    if intgtrace.REPL_DEBUG >= 5:
         miscutils.fwdebug_print("END")
     return val2return
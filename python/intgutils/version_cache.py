@@ -0,0 +1,127 @@
+"""
+On-disk cache of versions reported by executables
+
+Running "<execname> <version_flag>" can be expensive (e.g., loading large
+libraries just to print a version).  The version found is saved in a json file
+keyed by the resolved executable path, its inode, modification time and size,
+and the version flag and pattern, so that any change to the executable (or to
+how its version is found) misses the cache.  Writers hold an exclusive flock on
+filename + '.lock' and atomically replace the cache file, so concurrent jobs
+sharing one cache never see partial contents.
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import tempfile
+
+import despymisc.miscutils as miscutils
+from intgutils import intgtrace
+
+# suffix of file locked while updating the cache file
+LOCK_SUFFIX = '.lock'
+
+
+#######################################################################
+def get_exec_key(execname, verflag, verpat):
+    """ Return cache key for version of execname found with verflag and verpat,
+        or None if execname cannot be found """
+
+    path = shutil.which(execname)
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    try:
+        fstat = os.stat(path)
+    except OSError:
+        return None
+
+    return json.dumps([path, fstat.st_ino, fstat.st_mtime_ns, fstat.st_size, verflag, verpat])
+
+
+#######################################################################
+def get_key_file(key):
+    """ Return (path, inode, mtime, size) of executable in cache key or None
+        if not a valid key """
+
+    try:
+        return tuple(json.loads(key)[:4])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+class VersionCache:
+    """ Versions of executables saved in a json file """
+
+    ######################################################################
+    def __init__(self, filename, refresh=False):
+        """ Use cache in filename.  If refresh, lookups always miss so that
+            versions are found again and the cache updated """
+
+        self.filename = filename
+        self.refresh = refresh
+
+    ######################################################################
+    def read(self):
+        """ Return dict of key to version currently in the cache file """
+
+        try:
+            with open(self.filename, 'r') as cachefh:
+                versions = json.load(cachefh)
+        except FileNotFoundError:
+            versions = {}
+        except (OSError, ValueError) as err:
+            miscutils.fwdebug_print(f"WARN: ignoring unreadable version cache {self.filename}: {err}")
+            versions = {}
+
+        if not isinstance(versions, dict):
+            versions = {}
+        return versions
+
+    ######################################################################
+    def lookup(self, key):
+        """ Return cached version for key or None """
+
+        if key is None or self.refresh:
+            return None
+        version = self.read().get(key)
+        if intgtrace.DEBUG >= 3:
+            miscutils.fwdebug_print(f"INFO: version cache {'hit' if version is not None else 'miss'} for {key}")
+        return version
+
+    ######################################################################
+    def store(self, key, version):
+        """ Save version for key, dropping entries for other (i.e., older)
+            files at the same executable path """
+
+        if key is None or version is None:
+            return
+
+        execfile = get_key_file(key)
+        cachedir = os.path.dirname(os.path.abspath(self.filename))
+        try:
+            os.makedirs(cachedir, exist_ok=True)
+            with open(self.filename + LOCK_SUFFIX, 'a') as lockfh:
+                fcntl.flock(lockfh, fcntl.LOCK_EX)
+
+                versions = {}
+                for (ckey, cver) in self.read().items():
+                    cfile = get_key_file(ckey)
+                    if cfile is not None and (cfile[0] != execfile[0] or cfile == execfile):
+                        versions[ckey] = cver
+                versions[key] = version
+
+                (tmpfd, tmpname) = tempfile.mkstemp(dir=cachedir, prefix='.versions')
+                try:
+                    with os.fdopen(tmpfd, 'w') as tmpfh:
+                        json.dump(versions, tmpfh, indent=1, sort_keys=True)
+                    os.chmod(tmpname, 0o644)
+                    os.replace(tmpname, self.filename)
+                except BaseException:
+                    os.unlink(tmpname)
+                    raise
+        except OSError as err:
+            # the cache is only an optimization
+            miscutils.fwdebug_print(f"WARN: could not update version cache {self.filename}: {err}")
+
@@ -19,18 +19,79 @@ import os
 import collections
 from importlib import import_module
 import copy
+import threading
 
 
 import despymisc.miscutils as miscutils
 import intgutils.intgdefs as intgdefs
+import intgutils.intgtrace as intgtrace
 import intgutils.replace_funcs as replfuncs
 
+# parsed include files: (absolute filename, cmdline) ->
+#     (file ids of it and the files it includes when read, WCL)
+INCLUDE_CACHE = collections.OrderedDict()
+INCLUDE_CACHE_SIZE = 256
+
+# per thread stack of info about include files being read
+_INCLUDE_READS = threading.local()
+
+
+def read_include(filename, cmdline=False):
+    """ Return WCL read from an include file
+
+        A copy of an earlier read is returned while neither the file nor
+        any file it includes changed (copying is much faster than parsing).
+        Files which (or whose includes) use <<inclfunc are always read again
+        as the function may return different values. """
+
+    path = os.path.abspath(filename)
+    reading = getattr(_INCLUDE_READS, 'stack', None)
+    if reading is None:
+        reading = _INCLUDE_READS.stack = []
+
+    entry = INCLUDE_CACHE.get((path, cmdline))
+    if entry is not None and all(replfuncs.get_file_id(fname) == fileid
+                                 for (fname, fileid) in entry[0]):
+        INCLUDE_CACHE.move_to_end((path, cmdline))
+        if reading:
+            reading[-1]['files'].extend(entry[0])
+        return copy.deepcopy(entry[1])
+
+    INCLUDE_CACHE.pop((path, cmdline), None)
+    info = {'files': [(path, replfuncs.get_file_id(path))], 'cacheable': True}
+    reading.append(info)
+    try:
+        wclobj = WCL()
+        with open(filename, "r") as wclfh:
+            wclobj.read(wclfh, cmdline, filename)
+    finally:
+        reading.pop()
+
+    if reading:
+        reading[-1]['files'].extend(info['files'])
+        reading[-1]['cacheable'] = reading[-1]['cacheable'] and info['cacheable']
+    if info['cacheable'] and info['files'][0][1] is not None:
+        INCLUDE_CACHE[(path, cmdline)] = (info['files'], copy.deepcopy(wclobj))
+        while len(INCLUDE_CACHE) > INCLUDE_CACHE_SIZE:
+            INCLUDE_CACHE.popitem(last=False)
+    return wclobj
+
+
+def _include_uses_function():
+    """ Note include files being read call an inclfunc so cannot be reused """
+    for info in getattr(_INCLUDE_READS, 'stack', []):
+        info['cacheable'] = False
+
+
 class WCL(collections.OrderedDict):
     """ Base WCL class """
 
     def __init__(self, *args, **kwds):
         """ Initialize with given wcl """
 
+        self._expansions = {}   # (key, opts) -> (value, expanded value, variables used, current sections)
+        self._var_users = {}    # variable name -> keys in _expansions which used it
+        self._exec_index = {}   # section prefix -> numbered section names in order
         collections.OrderedDict.__init__(self, *args, **kwds)
         self.search_order = collections.OrderedDict()
 
@@ -39,6 +100,7 @@ class WCL(collections.OrderedDict):
         """ Set the search order """
 
         self.search_order = search_order
+        self.invalidate_expansions()
 
 
     ###########################################################################
@@ -58,16 +120,98 @@ class WCL(collections.OrderedDict):
         return value
 
     ###########################################################################
-    #def __setitem__(self, key, val):
-    #    """ x.__setitem__(i, y) <==> x[i]=y """
-    #    OrderedDict.__setitem__(self, key, val)
+    # Mutation hooks.  Changes made through these methods drop any cached
+    # information depending on the changed values.  Changes made directly
+    # to nested sections (e.g., wcl['current']['band'] = 'r') are not seen,
+    # use set('current.band', 'r') or call invalidate_expansions() instead.
+    ###########################################################################
+    def __setitem__(self, key, val):
+        """ x.__setitem__(i, y) <==> x[i]=y """
+        oldval = collections.OrderedDict.get(self, key)
+        collections.OrderedDict.__setitem__(self, key, val)
+        self._mutated(key, oldval, val)
+
+    def __delitem__(self, key):
+        """ x.__delitem__(y) <==> del x[y] """
+        oldval = collections.OrderedDict.get(self, key)
+        collections.OrderedDict.__delitem__(self, key)
+        self._mutated(key, oldval)
+
+    def pop(self, key, *args):
+        """ Remove specified key and return the corresponding value """
+        oldval = collections.OrderedDict.pop(self, key, *args)
+        self._mutated(key, oldval)
+        return oldval
+
+    def popitem(self, last=True):
+        """ Remove and return a (key, value) pair """
+        (key, oldval) = collections.OrderedDict.popitem(self, last)
+        self._mutated(key, oldval)
+        return (key, oldval)
+
+    def setdefault(self, key, default=None):
+        """ Insert key with a value of default if key is not in the dictionary """
+        if not collections.OrderedDict.__contains__(self, key):
+            self[key] = default
+        return collections.OrderedDict.__getitem__(self, key)
+
+    def clear(self):
+        """ Remove all items """
+        collections.OrderedDict.clear(self)
+        self.invalidate_expansions()
+
+    ###########################################################################
+    def _mutated(self, key, *vals):
+        """ Drop cached information affected by a change to key """
+
+        self._exec_index = {}
+        if not self._expansions:
+            return
+
+        # names of changed variables
+        names = {str(key).split('.')[-1].lower()}
+        for val in vals:
+            if isinstance(val, dict):
+                names.update(self._leaf_names(val))
 
+        # changes to which section is current can affect any variable
+        if any(name.startswith('curr_') for name in names):
+            self.invalidate_expansions()
+            return
+
+        for name in names:
+            for ckey in self._var_users.pop(name, ()):
+                self._expansions.pop(ckey, None)
+
+        # entries stored under changed key
+        prefix = str(key).lower()
+        for ckey in [k for k in self._expansions if k[0] == prefix or k[0].startswith(prefix + '.')]:
+            del self._expansions[ckey]
+
+    ###########################################################################
+    @classmethod
+    def _leaf_names(cls, wcldict):
+        """ Return names of all non-section values within wcldict """
+        names = set()
+        for key, val in wcldict.items():
+            if isinstance(val, dict):
+                names.update(cls._leaf_names(val))
+            else:
+                names.add(str(key).lower())
+        return names
+
+    ###########################################################################
+    def invalidate_expansions(self):
+        """ Forget all cached expansions and the variable index """
+        self._expansions = {}
+        self._var_users = {}
+        self._exec_index = {}
 
     ###########################################################################
     def set(self, key, val):
         """ Sets value of key in wcl, follows section notation """
 
-        if miscutils.fwdebug_check(9, "WCL_DEBUG"):
+        if intgtrace.WCL_DEBUG >= 9:
             miscutils.fwdebug_print(f"BEG key={key}, val={val}")
 
         subkeys = key.split('.')
@@ -76,9 +220,11 @@ class WCL(collections.OrderedDict):
         for k in subkeys:
             wcldict = collections.OrderedDict.__getitem__(wcldict, k)
 
+        oldval = collections.OrderedDict.get(wcldict, valkey)
         collections.OrderedDict.__setitem__(wcldict, valkey, val)
+        self._mutated(key, oldval, val)
 
-        if miscutils.fwdebug_check(9, "WCL_DEBUG"):
+        if intgtrace.WCL_DEBUG >= 9:
             miscutils.fwdebug_print("END")
 
 
@@ -87,7 +233,7 @@ class WCL(collections.OrderedDict):
     def search(self, key, opt=None):
         """ Searches for key using given opt following hierarchy rules """
 
-        if miscutils.fwdebug_check(8, 'WCL_DEBUG'):
+        if intgtrace.WCL_DEBUG >= 8:
             miscutils.fwdebug_print("\tBEG")
             miscutils.fwdebug_print(f"\tinitial key = '{key}'")
             miscutils.fwdebug_print(f"\tinitial opts = '{opt}'")
@@ -102,17 +248,17 @@ class WCL(collections.OrderedDict):
 
         # if key contains period, use it exactly instead of scoping rules
         if isinstance(key, str) and '.' in key:
-            if miscutils.fwdebug_check(8, 'WCL_DEBUG'):
+            if intgtrace.WCL_DEBUG >= 8:
                 miscutils.fwdebug_print(f"\t. in key '{key}'")
 
             value = self
             found = True
             for k in key.split('.'):
-                if miscutils.fwdebug_check(8, 'WCL_DEBUG'):
+                if intgtrace.WCL_DEBUG >= 8:
                     miscutils.fwdebug_print(f"\t\t partial key '{k}'")
                 if k in value:
                     value = collections.OrderedDict.__getitem__(value, k)
-                    if miscutils.fwdebug_check(8, 'WCL_DEBUG'):
+                    if intgtrace.WCL_DEBUG >= 8:
                         miscutils.fwdebug_print(f"\t\t next val '{value}'")
                     found = True
                 else:
@@ -130,11 +276,11 @@ class WCL(collections.OrderedDict):
             # override with current values passed into function if given
             if opt is not None and 'currentvals' in opt:
                 for ckey, cval in opt['currentvals'].items():
-                    if miscutils.fwdebug_check(8, 'WCL_DEBUG'):
+                    if intgtrace.WCL_DEBUG >= 8:
                         miscutils.fwdebug_print(f"using specified curval {ckey} = {cval}")
                     curvals[ckey] = cval
 
-            if miscutils.fwdebug_check(6, 'WCL_DEBUG'):
+            if intgtrace.WCL_DEBUG >= 6:
                 miscutils.fwdebug_print(f"curvals = {curvals}")
             if key in curvals:
                 #print "found %s in curvals" % (key)
@@ -176,7 +322,7 @@ class WCL(collections.OrderedDict):
             print("\n\n")
             raise KeyError(f"Error: Search failed ({key})")
 
-        if miscutils.fwdebug_check(8, 'WCL_DEBUG'):
+        if intgtrace.WCL_DEBUG >= 8:
             miscutils.fwdebug_print(f"\tEND: found={found}, value={value}")
 
         return found, value
@@ -187,7 +333,7 @@ class WCL(collections.OrderedDict):
     def search_wcl_for_variables(cls, wcl):
         """ Search the wcl for variables """
 
-        if miscutils.fwdebug_check(9, "WCL_DEBUG"):
+        if intgtrace.WCL_DEBUG >= 9:
             miscutils.fwdebug_print("BEG")
         usedvars = {}
         for key, val in wcl.items():
@@ -202,11 +348,11 @@ class WCL(collections.OrderedDict):
                         vstr = vstr.split(':')[0]
                     usedvars[vstr] = True
             else:
-                if miscutils.fwdebug_check(9, "WCL_DEBUG"):
+                if intgtrace.WCL_DEBUG >= 9:
                     miscutils.fwdebug_print("Note: wcl is not string.")
                     miscutils.fwdebug_print(f"\tkey = {key}, type(val) = {type(val)}, val = '{val}'")
 
-        if miscutils.fwdebug_check(9, "WCL_DEBUG"):
+        if intgtrace.WCL_DEBUG >= 9:
             miscutils.fwdebug_print("END")
         return usedvars
 
@@ -276,10 +422,7 @@ class WCL(collections.OrderedDict):
                     # expand ~ and env vars in filename
                     filename2 = os.path.expandvars(os.path.expanduser(filename2))
 
-                    wclobj2 = WCL()
-                    with open(filename2, "r") as wclfh:
-                        wclobj2.read(wclfh, cmdline, filename2)
-                    self.update(wclobj2)
+                    self.update(read_include(filename2, cmdline))
                     line = in_file.readline()
                     linecnt += 1
                     continue
@@ -287,11 +430,12 @@ class WCL(collections.OrderedDict):
                 # handle calls to external functions to get more information usually from db
                 patmatch = re.search(r"<<inclfunc ([^>]+)>>", line)
                 if patmatch is not None:
-                    if miscutils.fwdebug_check(9, "WCL_DEBUG"):
+                    _include_uses_function()
+                    if intgtrace.WCL_DEBUG >= 9:
                         miscutils.fwdebug_print(f"patmatch={patmatch.group(0)}")
                     funcmatch = re.match(r'([^(]+)\(([^)]+)\)', patmatch.group(1))
                     if funcmatch:
-                        if miscutils.fwdebug_check(9, "WCL_DEBUG"):
+                        if intgtrace.WCL_DEBUG >= 9:
                             miscutils.fwdebug_print(f"funcmatch keys={funcmatch.group(2)}")
                             miscutils.fwdebug_print(f"funcmatch funcname={funcmatch.group(1)}")
                         keys = miscutils.fwsplit(funcmatch.group(2), ',')
@@ -431,16 +575,21 @@ class WCL(collections.OrderedDict):
             print("Check that all sections have closing line.")
             raise SyntaxError(f"File {filename} - missing section closing line.")
 
+        # nested sections were filled in without going through the mutation hooks
+        self.invalidate_expansions()
+
     ############################################################
     def update(self, udict):
         """ update allowing for nested dictionaries """
         miscutils.updateOrderedDict(self, udict)
+        for key, val in udict.items():
+            self._mutated(key, val)
 
     ###########################################################################
     def getfull(self, key, opts=None, default=None):
         """ Return with variables replaced and expanded if string(s) """
 
-        if miscutils.fwdebug_check(9, "WCL_DEBUG"):
+        if intgtrace.WCL_DEBUG >= 9:
             miscutils.fwdebug_print(f"BEG - key={key}")
             miscutils.fwdebug_print(f"default - {default}")
             miscutils.fwdebug_print(f"opts - {opts}")
@@ -449,23 +598,280 @@ class WCL(collections.OrderedDict):
         if not found:
             value = default
         elif isinstance(value, str):
-            if opts is None:
-                newopts = {'expand': True,
-                           intgdefs.REPLACE_VARS: True}
-            else:
-                newopts = copy.deepcopy(opts)
+            (value, _) = self._replace_vars(value, opts)
 
-            if intgdefs.REPLACE_VARS not in newopts or \
-               miscutils.convertBool(newopts[intgdefs.REPLACE_VARS]):
-                newopts['expand'] = True
-                if miscutils.fwdebug_check(9, "WCL_DEBUG"):
-                    miscutils.fwdebug_print(f"calling replace_vars value={value}, opts={newopts}")
+        return value
 
-                (value, _) = replfuncs.replace_vars(value, self, newopts)
-                if len(value) == 1:
-                    value = value[0]
+    ###########################################################################
+    def _replace_vars(self, value, opts):
+        """ Replace variables in value as done by getfull returning (value, keep) """
 
-        return value
+        keep = {}
+        if opts is None:
+            newopts = {'expand': True,
+                       intgdefs.REPLACE_VARS: True}
+        else:
+            newopts = copy.deepcopy(opts)
+
+        if intgdefs.REPLACE_VARS not in newopts or \
+           miscutils.convertBool(newopts[intgdefs.REPLACE_VARS]):
+            newopts['expand'] = True
+            if intgtrace.WCL_DEBUG >= 9:
+                miscutils.fwdebug_print(f"calling replace_vars value={value}, opts={newopts}")
+
+            (value, keep) = replfuncs.replace_vars(value, self, newopts)
+            if len(value) == 1:
+                value = value[0]
+
+        return (value, keep)
+
+    ###########################################################################
+    def _get_curvals(self, opts):
+        """ Return current values as used by search: the wcl's current
+            section overridden by opts['currentvals'] """
+
+        curvals = {}
+        if collections.OrderedDict.__contains__(self, 'current'):
+            curvals.update(collections.OrderedDict.__getitem__(self, 'current'))
+        if opts is not None and 'currentvals' in opts:
+            curvals.update(opts['currentvals'])
+        return curvals
+
+    ###########################################################################
+    def getfull_cached(self, key, opts=None, default=None):
+        """ Same as getfull, but remembers the expanded value
+
+            The value is re-expanded only when it or a variable it depends on
+            changes, either in the current values (opts['currentvals'] or the
+            wcl's current section) or through the wcl mutation methods (set,
+            update, item assignment).  Values using $HEAD or $FUNC are always
+            expanded again as they depend on more than the wcl.
+
+            Writes made directly into nested sections other than current
+            (e.g., wcl['module']['m']['c'] = 3) are not seen, so only use it
+            where those cannot happen, or call invalidate_expansions after. """
+
+        curvals = self._get_curvals(opts)
+        otheropts = []
+        if opts is not None:
+            for okey, oval in opts.items():
+                if okey != 'currentvals':
+                    otheropts.append((okey, repr(oval)))
+        ckey = (key.lower(), tuple(sorted(otheropts)))
+
+        # current section of each section searched
+        sects = [(sect, curvals.get('curr_' + sect)) for sect in self.search_order]
+
+        (found, rawval) = self.search(key, opts)
+        if not found:
+            return default
+        if not isinstance(rawval, str):
+            return rawval
+
+        if ckey in self._expansions:
+            (crawval, value, deps, csects) = self._expansions[ckey]
+            if crawval == rawval and csects == sects and \
+               all((var in curvals, curvals.get(var)) == cval for var, cval in deps.items()):
+                if intgtrace.WCL_DEBUG >= 9:
+                    miscutils.fwdebug_print(f"using cached expansion for {key}")
+                return copy.copy(value)
+
+        (value, keep) = self._replace_vars(rawval, opts)
+
+        # every variable the expansion used directly or through other variables
+        usedvars = {key.split('.')[-1].lower()}
+        usedvars.update(self._find_var_names(rawval))
+        external = self._uses_external(rawval)
+        for kdict in (keep if isinstance(keep, list) else [keep]):
+            for var, val in kdict.items():
+                usedvars.add(var.lower())
+                usedvars.update(self._find_var_names(str(val)))
+                external = external or self._uses_external(str(val))
+
+        if external:
+            self._expansions.pop(ckey, None)
+        else:
+            deps = {var: (var in curvals, curvals.get(var)) for var in usedvars}
+            self._expansions[ckey] = (rawval, value, deps, sects)
+            for var in usedvars:
+                self._var_users.setdefault(var, set()).add(ckey)
+
+        return copy.copy(value)
+
+    ###########################################################################
+    @classmethod
+    def _find_var_names(cls, value):
+        """ Return lowercase names of all variables referenced in value """
+        return {vstr.split(':')[0].lower() for vstr in
+                re.findall(r'(?i)\$(?:opt|LOOP)?\{([^$}]+)\}', value)}
+
+    ###########################################################################
+    @classmethod
+    def _uses_external(cls, value):
+        """ Return whether value has $HEAD or $FUNC variables """
+        return re.search(r'(?i)\$(?:HEAD|FUNC)\{', value) is not None
+
+    ###########################################################################
+    def eval_funcs(self, opts, sections=None):
+        """ Return dict of each $FUNC call in the wcl to its value
+
+            Variables in the values are replaced first (with opts, as done
+            when the values are used) and all calls are evaluated at the same
+            time in the $FUNC worker pool (opts[func_workers]).  Passing the
+            result as opts[func_values] lets later replace_vars calls use the
+            values.  Calls that cannot be evaluated now (e.g., variables not
+            found) are left out, to be evaluated and reported when used.
+
+            If sections (list of dotted section names) is given, only calls
+            in those sections, directly or through their variables, are
+            evaluated. """
+
+        funcs = set()
+
+        def recurs_find(wcldict):
+            for val in wcldict.values():
+                if isinstance(val, dict):
+                    recurs_find(val)
+                elif isinstance(val, str) and ('${' in val or re.search(r'(?i)\$FUNC\{', val)):
+                    try:
+                        (newval, _) = replfuncs.replace_vars_nonfunc(val, self, opts)
+                    except Exception:    # pylint: disable=broad-except
+                        continue
+                    funcs.update(replfuncs.find_funcs(newval))
+
+        if sections is None:
+            recurs_find(self)
+        else:
+            for sect in sections:
+                val = self.get(sect)
+                recurs_find(val if isinstance(val, dict) else {sect: val})
+        if intgtrace.WCL_DEBUG >= 3:
+            miscutils.fwdebug_print(f"evaluating {len(funcs):d} $FUNC calls")
+        if not funcs:
+            return {}
+        return replfuncs.eval_funcs(funcs, opts, skip_errors=True)
+
+    ###########################################################################
+    def get_numbered_sections(self, prefix):
+        """ Return names of top-level sections named prefix followed by a
+            number (e.g., exec_1) in numeric order (exec_9 before exec_10) """
+
+        if prefix not in self._exec_index:
+            pattern = re.compile(re.escape(prefix) + r'(\d+)')
+            numbered = []
+            for key in collections.OrderedDict.keys(self):
+                patmatch = pattern.fullmatch(key)
+                if patmatch is not None:
+                    numbered.append((int(patmatch.group(1)), key))
+            self._exec_index[prefix] = [key for (_, key) in sorted(numbered)]
+        return self._exec_index[prefix]
+
+    ###########################################################################
+    def expand_all(self, opts=None):
+        """ Return read-only snapshot of wcl with all variables replaced
+
+            Builds the graph of variable references across the whole wcl
+            resolving each variable exactly once in dependency (topological)
+            order, so a variable used in many places is only expanded once.
+            Loop values are left unexpanded.  Required variables that cannot
+            be found, and padded ones (e.g., ${ccdnum:02}) whose value is not
+            an integer, are left in the string.   Raises VariableCycleError if
+            variables reference each other in a cycle.  If opts has
+            func_workers, the $FUNC calls across the whole wcl are evaluated
+            at the same time in the $FUNC worker pool. """
+
+        if intgtrace.WCL_DEBUG >= 3:
+            miscutils.fwdebug_print("BEG")
+
+        newopts = copy.deepcopy(opts) if opts is not None else {}
+        newopts['expand'] = False
+
+        varpat = re.compile(r"(?i)\$(opt)?\{([^$}]+)\}")
+        resolved = {}   # variable name -> resolved value (None if not found)
+        order = []      # variable names in topological order
+        stack = []      # variables currently being resolved
+
+        def resolve(name):
+            """ Return fully resolved value of variable """
+            name = name.lower()
+            if name in resolved:
+                return resolved[name]
+            if name in stack:
+                raise replfuncs.VariableCycleError(stack[stack.index(name):] + [name])
+
+            (found, value) = self.search(name, newopts)
+            if not found:
+                value = None
+            elif isinstance(value, str):
+                stack.append(name)
+                value = expand(value)
+                stack.pop()
+            else:
+                value = str(value)
+            resolved[name] = value
+            order.append(name)
+            return value
+
+        def replace(match):
+            """ Return replacement text for one innermost variable reference """
+            parts = match.group(2).split(':')
+            value = resolve(parts[0])
+            if value is None:
+                if match.group(1) is not None:
+                    return ''    # missing optional value
+                return match.group(0)
+            if len(parts) > 1 and not value.startswith('(') and ',' not in value:
+                try:
+                    value = f"{{:0{int(parts[1]):d}d}}".format(int(value))
+                except ValueError:
+                    # not a number so cannot be padded, left in string as
+                    # for variables that cannot be found
+                    if intgtrace.WCL_DEBUG >= 3:
+                        miscutils.fwdebug_print(f"cannot pad {match.group(0)} = {value}")
+                    return match.group(0)
+            return value
+
+        def expand(value):
+            """ Replace variables in string until no more can be replaced """
+            newval = varpat.sub(replace, value)
+            while newval != value:
+                value = newval
+                newval = varpat.sub(replace, value)
+            return newval
+
+        pending = []    # (dict, key) of values with $HEAD or $FUNC left
+
+        def recurs_expand(wcldict, newdict):
+            """ Copy wcldict into newdict expanding strings """
+            for key, val in wcldict.items():
+                if isinstance(val, dict):
+                    newdict[key] = recurs_expand(val, collections.OrderedDict())
+                elif isinstance(val, str):
+                    newval = expand(val)
+                    if '$HEAD{' in newval or '$FUNC{' in newval:
+                        pending.append((newdict, key))
+                    newdict[key] = newval
+                else:
+                    newdict[key] = copy.deepcopy(val)
+            return newdict
+
+        snapshot = recurs_expand(self, WCL())
+
+        # with a $FUNC worker pool, evaluate all $FUNCs at the same time
+        if pending and replfuncs.get_func_workers(newopts) > 0:
+            funcs = set()
+            for (newdict, key) in pending:
+                funcs.update(replfuncs.find_funcs(newdict[key]))
+            newopts[intgdefs.FUNC_VALUES] = replfuncs.eval_funcs(funcs, newopts)
+        for (newdict, key) in pending:
+            newdict[key] = replfuncs.replace_vars(newdict[key], self, newopts)[0]
+        snapshot.set_search_order(copy.deepcopy(self.search_order))
+
+        if intgtrace.WCL_DEBUG >= 3:
+            miscutils.fwdebug_print(f"END - resolved {len(order):d} variables")
+        if intgtrace.WCL_DEBUG >= 9:
+            miscutils.fwdebug_print(f"resolution order = {order}")
+        return snapshot
 
     ############################################################
     @classmethod
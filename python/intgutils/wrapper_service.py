@@ -0,0 +1,359 @@
+"""
+Local service running wrappers in children forked from a warm server process
+
+The server imports the wrapper code (astropy included) once, and reads the
+include files of each request before forking, so that children start with
+them parsed (see wcl.read_include).  Other caches, e.g., $HEAD values, parsed
+lists and fullnames, are filled by each child and last only for its wrapper;
+exec versions are shared through the on-disk version cache if the wrappers
+use one.  Requests are read without blocking, so a slow client only holds up
+itself.  A client connects
+over a Unix domain socket and passes its stdin, stdout and stderr (SCM_RIGHTS)
+followed by a json line with the input wcl filename and its working directory,
+environment and umask.  The server forks a child which takes on the client's
+files, directory and environment, runs the wrapper and sends back a json line
+with its exit status, so wrappers cannot affect each other or the server.
+
+Note the environment only affects what is read from it at run time (e.g.,
+debug levels, PATH for execs), not modules already imported by the server, so
+the server must be started with the same software setup as its clients.
+
+Only the user running the server may connect: the socket is made accessible
+to that user only, and connections from another uid are rejected.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import struct
+import selectors
+import signal
+import socket
+import traceback
+
+# largest request accepted (the environment is most of it)
+MAX_REQUEST_SIZE = 1 << 20
+
+# seconds a client has to send its request
+REQUEST_TIMEOUT = 10
+
+# seconds between checks for finished children and stop requests
+POLL_INTERVAL = 0.5
+
+# include lines whose files the server reads before forking to keep them cached
+INCLUDE_RE = re.compile(r"^\s*<<include ([^\s$]+)>>", re.M)
+
+
+#######################################################################
+def read_line(sock, maxsize=MAX_REQUEST_SIZE):
+    """ Return bytes received from sock up to a newline, or None if the
+        connection closed first """
+
+    data = bytearray()
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            return None
+        data.extend(chunk)
+        if len(data) > maxsize:
+            raise ValueError(f"message longer than {maxsize} bytes")
+    return bytes(data)
+
+
+#######################################################################
+def get_umask():
+    """ Return current umask """
+
+    umask = os.umask(0o22)
+    os.umask(umask)
+    return umask
+
+
+#######################################################################
+def get_peer_uid(conn):
+    """ Return uid of the process connected to Unix domain socket conn """
+
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    (_, uid, _) = struct.unpack('3i', creds)
+    return uid
+
+
+#######################################################################
+def run_client(sockpath, inputwcl, stdfds=(0, 1, 2)):
+    """ Have service listening on sockpath run wrapper for inputwcl with the
+        given stdin, stdout and stderr, returning the wrapper's exit status """
+
+    request = {'inputwcl': os.path.abspath(inputwcl),
+               'cwd': os.getcwd(),
+               'env': dict(os.environ),
+               'umask': get_umask()}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(sockpath)
+        try:
+            socket.send_fds(sock, [b'R'], list(stdfds))
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            reply = read_line(sock)
+        except (BrokenPipeError, ConnectionResetError):
+            reply = None    # server rejected the request
+
+    if reply is None:
+        print(f"Error: wrapper service at {sockpath} did not return a status for {inputwcl}",
+              file=sys.stderr)
+        return 1
+    return json.loads(reply)['status']
+
+
+class PendingRequest:
+    """ Connection whose request is still being received """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.fds = None
+        self.data = bytearray()
+        self.starttime = time.time()
+
+    def close(self):
+        """ Close connection and any file descriptors received """
+        for fd in self.fds or []:
+            os.close(fd)
+        self.fds = []
+        self.conn.close()
+
+
+class WrapperService:
+    """ Server running each wrapper request in a forked child """
+
+    ######################################################################
+    def __init__(self, sockpath, max_children=None):
+        """ Serve on Unix domain socket sockpath running at most max_children
+            wrappers at the same time (default number of cpus) """
+
+        self.sockpath = sockpath
+        self.max_children = max_children if max_children else os.cpu_count()
+        self.uid = os.getuid()    # only user allowed to connect
+        self.pending = {}         # connection fd -> PendingRequest being received
+        self.children = set()
+        self.stopping = False
+        self.listener = None
+
+    ######################################################################
+    def stop(self, *_):
+        """ Stop accepting requests (usable as signal handler) """
+        self.stopping = True
+
+    ######################################################################
+    def reap(self, block=False):
+        """ Forget finished children, waiting for one if block """
+
+        while self.children:
+            try:
+                (pid, _) = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if pid == 0:
+                break
+            self.children.discard(pid)
+            block = False
+
+    ######################################################################
+    def warm(self, inputwcl):
+        """ Read include files of inputwcl so children find them cached """
+
+        import intgutils.wcl as wcl
+        try:
+            with open(inputwcl, 'r') as wclfh:
+                text = wclfh.read()
+            for filename in INCLUDE_RE.findall(text):
+                wcl.read_include(os.path.expandvars(os.path.expanduser(filename)))
+        except Exception:
+            # the child reports any problem reading the wcl
+            pass
+
+    ######################################################################
+    def read_request(self, pending):
+        """ Read what is available of the request on pending's connection,
+            returning (request dict, [stdin, stdout, stderr]) once all of it
+            is received, else None """
+
+        conn = pending.conn
+        if pending.fds is None:
+            (_, fds, _, _) = socket.recv_fds(conn, 1, 3)
+            pending.fds = fds
+            if len(fds) != 3:
+                raise ValueError(f"expected 3 file descriptors, got {len(fds)}")
+
+        while not pending.data.endswith(b'\n'):
+            chunk = conn.recv(65536)
+            if not chunk:
+                raise ValueError("connection closed before request")
+            pending.data.extend(chunk)
+            if len(pending.data) > MAX_REQUEST_SIZE:
+                raise ValueError(f"request longer than {MAX_REQUEST_SIZE} bytes")
+
+        request = json.loads(pending.data)
+        for key in ['inputwcl', 'cwd', 'env', 'umask']:
+            if key not in request:
+                raise ValueError(f"request missing {key}")
+        return (request, pending.fds)
+
+    ######################################################################
+    def run_child(self, conn, request, fds):
+        """ Run wrapper for request in this (forked) process and exit """
+
+        import intgutils.intgtrace as intgtrace
+        import intgutils.basic_wrapper as basic_wrapper
+
+        status = 1
+        try:
+            self.listener.close()
+            for pending in self.pending.values():
+                if pending.conn is not conn:
+                    pending.close()
+            for signum in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]:
+                signal.signal(signum, signal.SIG_DFL)
+            for (stdfd, fd) in enumerate(fds):
+                if fd != stdfd:
+                    os.dup2(fd, stdfd)
+                    os.close(fd)
+            sys.stdin = open(0, 'r', closefd=False)
+            sys.stdout = open(1, 'w', closefd=False)
+            sys.stderr = open(2, 'w', closefd=False)
+            os.chdir(request['cwd'])
+            os.umask(request['umask'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            intgtrace.reconfigure()
+
+            status = basic_wrapper.run_wrapper_file(request['inputwcl'])
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                conn.sendall(json.dumps({'status': status}).encode() + b'\n')
+            finally:
+                os._exit(0)
+
+    ######################################################################
+    def accept(self, selector):
+        """ Accept a connection from the listener, if from the server's user """
+
+        try:
+            (conn, _) = self.listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        peer_uid = get_peer_uid(conn)
+        if peer_uid != self.uid:
+            print(f"WARN: rejected wrapper service connection from uid {peer_uid}", file=sys.stderr)
+            conn.close()
+            return
+        conn.setblocking(False)
+        self.pending[conn.fileno()] = PendingRequest(conn)
+        selector.register(conn, selectors.EVENT_READ)
+
+    ######################################################################
+    def receive(self, selector, pending):
+        """ Read more of a pending request, running it once complete """
+
+        try:
+            received = self.read_request(pending)
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception as err:
+            print(f"WARN: bad wrapper service request: {err}", file=sys.stderr)
+            received = None
+        else:
+            if received is None:
+                return
+
+        selector.unregister(pending.conn)
+        try:
+            if received is not None:
+                pending.conn.setblocking(True)
+                self.handle(pending.conn, *received)
+        finally:
+            del self.pending[pending.conn.fileno()]
+            pending.close()
+
+    ######################################################################
+    def expire(self, selector):
+        """ Drop pending requests not received within REQUEST_TIMEOUT """
+
+        now = time.time()
+        for pending in list(self.pending.values()):
+            if now - pending.starttime > REQUEST_TIMEOUT:
+                print(f"WARN: bad wrapper service request: not received within {REQUEST_TIMEOUT} secs",
+                      file=sys.stderr)
+                selector.unregister(pending.conn)
+                del self.pending[pending.conn.fileno()]
+                pending.close()
+
+    ######################################################################
+    def handle(self, conn, request, fds):
+        """ Fork a child to run the received request """
+
+        self.warm(request['inputwcl'])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self.run_child(conn, request, fds)
+        self.children.add(pid)
+
+    ######################################################################
+    def serve_forever(self):
+        """ Handle requests until stopped by SIGTERM, SIGINT or stop() """
+
+        # import now so that every child starts with them loaded
+        import intgutils.basic_wrapper      # pylint: disable=unused-import
+
+        if os.path.exists(self.sockpath):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                try:
+                    sock.connect(self.sockpath)
+                except OSError:
+                    os.unlink(self.sockpath)    # left by a server which died
+                else:
+                    raise OSError(f"a wrapper service is already listening on {self.sockpath}")
+
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            signal.signal(signum, self.stop)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        selector = selectors.DefaultSelector()
+        try:
+            self.listener.bind(self.sockpath)
+            os.chmod(self.sockpath, 0o600)    # before listen, so no one else gets in first
+            self.listener.listen(128)
+            self.listener.setblocking(False)
+            selector.register(self.listener, selectors.EVENT_READ)
+            print(f"INFO: wrapper service listening on {self.sockpath} (pid {os.getpid()})")
+            sys.stdout.flush()
+
+            while not self.stopping:
+                self.reap(block=len(self.children) >= self.max_children)
+                for (key, _) in selector.select(POLL_INTERVAL):
+                    if key.fileobj is self.listener:
+                        self.accept(selector)
+                    elif key.fd in self.pending:
+                        self.receive(selector, self.pending[key.fd])
+                self.expire(selector)
+        finally:
+            for pending in self.pending.values():
+                pending.close()
+            self.pending = {}
+            selector.close()
+            self.listener.close()
+            try:
+                os.unlink(self.sockpath)
+            except FileNotFoundError:
+                pass
+            starttime = time.time()
+            while self.children:
+                self.reap(block=True)
+            print(f"INFO: wrapper service stopped ({time.time() - starttime:0.1f} secs waiting for children)")
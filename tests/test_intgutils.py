@@ -8,6 +8,13 @@ import sys
 import copy
 import time
 import errno
+import signal
+import socket
+import tempfile
+import multiprocessing
+import gzip
+import bz2
+import lzma
 from contextlib import contextmanager
 from collections import OrderedDict
 from io import StringIO
@@ -17,12 +24,16 @@ import json
 import intgutils.intgmisc as igm
 import intgutils.replace_funcs as rf
 import intgutils.intgdefs as intgdefs
+import intgutils.intgtrace as intgtrace
 import intgutils.wcl as wcl
 import intgutils.queryutils as iqu
 import intgutils.basic_wrapper as bwr
+import intgutils.version_cache as ivc
+import intgutils.wrapper_service as iws
 import genwrap as gwr
 from intgutils import *
 
+import despymisc.miscutils as miscutils
 import despydmdb.desdmdbi as dmdbi
 from MockDBI import MockConnection
 
@@ -87,6 +98,90 @@ class TestIntgmisc(unittest.TestCase):
         self.assertTrue('test_raw.fits' in exist[0])
         self.assertTrue('notthere' in missing[0])
 
+    def test_check_files_batch(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            files = []
+            for i in range(igm.SCANDIR_MIN_FILES * 2):
+                fname = os.path.join(tmpdir, f'file{i}.fits')
+                if i % 3:
+                    open(fname, 'w').close()
+                files.append(fname)
+            os.symlink(os.path.join(tmpdir, 'notthere'), os.path.join(tmpdir, 'dangling'))
+            files += [os.path.join(tmpdir, 'dangling'), os.path.join(tmpdir, 'nodir/file.fits'),
+                      ROOT + 'raw/test_raw.fits.fz']
+
+            (exist, missing) = igm.check_files(files, batch=True)
+            self.assertEqual((exist, missing), igm.check_files(files))
+            self.assertEqual(len(missing), 8)
+            self.assertTrue(os.path.join(tmpdir, 'dangling') in missing)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parse_fullnames(self):
+        names = ['a/b/one.fits.fz[0]', 'a/c/two.fits']
+        mask = miscutils.CU_PARSE_PATH | miscutils.CU_PARSE_FILENAME | miscutils.CU_PARSE_COMPRESSION
+        (paths, filenames, compressions) = igm.parse_fullnames(names, mask)
+        self.assertEqual(paths, ['a/b', 'a/c'])
+        self.assertEqual(filenames, ['one.fits', 'two.fits'])
+        self.assertEqual(compressions, ['.fz', None])
+        self.assertEqual(igm.parse_fullnames(names, miscutils.CU_PARSE_BASENAME),
+                         ['one.fits.fz', 'two.fits'])
+        self.assertEqual(igm.parse_fullnames([], mask), ([], [], []))
+        self.assertEqual(igm.parse_fullname(names[0], mask), miscutils.parse_fullname(names[0], mask))
+        self.assertTrue(igm.parse_fullname.cache_info().hits > 0)
+
+    def test_stat_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'file.fits')
+            with open(fname, 'w') as fh:
+                fh.write('12345')
+            files = [fname, os.path.join(tmpdir, 'notthere.fits'), fname]
+            stats = igm.stat_files(files, nthreads=2)
+            self.assertEqual(list(stats.keys()), files[:2])
+            self.assertEqual(stats[fname].size, 5)
+            self.assertEqual(stats[fname].mtime, os.path.getmtime(fname))
+            self.assertEqual(stats[files[1]], igm.FileStat(False, None, None))
+            self.assertEqual(stats, igm.stat_files(files, nthreads=1))
+
+            def slow_stat(name):
+                if 'slow' in name:
+                    time.sleep(0.5)
+                return igm.FileStat(True, 0, 0)
+            with patch('intgutils.intgmisc.stat_file', side_effect=slow_stat):
+                with capture_output() as (out, _):
+                    stats = igm.stat_files(['slow', 'fast'], nthreads=2, timeout=0.1)
+                    self.assertTrue('WARN' in out.getvalue())
+                    # a timed out stat is not reported as missing
+                    self.assertRaises(TimeoutError, igm.check_files, ['slow', 'fast'],
+                                      nthreads=2, timeout=0.1)
+            self.assertEqual(stats['slow'], igm.STAT_TIMED_OUT)
+            self.assertIsNone(stats['slow'].exists)
+            self.assertTrue(stats['fast'].exists)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_make_output_dirs(self):
+        fullnames = ['out/a/b/f1.fits', 'out/a/b/f2.fits', 'out/a/f3.fits', 'out/a-c/f4.fits',
+                     'out/a/b/c/f5.fits', 'f6.fits', '/tmp/x/f7.fits', '/tmp/f8.fits']
+        self.assertEqual(igm.get_leaf_dirs(fullnames), ['/tmp/x', 'out/a-c', 'out/a/b/c'])
+        self.assertEqual(igm.get_leaf_dirs(['./d/f1', 'd//f2', 'd/e/../f3']), ['d'])
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            dirs = [os.path.join(tmpdir, f'd{i}', f's{j}') for i in range(4) for j in range(4)]
+            igm.make_dirs(dirs, 8)
+            igm.make_dirs(dirs)
+            for dirname in dirs:
+                self.assertTrue(os.path.isdir(dirname))
+
+            open(os.path.join(tmpdir, 'afile'), 'w').close()
+            igm.make_dir(os.path.join(tmpdir, 'afile'))
+            self.assertRaises(OSError, igm.make_dir, os.path.join(tmpdir, 'afile', 'sub'))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_get_cmd_hyphen(self):
         self.assertEqual('--', igm.get_cmd_hyphen('alldouble', 'test'))
         self.assertEqual('-', igm.get_cmd_hyphen('allsingle', 'test'))
@@ -104,11 +199,95 @@ class TestIntgmisc(unittest.TestCase):
         self.assertEqual('exec_1', keys[0])
         self.assertEqual('file.coadd', res['exec_1']['was_generated_by'])
 
+    def test_get_exec_sections_order(self):
+        sects = OrderedDict([('exec_10', {'n': 10}), ('wrapper', {}), ('exec_9', {'n': 9}),
+                             ('exec_1', {'n': 1}), ('exec_2x', {})])
+        for w in [sects, wcl.WCL(sects)]:
+            res = igm.get_exec_sections(w, 'exec_')
+            self.assertEqual(list(res.keys()), ['exec_1', 'exec_9', 'exec_10'])
+            self.assertEqual(res['exec_10']['n'], 10)
+
+        w = wcl.WCL(sects)
+        self.assertTrue(w.get_numbered_sections('exec_') is w.get_numbered_sections('exec_'))
+        w['exec_3'] = {'n': 3}
+        self.assertEqual(w.get_numbered_sections('exec_'), ['exec_1', 'exec_3', 'exec_9', 'exec_10'])
+        del w['exec_9']
+        self.assertEqual(list(igm.get_exec_sections(w, 'exec_').keys()), ['exec_1', 'exec_3', 'exec_10'])
+
     def test_run_exec(self):
         (retcode, procinfo) = igm.run_exec('ls')
         self.assertEqual(retcode, 0)
         self.assertTrue(procinfo['ru_stime'] >= 0.)
 
+    def test_run_exec_io(self):
+        (retcode, procinfo) = igm.run_exec("sh -c 'head -c 1000000 /dev/zero > /dev/null'")
+        self.assertEqual(retcode, 0)
+        if os.path.exists(f'/proc/{os.getpid()}/io'):
+            self.assertTrue(procinfo['io_rchar'] >= 1000000)
+            self.assertTrue(procinfo['io_wchar'] >= 1000000)
+            for field in igm.PROC_IO_FIELDS:
+                self.assertTrue(f'io_{field}' in procinfo)
+
+    def test_run_exec_limits(self):
+        start = time.time()
+        (retcode, procinfo) = igm.run_exec("sh -c 'sleep 30 & sleep 30'", limits={'max_walltime': 0.5})
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(retcode, -15)
+        self.assertTrue(procinfo['limit_exceeded'].startswith('max_walltime'))
+
+        cmd = f"{sys.executable} -c 'x = bytearray(200000000); import time; time.sleep(30)'"
+        (retcode, procinfo) = igm.run_exec(cmd, limits={'max_rss': 100000000})
+        self.assertTrue(procinfo['limit_exceeded'].startswith('max_rss'))
+
+        cmd = f"{sys.executable} -c 'x = bytearray(2000000000)'"
+        (retcode, procinfo) = igm.run_exec(cmd, limits={'max_vmem': 1000000000})
+        self.assertNotEqual(retcode, 0)
+
+        (retcode, procinfo) = igm.run_exec("sh -c 'while :; do :; done'", limits={'max_cputime': 1})
+        self.assertEqual(retcode, -signal.SIGXCPU)
+        self.assertTrue(procinfo['limit_exceeded'].startswith('max_cputime'))
+
+        (retcode, procinfo) = igm.run_exec('ls', limits={'max_walltime': 30, 'max_rss': None})
+        self.assertEqual(retcode, 0)
+        self.assertFalse('limit_exceeded' in procinfo)
+
+        # the exec stays in the wrapper's process group so job signals reach it
+        cmd = f"{sys.executable} -c 'import os, sys; sys.exit(os.getpgid(0) != {os.getpgid(0)})'"
+        (retcode, procinfo) = igm.run_exec(cmd, limits={'max_walltime': 30, 'max_cputime': 30})
+        self.assertEqual(retcode, 0)
+
+        self.assertRaises(FileNotFoundError, igm.run_exec, 'no_such_exec_xyz', limits={'max_cputime': 30})
+
+    def test_run_exec_output_log(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            logfile = os.path.join(tmpdir, 'logs/exec.log.gz')
+            cmd = f"{sys.executable} -c 'import sys\nfor i in range(100000): print(i)\nprint(\"err\", file=sys.stderr)'"
+            with capture_output() as (out, _):
+                (retcode, procinfo) = igm.run_exec(cmd, logfile=logfile, tail_size=100)
+                self.assertEqual(out.getvalue(), '')
+            self.assertEqual(retcode, 0)
+            with gzip.open(logfile, 'rt') as fh:
+                text = fh.read()
+            self.assertTrue('99999\n' in text and 'err\n' in text)
+            self.assertEqual(procinfo['output_bytes'], len(text))
+            self.assertEqual(len(procinfo['output_tail']), 100)
+            self.assertTrue(procinfo['output_tail'].endswith('\n'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_run_exec_sampled(self):
+        cmd = f"{sys.executable} -c 'import time; x = bytearray(50000000); time.sleep(0.5)'"
+        (retcode, procinfo) = igm.run_exec(cmd, sample_interval=0.05)
+        self.assertEqual(retcode, 0)
+        self.assertTrue(procinfo['sample_count'] >= 2)
+        self.assertEqual(len(procinfo['samples']), procinfo['sample_count'] * len(igm.SAMPLE_FIELDS))
+        self.assertTrue(procinfo['sample_rss_max'] >= 50000000)
+        self.assertTrue(procinfo['sample_threads_max'] >= 1)
+        self.assertEqual(igm.decode_samples(igm.encode_samples(procinfo['samples'])), procinfo['samples'])
+        self.assertEqual(igm.summarize_samples([]), {'sample_count': 0})
+        self.assertEqual(igm.get_proc_tree(os.getpid())[0], os.getpid())
+
     def test_remove_column_format(self):
         w = wcl.WCL()
         with open(self.wcl_file, 'r') as infh:
@@ -162,10 +341,9 @@ class TestIntgmisc(unittest.TestCase):
             self.assertTrue(',' in res['red_immask'][25])
             self.assertTrue(res['red_immask'][25].endswith(','))
 
-            with capture_output() as (out, _):
-                self.assertRaises(SystemExit, igm.read_fullnames_from_listfile, fname, 'wcl', columns)
-                output = out.getvalue().strip()
-                self.assertTrue('supported' in output)
+            # not a wcl file, so no lines
+            res = igm.read_fullnames_from_listfile(fname, 'wcl', columns)
+            self.assertEqual(res, {'red_immask': []})
 
             with capture_output() as (out, _):
                 self.assertRaises(SystemExit, igm.read_fullnames_from_listfile, fname, 'unk', columns)
@@ -177,6 +355,122 @@ class TestIntgmisc(unittest.TestCase):
             except:
                 pass
 
+    def test_list_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'test.list')
+            with open(fname, 'w') as fh:
+                fh.write('/a/b/one.fits[0],1\n/a/b/two.fits.fz,2\n')
+            res = igm.read_fullnames_from_listfile(fname, 'textcsv', 'red.fullname,num')
+            self.assertEqual(res, {'red': ['/a/b/one.fits', '/a/b/two.fits.fz']})
+            res['red'].append('changed')
+            with patch('intgutils.intgmisc._read_fullnames_from_listfile') as ptch:
+                res = igm.read_fullnames_from_listfile(fname, 'textcsv', 'red.fullname,num')
+                self.assertFalse(ptch.called)
+                self.assertEqual(len(res['red']), 2)
+
+                # same mtime and size, but rewritten
+                stinfo = os.stat(fname)
+                with open(fname, 'w') as fh:
+                    fh.write('/a/b/six.fits[0],1\n/a/b/ten.fits.fz,2\n')
+                os.utime(fname, ns=(stinfo.st_atime_ns, stinfo.st_mtime_ns))
+                igm.read_fullnames_from_listfile(fname, 'textcsv', 'red.fullname,num')
+                self.assertFalse(ptch.called)
+
+            igm.invalidate_list_cache(fname)
+            res = igm.read_fullnames_from_listfile(fname, 'textcsv', 'red.fullname,num')
+            self.assertEqual(res['red'][0], '/a/b/six.fits')
+            igm.invalidate_list_cache()
+            self.assertEqual(igm.LIST_CACHE, {})
+
+            # least recently used lists are dropped once over the row limit
+            names = []
+            for num in range(3):
+                names.append(os.path.join(tmpdir, f'{num}.list'))
+                with open(names[-1], 'w') as fh:
+                    fh.write(f'/a/b/{num}.fits,1\n/a/c/{num}.fits,2\n')
+            with patch('intgutils.intgmisc.LIST_CACHE_MAX_ROWS', 4):
+                for name in names[:2] + names[:1] + names[2:]:
+                    igm.read_fullnames_from_listfile(name, 'textcsv', 'red.fullname,num')
+            self.assertEqual([key[0] for key in igm.LIST_CACHE], [names[0], names[2]])
+            igm.invalidate_list_cache()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_listfile_columns(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'test.list')
+            lines = ['red/one.fits.fz[0],1,/b/bkg1.fits', 'red/two.fits[12] , 2,bkg2.fits',
+                     'red/(three).fits,3,/bkg3.fits', '/x/red/four.fits,4,b/four.fits[1]']
+            with open(fname, 'w') as fh:
+                fh.write('\n'.join(lines) + '\n')
+            columns = 'red.fullname,num,bkg.fullname'
+            expected = {'red': [], 'bkg': []}
+            for line in lines:
+                lineinfo = miscutils.fwsplit(line.strip(), ',')
+                expected['red'].append(igm.parse_list_fullname(lineinfo[0]))
+                expected['bkg'].append(igm.parse_list_fullname(lineinfo[2]))
+            for chunksize in [1, 2, 3, 10]:
+                res = igm.read_listfile_columns(fname, 'textcsv', columns, chunksize)
+                self.assertEqual(res, expected)
+                self.assertEqual(list(igm.iter_listfile_fullnames(fname, 'textcsv', columns, chunksize)),
+                                 list(zip(expected['red'], expected['bkg'])))
+            self.assertEqual(res['red'][0], 'red/one.fits.fz')
+            self.assertEqual(res['red'][3], '/x/red/four.fits')
+            self.assertEqual(igm.parse_list_fullnames([]), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_compressed_listfile(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            text = 'red/one.fits.fz[0],1\nred/two.fits,2\n'
+            for (suffix, module) in [('', None), ('.gz', gzip), ('.bz2', bz2), ('.xz', lzma)]:
+                fname = os.path.join(tmpdir, 'test.list' + suffix)
+                if module is None:
+                    with open(fname, 'w') as fh:
+                        fh.write(text)
+                else:
+                    with module.open(fname, 'wt') as fh:
+                        fh.write(text)
+                with igm.open_listfile(fname) as fh:
+                    self.assertEqual(fh.read(), text)
+                res = igm.read_fullnames_from_listfile(fname, 'textcsv', 'red.fullname,num')
+                self.assertEqual(res['red'], ['red/one.fits.fz', 'red/two.fits'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_wcl_listfile(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            files = [[{'filename': f'D{i:04d}_immask.fits', 'path': 'red/r1', 'compression': '.fz'},
+                      {'fullname': f'cat/D{i:04d}_cat.fits[2]'}] for i in range(1, 4)]
+            fname = os.path.join(tmpdir, 'test.wcl')
+            iqu.output_lines_wcl(fname, iqu.convert_multiple_files_to_lines(files, ['red', 'cat']))
+            res = igm.read_fullnames_from_listfile(fname, 'wcl', 'cat.fullname,red.fullname')
+            self.assertEqual(res['red'], [f'red/r1/D{i:04d}_immask.fits.fz' for i in range(1, 4)])
+            self.assertEqual(res['cat'][0], 'cat/D0001_cat.fits')
+            self.assertEqual(list(igm.iter_wcl_listfile_fullnames(fname, 'red.fullname,cat.fullname')),
+                             list(zip(res['red'], res['cat'])))
+            self.assertRaises(KeyError, igm.read_wcl_listfile_columns, fname, 'bkg.fullname,red.fullname')
+
+            fname = os.path.join(tmpdir, 'single.wcl')
+            iqu.output_lines_wcl(fname, iqu.convert_single_files_to_lines([f[0] for f in files]))
+            res = igm.read_fullnames_from_listfile(fname, 'config', 'red.fullname')
+            self.assertEqual(len(res['red']), 3)
+
+            with open(fname, 'a') as fh:
+                fh.write('<list>\n')
+            self.assertRaises(SyntaxError, igm.read_wcl_listfile_columns, fname, 'red.fullname')
+
+            fname = os.path.join(tmpdir, 'sublabel.wcl')
+            with open(fname, 'w') as fh:
+                fh.write('<list>\n<line line1>\n<file red>\nfullname = a/b.fits\n</file>\n</line>\n</list>\n')
+            self.assertEqual(igm.read_wcl_listfile_columns(fname, 'red.fullname'), {'red': ['a/b.fits']})
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_get_list_fullnames(self):
         fname = 'list/mangle/DES2157-5248_r15p03_g_mangle-red.list'
         os.symlink(os.path.join(ROOT, 'list'), 'list', target_is_directory=True)
@@ -301,6 +595,23 @@ class TestIntgmisc(unittest.TestCase):
                 pass
 
 
+class TestIntgtrace(unittest.TestCase):
+    def test_reconfigure(self):
+        old = os.environ.get('REPL_DEBUG')
+        try:
+            os.environ['REPL_DEBUG'] = '6'
+            self.assertNotEqual(intgtrace.REPL_DEBUG, 6)
+            intgtrace.reconfigure()
+            self.assertEqual(intgtrace.REPL_DEBUG, 6)
+            self.assertEqual(intgtrace.get_level('REPL_DEBUG'), 6)
+        finally:
+            if old is None:
+                del os.environ['REPL_DEBUG']
+            else:
+                os.environ['REPL_DEBUG'] = old
+            intgtrace.reconfigure()
+
+
 class TestReplaceFuncs(unittest.TestCase):
     @classmethod
     def setUp(cls):
@@ -327,10 +638,48 @@ class TestReplaceFuncs(unittest.TestCase):
                                                self.w, True, 'HEAD')
         self.assertEqual('SExtractor', res)
 
+    def test_header_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'test.fits')
+            open(fname, 'w').close()
+            with patch('intgutils.replace_funcs.fits.open') as fopen, \
+                 patch('intgutils.replace_funcs.fitsutils.get_hdr_value',
+                       side_effect=lambda hdulist, key: key.lower()) as hdrval:
+                self.assertEqual(rf.get_header_values(fname, ['BAND', 'EXPNUM']), ['band', 'expnum'])
+                self.assertEqual(rf.get_header_values(fname, ['EXPNUM', 'BAND']), ['expnum', 'band'])
+                self.assertEqual((fopen.call_count, hdrval.call_count), (1, 2))
+                self.assertEqual(rf.get_header_values(fname, ['BAND', 'CCDNUM']), ['band', 'ccdnum'])
+                self.assertEqual((fopen.call_count, hdrval.call_count), (2, 3))
+
+                os.utime(fname, (1000000, 1000000))
+                self.assertEqual(rf.get_header_values(fname, ['BAND']), ['band'])
+                self.assertEqual((fopen.call_count, hdrval.call_count), (3, 4))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_replace_vars_type_func(self):
         done, res, data = rf.replace_vars_type("$FUNC{tester.add,1,2,3}", self.w, True, 'FUNC')
         self.assertEqual(res, '6')
 
+    def test_replace_vars_type_func_pool(self):
+        try:
+            done, res, data = rf.replace_vars_type("$FUNC{tester.add,1,2}_$FUNC{tester.add,3,4}",
+                                                   self.w, True, 'FUNC', {'func_workers': 2})
+            self.assertFalse(done)
+            self.assertEqual(res, '3_7')
+            self.assertEqual(data['tester.add,3,4'], '7')
+
+            self.assertRaises(TimeoutError, rf.replace_vars, "$FUNC{tester.slow,5}", self.w,
+                              {'func_workers': 1, 'func_timeout': 0.5})
+            self.assertIsNone(rf.FUNC_POOL)
+
+            # the timeout is for all calls together, each finishing within it is not enough
+            self.assertRaises(TimeoutError, rf.eval_funcs, ['tester.slow,0.4', 'tester.slow,0.41'],
+                              {'func_workers': 1, 'func_timeout': 0.6})
+        finally:
+            rf.shutdown_func_pool()
+
     def test_replace_vars_type_other(self):
         done, res, data = rf.replace_vars_type("${band}", {'band': 'e'}, False, '')
         self.assertEqual(res, 'e')
@@ -368,6 +717,44 @@ class TestReplaceFuncs(unittest.TestCase):
         self.assertTrue(len(vals) == len(keep))
         self.assertTrue(keep[0]['bands'] in vals)
 
+    def test_keepmap(self):
+        base = rf.KeepMap({'a': '1', 'b': '2'})
+        child = base.bind('b', '3').bind('c', '4')
+        self.assertEqual(child['b'], '3')
+        self.assertEqual(base['b'], '2')
+        self.assertEqual(child, {'a': '1', 'b': '3', 'c': '4'})
+        self.assertEqual(list(child.keys()), ['a', 'b', 'c'])
+        self.assertEqual(len(child), 3)
+        self.assertTrue(isinstance(child.to_dict(), dict))
+        self.assertRaises(KeyError, child.__getitem__, 'd')
+        with self.assertRaises(TypeError):
+            child['d'] = '5'
+
+        w = wcl.WCL({'bands': 'g,r', 'ccds': '1,2'})
+        vals, keep = rf.replace_vars_loop(('$LOOP{bands}_$LOOP{ccds}', {'x': 'y'}), w)
+        self.assertEqual(sorted(vals), ['g_1', 'g_2', 'r_1', 'r_2'])
+        self.assertTrue(all(type(k) is dict for k in keep))
+        keep[0].update({'bands': 'z'})
+        self.assertEqual(copy.deepcopy(keep[1])['x'], 'y')
+        vals, keep = rf.replace_vars('$LOOP{bands}', w)
+        self.assertTrue(all(type(k) is dict for k in keep))
+
+    def test_iter_replace_vars_loop(self):
+        w = wcl.WCL({'bands': 'g,r', 'ccds': ','.join(str(i) for i in range(1, 63))})
+        valpair = ('$LOOP{bands}_$LOOP{ccds:02}', {'x': 'y'})
+        with patch.object(w, 'search', wraps=w.search) as srch:
+            gen = rf.iter_replace_vars_loop(valpair, w)
+            (val, keep) = next(gen)
+            # only one value of bands expanded so far
+            self.assertEqual(srch.call_count, 2)
+        self.assertTrue(isinstance(keep, rf.KeepMap))
+        self.assertEqual(keep['x'], 'y')
+        self.assertEqual(val, f"{keep['bands']}_{int(keep['ccds']):02d}")
+
+        (vals, keeps) = rf.replace_vars_loop(valpair, w)
+        self.assertEqual([val] + [v for (v, _) in gen], vals)
+        self.assertEqual(len(vals), 124)
+
     def test_replace_vars_loop_pad(self):
         vals, keep = rf.replace_vars_loop(('$LOOP{ccds:02}',{}), self.fw)
         self.assertEqual(len(vals), 5)
@@ -392,6 +779,24 @@ class TestReplaceFuncs(unittest.TestCase):
 
         self.assertRaises(Exception, rf.replace_vars, '$FUNC{tester.infinite,1,2}', self.fw)
 
+    def test_replace_vars_cycle(self):
+        w = wcl.WCL({'a': '${b}', 'b': 'x${c}', 'c': '${a}',
+                     'la': '1,$LOOP{lb}', 'lb': '2,$LOOP{la}'})
+        with self.assertRaises(rf.VariableCycleError) as cm:
+            rf.replace_vars('${a}', w)
+        self.assertEqual(cm.exception.path, ['a', 'b', 'c', 'a'])
+
+        with self.assertRaises(rf.VariableCycleError) as cm:
+            rf.replace_vars('$FUNC{tester.infinite,1,2}', w)
+        self.assertEqual(len(cm.exception.path), 2)
+
+        self.assertRaises(rf.VariableCycleError, rf.replace_vars, '$LOOP{la}', w)
+
+        # deep acyclic chains are fine
+        chain = {f'd{i}': f'${{d{i + 1}}}' for i in range(150)}
+        chain['d150'] = 'end'
+        self.assertEqual(rf.replace_vars('${d0}', wcl.WCL(chain))[0], 'end')
+
     def test_replace_vars_loop(self):
         res, data = rf.replace_vars(self.fw['band_ccd'], self.fw)
         self.assertEqual(len(res), 5)
@@ -425,6 +830,49 @@ class TestWCL(unittest.TestCase):
         self.assertTrue(wclDiff(self.wcl_file, 'out.wcl', ignore_blank_lines=True))
         os.unlink('out.wcl')
 
+    def test_include_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outer = os.path.join(tmpdir, 'outer.wcl')
+            inner = os.path.join(tmpdir, 'inner.wcl')
+            with open(outer, 'w') as fh:
+                fh.write(f"<sect>\n    a = 1\n</sect>\n<<include {inner}>>\n")
+            def write_inner(val, mtime):
+                with open(inner, 'w') as fh:
+                    fh.write(f"b = {val}\n")
+                os.utime(inner, (mtime, mtime))
+            write_inner(2, 1000000)
+
+            def read_main():
+                w = wcl.WCL()
+                w.read(StringIO(f"<<include {outer}>>\nc = 3\n"))
+                return w
+
+            w = read_main()
+            self.assertEqual((w['sect']['a'], w['b'], w['c']), ('1', '2', '3'))
+            self.assertTrue((outer, False) in wcl.INCLUDE_CACHE)
+            w['sect']['a'] = 'changed'
+            reads = []
+            real_read = wcl.WCL.read
+            def counted_read(self, *args):
+                reads.append(args)
+                return real_read(self, *args)
+            with patch.object(wcl.WCL, 'read', counted_read):
+                self.assertEqual(read_main()['sect']['a'], '1')
+                self.assertEqual(len(reads), 1)
+
+                write_inner(4, 2000000)
+                self.assertEqual(read_main()['b'], '4')
+                self.assertEqual(len(reads), 4)
+
+            with open(inner, 'a') as fh:
+                fh.write("<<inclfunc collections.OrderedDict(c)>>\n")
+            read_main()
+            self.assertFalse((outer, False) in wcl.INCLUDE_CACHE)
+            self.assertFalse((inner, False) in wcl.INCLUDE_CACHE)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_set_search_order(self):
         w = wcl.WCL()
         srch_order = None
@@ -671,6 +1119,111 @@ class TestWCL(unittest.TestCase):
         self.assertTrue('$' in val2)
         self.assertFalse('$' in val)
 
+    def test_expand_all(self):
+        w = wcl.WCL()
+        with open(self.wcl_file, 'r') as infh:
+            w.read(infh, self.wcl_file)
+        snap = w.expand_all()
+        self.assertEqual(snap['ops_run_dir'], w.getfull('ops_run_dir'))
+        self.assertTrue('$' in w['ops_run_dir'])
+
+        w = wcl.WCL({'a': '${b}/x', 'b': '${c}', 'c': 'v', 'num': '7',
+                     'sect': {'f': '${a}_$opt{none}_${num:03}_${unk}'}})
+        snap = w.expand_all()
+        self.assertEqual(snap['sect']['f'], 'v/x__007_${unk}')
+        self.assertEqual(w['sect']['f'], '${a}_$opt{none}_${num:03}_${unk}')
+
+        w = wcl.WCL({'name': 'abc', 'f': '${name:03}_${name}', 'g': '${unk:02}'})
+        snap = w.expand_all()
+        self.assertEqual((snap['f'], snap['g']), ('${name:03}_abc', '${unk:02}'))
+
+        w = wcl.WCL({'a': '${b}', 'b': 'x${c}', 'c': '${a}'})
+        with self.assertRaises(rf.VariableCycleError) as cm:
+            w.expand_all()
+        self.assertEqual(cm.exception.path, ['b', 'c', 'a', 'b'])
+
+    def test_eval_funcs(self):
+        w = wcl.WCL({'a': '2', 'f': '$FUNC{tester.add,1,${a}}',
+                     'sect': {'g': 'x_$FUNC{tester.add,3,4}'}, 'bad': '$FUNC{tester.add,${none}}',
+                     'other': {'h': '${f}'}})
+        opts = {intgdefs.FUNC_WORKERS: 2}
+        try:
+            # only calls in the given sections, including through variables
+            self.assertEqual(w.eval_funcs(opts, ['sect']), {'tester.add,3,4': 7})
+            self.assertEqual(w.eval_funcs(opts, ['other', 'missing']), {'tester.add,1,2': 3})
+
+            with patch('intgutils.replace_funcs.eval_funcs', wraps=rf.eval_funcs) as evalf:
+                funcvals = w.eval_funcs(opts)
+                self.assertEqual(funcvals, {'tester.add,1,2': 3, 'tester.add,3,4': 7})
+                opts[intgdefs.FUNC_VALUES] = funcvals
+                self.assertEqual(rf.replace_vars(w['f'], w, dict(opts))[0], '3')
+                self.assertEqual(evalf.call_count, 1)
+
+                del w['bad']
+                snap = w.expand_all({intgdefs.FUNC_WORKERS: 2})
+                self.assertEqual((snap['f'], snap['sect']['g']), ('3', 'x_7'))
+                self.assertEqual(evalf.call_count, 2)
+        finally:
+            rf.shutdown_func_pool()
+
+    def test_getfull_cached(self):
+        w = wcl.WCL({'band': 'g', 'current': OrderedDict(), 'other': 'o',
+                     'f': 'a_${band}', 'h': '${other}'})
+        self.assertEqual(w.getfull_cached('f'), 'a_g')
+        self.assertEqual(w.getfull_cached('h'), 'o')
+
+        w.set('other', 'p')
+        self.assertEqual(len(w._expansions), 1)
+        self.assertEqual(w.getfull_cached('h'), 'p')
+
+        self.assertEqual(w.getfull_cached('f', {'currentvals': {'band': 'r'}}), 'a_r')
+        self.assertEqual(w.getfull_cached('f', {'currentvals': {'band': 'i'}}), 'a_i')
+
+        w.set('current.band', 'z')
+        self.assertEqual(w.getfull_cached('f'), 'a_z')
+        self.assertEqual(w.getfull_cached('f'), w.getfull('f'))
+
+        w.invalidate_expansions()
+        self.assertEqual(len(w._expansions), 0)
+
+    def test_getfull_reexpands_dependents(self):
+        w = wcl.WCL({'band': 'g', 'current': OrderedDict(), 'other': 'o', 'ccd': '1',
+                     'f': 'a_${band}_${ccd:02}', 'h': '${other}', 'x': '$FUNC{tester.add,1,2}'})
+        with patch.object(w, '_replace_vars', wraps=w._replace_vars) as repl:
+            for band in ['g', 'r', 'r']:
+                opts = {'currentvals': {'band': band}}
+                self.assertEqual(w.getfull_cached('f', opts), f'a_{band}_01')
+                self.assertEqual(w.getfull_cached('h', opts), 'o')
+            self.assertEqual([c[0][0] for c in repl.call_args_list],
+                             ['a_${band}_${ccd:02}', '${other}', 'a_${band}_${ccd:02}'])
+
+            # changes made directly to the current section are seen too
+            w['current']['band'] = 'i'
+            self.assertEqual(w.getfull_cached('f'), 'a_i_01')
+            w['current']['ccd'] = '5'
+            self.assertEqual(w.getfull_cached('f'), 'a_i_05')
+            self.assertEqual(w.getfull_cached('h'), 'o')
+            self.assertEqual(repl.call_count, 5)
+
+            self.assertEqual(w.getfull_cached('x'), '3')
+            self.assertEqual(w.getfull_cached('x'), '3')
+            self.assertEqual(repl.call_count, 7)
+
+    def test_getfull_nested_write(self):
+        w = wcl.WCL({'module': {'m': {'c': '9'}}, 'current': OrderedDict({'curr_module': 'm'}),
+                     'a': 'x${c:2}_x${c:2}'})
+        w.set_search_order(['module'])
+        self.assertEqual(w.getfull('a'), 'x09_x09')
+        self.assertEqual(w.getfull_cached('a'), 'x09_x09')
+
+        # nested sections are plain dicts, so only getfull sees the write
+        w['module']['m']['c'] = '3'
+        self.assertEqual(w.getfull('a'), 'x03_x03')
+        self.assertEqual(w.getfull('a'), rf.replace_vars(w['a'], w)[0])
+        w.invalidate_expansions()
+        self.assertEqual(w.getfull_cached('a'), 'x03_x03')
+
+
 class TestQueryUtils(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -979,6 +1532,67 @@ port    =   0
                                                              'two': {'file00004': 'fourth.file'}}}}}}
         self.assertRaises(Exception, iqu.output_lines, 'blah.xml', expected, 'txt')
 
+class TestVersionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.execname = os.path.join(self.tmpdir, 'myexec')
+        self.nwrites = 0
+        self.write_exec('1.2.3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_exec(self, version):
+        with open(self.execname, 'w') as fh:
+            fh.write(f"#!/bin/sh\necho myexec version {version}\n")
+        os.chmod(self.execname, 0o755)
+        # differ even on file systems with coarse timestamps
+        self.nwrites += 1
+        mtime = time.time() + self.nwrites
+        os.utime(self.execname, (mtime, mtime))
+
+    def test_lookup_store(self):
+        cache = ivc.VersionCache(os.path.join(self.tmpdir, 'cache', 'versions.json'))
+        self.assertIsNone(ivc.get_exec_key(os.path.join(self.tmpdir, 'nosuchexec'), '-V', 'x'))
+        key = ivc.get_exec_key(self.execname, '--version', r'version (\S+)')
+        self.assertIsNone(cache.lookup(key))
+        cache.store(key, '1.2.3')
+        self.assertEqual(cache.lookup(key), '1.2.3')
+        otherkey = ivc.get_exec_key(self.execname, '-V', r'version (\S+)')
+        self.assertIsNone(cache.lookup(otherkey))
+        cache.store(otherkey, '1.2.3')
+
+        self.write_exec('1.2.4')
+        newkey = ivc.get_exec_key(self.execname, '--version', r'version (\S+)')
+        self.assertNotEqual(key, newkey)
+        self.assertIsNone(cache.lookup(newkey))
+        cache.store(newkey, '1.2.4')
+        self.assertEqual(list(cache.read()), [newkey])
+        self.assertIsNone(ivc.VersionCache(cache.filename, refresh=True).lookup(newkey))
+
+        with open(cache.filename, 'w') as fh:
+            fh.write('{"trunc')
+        with capture_output():
+            self.assertIsNone(cache.lookup(newkey))
+            cache.store(newkey, '1.2.4')
+        self.assertEqual(cache.lookup(newkey), '1.2.4')
+
+    def test_save_exec_version(self):
+        wclfile = os.path.join(self.tmpdir, 'wrap.wcl')
+        with open(wclfile, 'w') as fh:
+            fh.write(f"<wrapper>\n    version_cache = {self.tmpdir}/versions.json\n</wrapper>\n")
+        exwcl = {'execname': self.execname, 'version_flag': '--version',
+                 'version_pattern': r'version (\S+)'}
+        for _ in range(2):
+            wrap = bwr.BasicWrapper(wclfile)
+            wrap.curr_exec = {'task_info': {}}
+            with patch.object(wrap, 'get_exec_version', wraps=wrap.get_exec_version) as ptch:
+                wrap.save_exec_version(exwcl)
+            self.assertEqual(wrap.curr_exec['version'], '1.2.3')
+            self.assertEqual(wrap.curr_exec['task_info']['save_exec_version']['status'], 0)
+        self.assertEqual(ptch.call_count, 0)
+
+
 class TestBasicWrapper(unittest.TestCase):
     wcl_file = os.path.join(ROOT, 'wcl/wrappertest.wcl')
     listfile = 'list/mangle/DES2157-5248_r15p03_g_mangle-out.list'
@@ -1180,6 +1794,27 @@ mangle/g/TEST_DATA_r15p03_g_maglims.pol[0]
         self.mkfiles(True)
         self.wr.check_inputs(ekey)
 
+    def test_check_files_timeout(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            wclfile = os.path.join(tmpdir, 'wrap.wcl')
+            with open(wclfile, 'w') as fh:
+                fh.write("<wrapper>\n    stat_timeout = 0.1\n</wrapper>\n")
+            wrap = bwr.BasicWrapper(wclfile)
+            found = igm.FileStat(True, 0, 0)
+            # timed out stats are tried again, and not reported missing if still unknown
+            with patch('intgutils.intgmisc.stat_files',
+                       side_effect=[{'a': igm.STAT_TIMED_OUT, 'b': found}, {'a': found}]) as ptch, \
+                 capture_output():
+                self.assertEqual(wrap.check_files(['a', 'b']), (['a', 'b'], []))
+            self.assertEqual(ptch.call_args[0][0], ['a'])
+            with patch('intgutils.intgmisc.stat_files', return_value={'a': igm.STAT_TIMED_OUT}), \
+                 capture_output() as (out, _):
+                self.assertRaises(TimeoutError, wrap.check_files, ['a'])
+            self.assertTrue("could not stat 'a'" in out.getvalue())
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_check_command_line(self):
         self.wr.outputwcl['wrapper']['start_time'] = time.time()
         execs = igm.get_exec_sections(self.wr.inputwcl, intgdefs.IW_EXEC_PREFIX)
@@ -1354,6 +1989,161 @@ mangle/g/TEST_DATA_r15p03_g_maglims.pol[0]
         del iw_exec['was_generated_by']
         self.wr.create_output_dirs(iw_exec)
 
+    def test_io_manifest(self):
+        self.mkfiles(True)
+        self.writeLists()
+        self.wr.outputwcl['wrapper']['start_time'] = time.time()
+        execs = igm.get_exec_sections(self.wr.inputwcl, intgdefs.IW_EXEC_PREFIX)
+        ekey = list(execs.keys())[0]
+        iw_exec = list(execs.values())[0]
+        iw_exec['was_generated_by'] = 'filespecs.polygons,list.out.red_immask_test'
+        ow_exec = {'task_info': {}}
+        self.wr.outputwcl[ekey] = ow_exec
+        self.wr.curr_exec = ow_exec
+        with patch('intgutils.intgmisc.get_fullnames', wraps=igm.get_fullnames) as ptch:
+            self.wr.check_inputs(ekey)
+            self.wr.create_output_dirs(iw_exec, ekey)
+            self.assertEqual(ptch.call_count, 2)
+            (ins, outs) = self.wr.get_io_manifest(ekey)
+            self.assertEqual(ptch.call_count, 2)
+
+            with patch.object(self.wr, 'run_exec'):
+                self.wr.run_exec_section(ekey, iw_exec)
+            self.assertTrue(self.wr.get_io_manifest(ekey, get_outputs=False)[0] is ins)
+            self.assertEqual(ptch.call_count, 2)
+            self.wr.check_outputs(ekey, 0)
+            self.assertEqual(ptch.call_count, 3)
+        self.assertEqual((ins, outs), igm.get_fullnames(self.wr.inputwcl, self.wr.inputwcl, ekey))
+
+    def test_transform_outputs_manifest(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            wclfile = os.path.join(tmpdir, 'wrap.wcl')
+            with open(wclfile, 'w') as fh:
+                fh.write(f"<filespecs>\n    <out>\n        fullname = {tmpdir}/a.fits\n"
+                         "    </out>\n</filespecs>\n"
+                         "<exec_1>\n    execname = true\n    was_generated_by = filespecs.out\n</exec_1>\n")
+
+            class RenameWrapper(bwr.BasicWrapper):
+                def transform_outputs(self, exwcl):
+                    bwr.BasicWrapper.transform_outputs(self, exwcl)
+                    self.inputwcl['filespecs']['out']['fullname'] = f'{tmpdir}/b.fits'
+
+            wrap = RenameWrapper(wclfile)
+            wrap.curr_exec = {'task_info': {}}
+            wrap.create_output_dirs(wrap.inputwcl['exec_1'], 'exec_1')
+            open(os.path.join(tmpdir, 'b.fits'), 'w').close()
+            with patch.object(wrap, 'run_exec'):
+                wrap.run_exec_section('exec_1', wrap.inputwcl['exec_1'])
+            self.assertEqual(wrap.check_outputs('exec_1', 0), {'filespecs.out': [f'{tmpdir}/b.fits']})
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_run_execs_parallel(self):
+        execs = OrderedDict((f'exec_{i}', {}) for i in range(1, 5))
+        fullnames = {
+            'exec_1': ({'a': ['in/a.fits']}, {'b': ['out/b.fits']}),
+            'exec_2': ({'a': ['in/a.fits']}, {'c': ['out/c.fits']}),
+            'exec_3': ({'b': ['out/b.fits']}, {'d': ['out/d.fits']}),
+            'exec_4': ({'e': ['in/e.fits']}, {'a': ['in/a.fits']})}
+        self.wr.invalidate_io_manifest()
+        with patch('intgutils.basic_wrapper.intgmisc.get_fullnames',
+                   side_effect=lambda modwcl, fullwcl, ekey, **kwargs: fullnames[ekey]):
+            depends = self.wr.get_exec_dependencies(execs)
+        self.assertEqual(dict(depends), {'exec_1': [], 'exec_2': [], 'exec_3': ['exec_1'],
+                                         'exec_4': ['exec_1', 'exec_2']})
+        # manifests are resolved by each exec after its transform_inputs
+        self.assertEqual(self.wr.io_manifest, {})
+
+        events = []
+        def prepare(ekey, iw_exec):
+            events.append(('prepare', ekey))
+            self.wr.curr_exec['ekey'] = ekey
+            return {}
+        def run_section(ekey, iw_exec):
+            time.sleep(0.2 if ekey == 'exec_1' else 0)
+            self.assertEqual(self.wr.curr_exec['ekey'], ekey)
+            self.wr.curr_exec['status'] = 0
+            events.append(('run', ekey))
+        def finish(ekey, iw_exec, inputs):
+            self.assertEqual(self.wr.curr_exec['ekey'], ekey)
+            events.append(('finish', ekey))
+
+        with patch.object(self.wr, 'get_exec_dependencies', return_value=depends), \
+             patch.object(self.wr, 'prepare_exec', side_effect=prepare), \
+             patch.object(self.wr, 'run_exec_section', side_effect=run_section), \
+             patch.object(self.wr, 'finish_exec', side_effect=finish):
+            self.wr.run_execs_parallel(execs, 4)
+        self.assertEqual([ekey for (step, ekey) in events if step == 'finish'], list(execs))
+        self.assertLess(events.index(('run', 'exec_2')), events.index(('run', 'exec_1')))
+        self.assertLess(events.index(('run', 'exec_1')), events.index(('prepare', 'exec_3')))
+        self.assertEqual([key for key in self.wr.outputwcl if key.startswith('exec_')], list(execs))
+
+    def test_func_workers(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            wclfile = os.path.join(tmpdir, 'wrap.wcl')
+            with open(wclfile, 'w') as fh:
+                fh.write("<wrapper>\n    func_workers = 2\n</wrapper>\n"
+                         "<exec_1>\n    execname = echo\n    <cmdline>\n"
+                         "        _01 = $FUNC{tester.add,1,2}\n        _02 = $FUNC{tester.add,3,4}\n"
+                         "    </cmdline>\n</exec_1>\n"
+                         "<unused>\n    f = $FUNC{tester.slow,30}\n</unused>\n")
+            wrap = bwr.BasicWrapper(wclfile)
+            execs = igm.get_exec_sections(wrap.inputwcl, intgdefs.IW_EXEC_PREFIX)
+            with patch('intgutils.replace_funcs.eval_funcs', wraps=rf.eval_funcs) as evalf:
+                wrap.eval_funcs(execs)
+                self.assertEqual(set(evalf.call_args[0][0]), {'tester.add,1,2', 'tester.add,3,4'})
+                wrap.curr_exec = {'task_info': {}}
+                wrap.create_command_line('exec_1', wrap.inputwcl['exec_1'])
+            self.assertEqual(wrap.curr_exec['cmdline'], 'echo 3 7')
+            self.assertEqual(evalf.call_count, 1)
+        finally:
+            rf.shutdown_func_pool()
+            shutil.rmtree(tmpdir)
+
+    def test_prepare_exec_async(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            wclfile = os.path.join(tmpdir, 'wrap.wcl')
+            with open(wclfile, 'w') as fh:
+                fh.write("<wrapper>\n    async_prepare = true\n</wrapper>\n")
+                for num in (1, 2):
+                    fh.write(f"<exec_{num}>\n    execname = {sys.executable}\n"
+                             "    version_flag = --version\n    version_pattern = Python (\\S+)\n"
+                             "    <cmdline>\n        _01 = -c pass\n    </cmdline>\n"
+                             f"</exec_{num}>\n")
+            wrap = bwr.BasicWrapper(wclfile)
+            execs = igm.get_exec_sections(wrap.inputwcl, intgdefs.IW_EXEC_PREFIX)
+            with patch.object(wrap, 'get_exec_version', wraps=wrap.get_exec_version) as ptch:
+                wrap.prefetch_exec_versions(execs)
+                for ekey, iw_exec in execs.items():
+                    wrap.curr_exec = {'task_info': {}}
+                    with capture_output():
+                        self.assertEqual(wrap.prepare_exec(ekey, iw_exec), {})
+                    self.assertEqual(list(wrap.curr_exec['task_info']),
+                                     ['transform_inputs', 'check_inputs', 'check_command_line',
+                                      'save_exec_version', 'create_command_line',
+                                      'create_output_dirs'])
+                    for task in wrap.curr_exec['task_info'].values():
+                        self.assertEqual(task['status'], 0)
+                        self.assertLessEqual(task['start_time'], task['end_time'])
+                    self.assertEqual(wrap.curr_exec['version'], sys.version.split()[0])
+                    self.assertTrue('cmdline' in wrap.curr_exec)
+                self.assertEqual(ptch.call_count, 1)
+            self.assertEqual(wrap.curr_task, [])
+
+            # no output directories are made if inputs are missing
+            wrap.curr_exec = {'task_info': {}}
+            with patch.object(wrap, 'check_inputs', side_effect=SystemExit(3)), \
+                 patch.object(wrap, 'create_output_dirs') as mkdirs, capture_output():
+                self.assertRaises(SystemExit, wrap.prepare_exec, 'exec_1', execs['exec_1'])
+            self.assertEqual(mkdirs.call_count, 0)
+            wrap.stop_prepare_pool()
+            self.assertIsNone(wrap.prepare_pool)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_run_exec(self):
         self.wr.outputwcl['wrapper']['start_time'] = time.time()
         execs = igm.get_exec_sections(self.wr.inputwcl, intgdefs.IW_EXEC_PREFIX)
@@ -1378,6 +2168,12 @@ mangle/g/TEST_DATA_r15p03_g_maglims.pol[0]
         with patch('intgutils.basic_wrapper.intgmisc.run_exec', side_effect=OSError(errno.ENOENT, 'msg')):
             self.assertRaises(OSError, self.wr.run_exec)
 
+        # limits may use variables like other exec values
+        self.wr.inputwcl['wrapper']['walllimit'] = '30'
+        with patch('intgutils.basic_wrapper.intgmisc.run_exec', return_value=(0, {})) as ptch:
+            self.wr.run_exec({'max_walltime': '${wrapper.walllimit}'})
+        self.assertEqual(ptch.call_args[0][2], {'max_walltime': 30.0})
+
 
     def test_transform_outputs(self):
         self.wr.outputwcl['wrapper']['start_time'] = time.time()
@@ -1625,7 +2421,140 @@ mangle/g/TEST_DATA_r15p03_g_maglims.pol[0]
         self.assertTrue('end_time' in self.wr.outputwcl['wrapper'])
         self.assertTrue(self.wr.outputwcl['wrapper']['end_time'] > 0.0)
 
+class TestWrapperService(unittest.TestCase):
+    def test_service(self):
+        tmpdir = tempfile.mkdtemp()
+        sockpath = os.path.join(tmpdir, 'sock')
+        service = iws.WrapperService(sockpath, 2)
+        server = multiprocessing.get_context('fork').Process(target=service.serve_forever)
+        with capture_output():
+            server.start()
+        try:
+            inputwcls = []
+            for (num, execname) in enumerate(['true', 'false']):
+                inputwcls.append(os.path.join(tmpdir, f'in{num}.wcl'))
+                with open(inputwcls[-1], 'w') as fh:
+                    fh.write(f"<wrapper>\n    outputwcl = out{num}.wcl\n</wrapper>\n"
+                             f"<exec_1>\n    execname = {execname}\n</exec_1>\n")
+            for _ in range(100):
+                if os.path.exists(sockpath):
+                    break
+                time.sleep(0.05)
+
+            # a client which never sends its request does not hold up others
+            stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stalled.connect(sockpath)
+            cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                start = time.time()
+                with open('client.log', 'w') as logfh:
+                    stdfds = (0, logfh.fileno(), logfh.fileno())
+                    self.assertEqual([iws.run_client(sockpath, inputwcl, stdfds) for inputwcl in inputwcls
+                                      + [os.path.join(tmpdir, 'missing.wcl')]], [0, 1, 1])
+                self.assertLess(time.time() - start, iws.REQUEST_TIMEOUT)
+            finally:
+                os.chdir(cwd)
+                stalled.close()
+            for num in range(2):
+                self.assertTrue(os.path.exists(os.path.join(tmpdir, f'out{num}.wcl')))
+            with open(os.path.join(tmpdir, 'client.log')) as logfh:
+                self.assertTrue('exit status = 1' in logfh.read())
+            self.assertEqual(stat.S_IMODE(os.stat(sockpath).st_mode), 0o600)
+        finally:
+            os.kill(server.pid, signal.SIGTERM)
+            server.join(10)
+            self.assertEqual(server.exitcode, 0)
+            self.assertFalse(os.path.exists(sockpath))
+            shutil.rmtree(tmpdir)
+
+    def test_reject_other_user(self):
+        tmpdir = tempfile.mkdtemp()
+        sockpath = os.path.join(tmpdir, 'sock')
+        service = iws.WrapperService(sockpath, 1)
+        service.uid = os.getuid() + 1    # as if the server were run by another user
+        server = multiprocessing.get_context('fork').Process(target=service.serve_forever)
+        with capture_output():
+            server.start()
+        try:
+            inputwcl = os.path.join(tmpdir, 'in.wcl')
+            with open(inputwcl, 'w') as fh:
+                fh.write(f"<wrapper>\n    outputwcl = {tmpdir}/out.wcl\n</wrapper>\n"
+                         "<exec_1>\n    execname = true\n</exec_1>\n")
+            for _ in range(100):
+                if os.path.exists(sockpath):
+                    break
+                time.sleep(0.05)
+
+            with capture_output() as (_, err):
+                self.assertEqual(iws.run_client(sockpath, inputwcl), 1)
+            self.assertTrue('did not return a status' in err.getvalue())
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, 'out.wcl')))
+        finally:
+            os.kill(server.pid, signal.SIGTERM)
+            server.join(10)
+            self.assertEqual(server.exitcode, 0)
+            shutil.rmtree(tmpdir)
+
+
 class TestGenWrap(unittest.TestCase):
+    def test_genwrap_batch(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inputwcls = []
+            for (num, execname) in enumerate(['true', 'false', 'true']):
+                inputwcls.append(os.path.join(tmpdir, f'in{num}.wcl'))
+                with open(inputwcls[-1], 'w') as fh:
+                    fh.write(f"<wrapper>\n    outputwcl = {tmpdir}/out{num}.wcl\n</wrapper>\n"
+                             f"<exec_1>\n    execname = {execname}\n</exec_1>\n")
+            inputwcls.insert(1, os.path.join(tmpdir, 'missing.wcl'))
+            manifest = os.path.join(tmpdir, 'manifest')
+            with open(manifest, 'w') as fh:
+                fh.write('# inputs\n\n' + '\n'.join(inputwcls[1:]) + '\n')
+            self.assertEqual(gwr.read_manifest(manifest), inputwcls[1:])
+
+            for workers in (1, 3):
+                with capture_output():
+                    self.assertEqual(gwr.run_batch(inputwcls, workers), [0, 1, 1, 0])
+                for num in range(3):
+                    self.assertTrue(os.path.exists(os.path.join(tmpdir, f'out{num}.wcl')))
+                    os.unlink(os.path.join(tmpdir, f'out{num}.wcl'))
+
+            # a wrapper killed outright is reported as failed, not waited for forever
+            killer = os.path.join(tmpdir, 'killer.py')
+            with open(killer, 'w') as fh:
+                fh.write("import os, signal\nos.kill(os.getppid(), signal.SIGKILL)\n")
+            killwcl = os.path.join(tmpdir, 'killed.wcl')
+            with open(killwcl, 'w') as fh:
+                fh.write(f"<wrapper>\n    outputwcl = {tmpdir}/killed_out.wcl\n</wrapper>\n"
+                         f"<exec_1>\n    execname = {sys.executable}\n"
+                         f"    <cmdline>\n        _01 = {killer}\n    </cmdline>\n</exec_1>\n")
+            for workers in (1, 2):
+                with capture_output() as (_, err):
+                    self.assertEqual(gwr.run_batch([inputwcls[0], killwcl, inputwcls[3]], workers),
+                                     [0, 128 + signal.SIGKILL, 0])
+                self.assertTrue(f"wrapper for {killwcl} killed by signal" in err.getvalue())
+                self.assertFalse(os.path.exists(os.path.join(tmpdir, 'killed_out.wcl')))
+
+            # sys.exit() without a status is success
+            for (code, status) in [(None, 0), (4, 4), ('failed', 1)]:
+                with patch('intgutils.basic_wrapper.BasicWrapper.run_wrapper',
+                           side_effect=SystemExit(code)), capture_output():
+                    self.assertEqual(bwr.run_wrapper_file(inputwcls[0]), status)
+
+            temp = copy.deepcopy(sys.argv)
+            try:
+                sys.argv = ['genwrap.py', inputwcls[0], '--manifest', manifest, '--workers', '2']
+                with capture_output() as (out, _):
+                    with self.assertRaises(SystemExit) as cm:
+                        gwr.main()
+                self.assertEqual(cm.exception.code, 1)
+                self.assertTrue(f"genwrap: {inputwcls[1]} exit status = 1" in out.getvalue())
+            finally:
+                sys.argv = temp
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_genwrap(self):
         out_wcl = 'outputwcl/mangle/DES2157-5248_r15p03_g_mangle_output.wcl'
         listfile = 'list/mangle/DES2157-5248_r15p03_g_mangle-out.list'
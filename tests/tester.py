@@ -1,3 +1,5 @@
+import time
+
 def add(data):
     mysum = 0
     for num in data:
@@ -8,6 +10,11 @@ def infinite(data):
     return "$FUNC{tester.infinite,1,2}"
 
 
+def slow(data):
+    time.sleep(float(data[0]))
+    return data[0]
+
+
 def convert(data):
     num = int(data['start_val'])
     return {data['start_name']: str(num * 2)}